@@ -0,0 +1,244 @@
+# File: async_runtime.py
+
+import asyncio
+import queue
+import threading
+import time
+from discovery_service import (DiscoveryService, DatagramReceiver, create_discovery_socket, describe_transport,
+                               DISCOVERY_BATCH)
+from metrics import Metrics
+from server import _Connection, _ServerContext, _receive_data
+
+"""
+@file async_runtime.py
+@brief Einprozess-Laufzeit (main.py --runtime asyncio):
+
+- Discovery-Service und TCP-Server laufen als asyncio-Protokolle auf einer gemeinsamen
+  Ereignisschleife in einem Hintergrund-Thread des Hauptprozesses. Es werden keine
+  zusätzlichen Prozesse gestartet und keine Ereignisse zwischen Prozessen serialisiert.
+- Die Protokolllogik ist dieselbe wie im Mehrprozess-Betrieb (DiscoveryService aus
+  discovery_service, Verbindungsverarbeitung aus server).
+- Der Discovery-Socket wird wie in discovery_loop in Stapeln geleert (loop.add_reader statt eines
+  Datagramm-Transports, der jedes Datagramm einzeln zustellen würde).
+- CLI bzw. GUI bekommen dieselben vier Queues wie bisher: net_to_interface und
+  disc_to_interface sind einfache queue.Queue-Objekte im selben Prozess; Anfragen an
+  interface_to_net und interface_to_disc werden direkt auf der Ereignisschleife ausgeführt.
+- Gesendet wird weiterhin über die Funktionen aus client.py im Thread der Oberfläche.
+"""
+
+# Sekunden zwischen zwei Durchläufen der regelmäßigen Aufgaben (Heartbeat, Deadlines, Metriken)
+TICK_INTERVAL = 0.5
+
+
+class _LoopInbox:
+    """Queue-artiges Objekt, dessen put() den Handler auf der Ereignisschleife aufruft."""
+
+    def __init__(self, loop, handler):
+        self.loop = loop
+        self.handler = handler
+
+    def put(self, item):
+        self.loop.call_soon_threadsafe(self.handler, item)
+
+
+class _TransportSocket:
+    """Stellt für _Connection das benötigte send() eines Sockets über einen asyncio-Transport bereit."""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def send(self, data):
+        self.transport.write(data)
+        return len(data)
+
+
+class _ServerProtocol(asyncio.Protocol):
+    """Eine eingehende TCP-Verbindung; verarbeitet die Daten wie server_loop."""
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+        self.transport = None
+        self.conn = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.conn = _Connection(_TransportSocket(transport), transport.get_extra_info('peername'))
+        self.runtime.connections.add(self)
+        self.runtime.server_ctx.metrics.inc('connections_accepted')
+
+    def data_received(self, data):
+        if _receive_data(self.conn, self.runtime.server_ctx, data):
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        # Abgebrochene Bildübertragungen werden nicht als (defektes) Bild gespeichert
+        self.conn.abort_transfer(self.runtime.server_ctx)
+        self.runtime.connections.discard(self)
+
+
+class AsyncRuntime:
+    """Betreibt Discovery-Service und TCP-Server auf einer asyncio-Schleife im Hintergrund-Thread."""
+
+    def __init__(self, config):
+        self.config = config
+        # Ereignisse an die Oberfläche (gleiches Format wie im Mehrprozess-Betrieb)
+        self.net_to_interface = queue.Queue()
+        self.disc_to_interface = queue.Queue()
+        self.loop = asyncio.new_event_loop()
+        # Anfragen der Oberfläche werden direkt auf der Ereignisschleife bearbeitet
+        self.interface_to_net = _LoopInbox(self.loop, self._handle_net_request)
+        self.interface_to_disc = _LoopInbox(self.loop, self._handle_disc_request)
+        # Eigene Metriken für Server und Discovery, damit sie wie im Mehrprozess-Betrieb
+        # getrennt von denen der Oberfläche gemeldet werden
+        self.server_ctx = _ServerContext(config, self.net_to_interface, Metrics())
+        self.server_ctx.call_soon = self._server_call_soon
+        self.discovery = DiscoveryService(config, self.disc_to_interface, self._send_datagram, Metrics())
+        # Offene Verbindungen (_ServerProtocol) für Deadlines und Metriken
+        self.connections = set()
+        self._server = None
+        # Port, auf den der Server zuletzt gebunden wurde (wie current_port in server_loop)
+        self._port = None
+        # Discovery-Socket und der Leser, der ihn in Stapeln leert
+        self._disc_sock = None
+        self._disc_receiver = None
+        # Zeitgeber (asyncio.TimerHandle) für die eingeplante KNOWUSERS-Antwort
+        self._response_timer = None
+        # Task der regelmäßigen Aufgaben (wird beim Beenden abgebrochen)
+        self._tick_task = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    def queues(self):
+        """Liefert (net_to_interface, disc_to_interface, interface_to_net, interface_to_disc) für CLI/GUI."""
+        return self.net_to_interface, self.disc_to_interface, self.interface_to_net, self.interface_to_disc
+
+    def start(self):
+        """Startet die Ereignisschleife und wartet, bis Server und Discovery bereit sind."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self, timeout=2):
+        """
+        Schließt Server, Discovery-Socket und offene Verbindungen, beendet die Ereignisschleife
+        und wartet bis zu timeout Sekunden auf den Hintergrund-Thread.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.loop.call_soon_threadsafe(self._shutdown)
+        self._thread.join(timeout)
+
+    def _shutdown(self):
+        """Gibt alle Ressourcen der Schleife frei und hält sie an (läuft auf der Ereignisschleife)."""
+        if self._tick_task is not None:
+            self._tick_task.cancel()
+        if self._response_timer is not None:
+            self._response_timer.cancel()
+            self._response_timer = None
+        if self._disc_sock is not None:
+            self.loop.remove_reader(self._disc_sock)
+            self._disc_sock.close()
+        if self._server is not None:
+            self._server.close()
+        # connection_lost verwirft dabei laufende Bildübertragungen wie bei einem Abbruch
+        for protocol in list(self.connections):
+            protocol.transport.close()
+        self.loop.stop()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._setup())
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+            # Abgebrochene Tasks und connection_lost der geschlossenen Verbindungen noch abarbeiten
+            pending = asyncio.all_tasks(self.loop)
+            if pending:
+                self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            if self._server is not None:
+                self.loop.run_until_complete(self._server.wait_closed())
+        finally:
+            self.loop.close()
+
+    async def _setup(self):
+        await self._bind_server(self.config['port'])
+        self._disc_sock = create_discovery_socket(self.config)
+        self._disc_receiver = DatagramReceiver(
+            self._disc_sock, self.config.get('discovery_batch', DISCOVERY_BATCH), self.discovery.metrics)
+        self.loop.add_reader(self._disc_sock, self._discovery_readable)
+        print(f"[Discovery] Service gestartet auf Port {self.config['whoisport']} ({describe_transport(self.config)})")
+        self._tick_task = self.loop.create_task(self._tick())
+
+    async def _bind_server(self, port):
+        """Öffnet den TCP-Server auf dem angegebenen Port (0 = vom System gewählt)."""
+        self._server = await self.loop.create_server(
+            lambda: _ServerProtocol(self), host="", port=port, reuse_address=True)
+        self._port = port
+
+    def _server_call_soon(self, conn, fn):
+        """Ergebnisse aus dem Worker-Pool des Servers auf der Ereignisschleife übernehmen (thread-sicher)."""
+        self.loop.call_soon_threadsafe(self._run_server_callback, conn, fn)
+
+    @staticmethod
+    def _run_server_callback(conn, fn):
+        if fn():
+            conn.sock.transport.close()
+
+    def _send_datagram(self, data, target):
+        self._disc_sock.sendto(data, target)
+
+    def _discovery_readable(self):
+        """Liest alle anstehenden Discovery-Datagramme und verarbeitet sie als einen Stapel."""
+        datagrams = self._disc_receiver.receive_batch()
+        if datagrams:
+            self.discovery.handle_batch(datagrams, time.monotonic())
+            self._schedule_response()
+
+    def _schedule_response(self):
+        """Weckt die Schleife genau zur eingeplanten Antwort des DiscoveryService (statt erst im nächsten Tick)."""
+        if self.discovery.response_due is not None and self._response_timer is None:
+            delay = self.discovery.next_timeout(time.monotonic(), TICK_INTERVAL)
+            self._response_timer = self.loop.call_later(delay, self._respond)
+
+    def _respond(self):
+        self._response_timer = None
+        self.discovery.respond_due(time.monotonic())
+        self._schedule_response()
+
+    def _handle_net_request(self, request):
+        """Anfragen an den Server; wie server_loop wird nur SET_PORT unterstützt."""
+        if request[0] == 'SET_PORT':
+            new_port = int(request[1])
+            if new_port != self._port:
+                self.loop.create_task(self._rebind(new_port))
+
+    async def _rebind(self, port):
+        """Schließt den Listen-Socket und öffnet ihn auf dem neuen Port (bestehende Verbindungen bleiben)."""
+        self._server.close()
+        self._port = None
+        await self._bind_server(port)
+
+    def _handle_disc_request(self, request):
+        self.discovery.handle_request(request)
+
+    async def _tick(self):
+        """Regelmäßige Aufgaben von Discovery und Server."""
+        while True:
+            await asyncio.sleep(TICK_INTERVAL)
+            now = time.monotonic()
+            self.discovery.tick(now)
+            # Auch ohne Datagramm können abgelaufene Peers die Liste verändert haben
+            self.discovery.publish_changes()
+            # Verbindungen schließen, deren Lese-Deadline bzw. Leerlaufzeit abgelaufen ist
+            for protocol in [p for p in self.connections if p.conn.expired(now, self.server_ctx)]:
+                self.server_ctx.metrics.inc('connections_expired')
+                protocol.transport.close()
+            self.server_ctx.publish_stats(len(self.connections))
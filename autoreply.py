@@ -0,0 +1,68 @@
+# File: autoreply.py
+
+from metrics import REGISTRY
+
+"""
+@file autoreply.py
+@brief Gemeinsame Auto-Reply-Logik für CLI und GUI mit Schutz vor Antwortstürmen.
+
+- Jede Auto-Reply beginnt mit AUTOREPLY_MARKER. Auf Nachrichten mit dieser Markierung wird
+  nie automatisch geantwortet, sodass zwei abwesende Clients sich nicht endlos antworten.
+- Pro Peer gibt es einen Token-Bucket: höchstens config['autoreply_burst'] Antworten am Stück,
+  danach eine weitere pro config['autoreply_interval'] Sekunden. Mit jeder neuen Abwesenheit
+  (neuer Zeitpunkt der letzten Nutzeraktivität) werden alle Buckets wieder aufgefüllt.
+  Ein abwesender Client erzeugt so O(Peers) statt O(Nachrichten) Antworten.
+- Unterdrückte Antworten werden als 'autoreplies_suppressed' gezählt.
+"""
+
+# Präfix, an dem Auto-Replies erkannt werden (auch von anderen Clients dieses Projekts)
+AUTOREPLY_MARKER = "[Auto-Reply] "
+# Standardwert: Anzahl Auto-Replies, die ein Peer pro Abwesenheit sofort erhalten kann
+AUTOREPLY_BURST = 1
+# Standardwert: Sekunden, nach denen ein Peer eine weitere Auto-Reply erhalten kann
+AUTOREPLY_INTERVAL = 300
+
+
+class AutoReplier:
+    """Entscheidet pro eingehender Nachricht, ob (und mit welchem Text) automatisch geantwortet wird."""
+
+    def __init__(self, config, metrics=REGISTRY):
+        self.config = config
+        self.burst = config.get('autoreply_burst', AUTOREPLY_BURST)
+        self.interval = config.get('autoreply_interval', AUTOREPLY_INTERVAL)
+        self.metrics = metrics
+        # handle -> [verfügbare Tokens, Zeitpunkt der letzten Auffüllung]
+        self._buckets = {}
+        # Zeitpunkt der letzten Nutzeraktivität, zu dem die Buckets gehören
+        self._away_since = None
+
+    def reply_for(self, from_handle, text, last_activity, now):
+        """
+        Liefert den Text der Auto-Reply an from_handle oder None (keine Antwort).
+        Der Aufrufer prüft vorher, ob der Nutzer abwesend ist; last_activity kennzeichnet die Abwesenheit.
+        """
+        # Liest config['autoreply'] bei jedem Aufruf, damit set_config sofort wirkt
+        auto_msg = self.config.get('autoreply')
+        if not auto_msg:
+            return None
+        # Antworten auf Auto-Replies würden zwischen zwei abwesenden Clients endlos hin und her gehen
+        if text.startswith(AUTOREPLY_MARKER):
+            self.metrics.inc('autoreplies_suppressed')
+            return None
+        if last_activity != self._away_since:
+            # Neue Abwesenheit: jeder Peer darf wieder eine Antwort bekommen
+            self._away_since = last_activity
+            self._buckets.clear()
+        bucket = self._buckets.get(from_handle)
+        if bucket is None:
+            bucket = self._buckets[from_handle] = [self.burst, now]
+        else:
+            # Tokens seit der letzten Auffüllung nachfüllen (höchstens bis burst)
+            if self.interval > 0:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) / self.interval)
+            bucket[1] = now
+        if bucket[0] < 1:
+            self.metrics.inc('autoreplies_suppressed')
+            return None
+        bucket[0] -= 1
+        return AUTOREPLY_MARKER + auto_msg
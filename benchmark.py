@@ -0,0 +1,297 @@
+# File: benchmark.py
+
+import argparse
+import json
+import os
+import platform
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+
+import client
+import discovery_service
+import server
+from async_runtime import AsyncRuntime
+from peer_table import PeerView
+
+"""
+@file benchmark.py
+@brief Loopback-Benchmark für einen Cluster aus N lokalen Peers.
+
+Startet N Peers auf 127.0.0.1, jeweils mit eigenem Discovery- und Server-Prozess
+(wie main.py mit --port/--whoisport/--broadcast), und misst über die Client-Funktionen:
+ - Discovery: Zeit, bis nach N JOINs jeder Peer alle N Peers kennt
+ - MSG-Latenz (Perzentile) und Nachrichten pro Sekunde
+ - Bildübertragung in MB/s je Dateigröße
+ - msgall: Zeit, bis eine Nachricht an alle Peers bei allen angekommen ist
+ - Start: Zeit, bis alle Peers Verbindungen annehmen
+Mit --runtime asyncio laufen die Peers stattdessen als AsyncRuntime im Benchmark-Prozess.
+Das Ergebnis wird als JSON ausgegeben (bzw. in --output geschrieben), sodass sich Läufe
+verschiedener Commits mit --compare vergleichen lassen.
+
+Beispiel:
+    python benchmark.py --peers 8 --messages 2000 --output bench.json
+    python benchmark.py --peers 8 --compare bench.json
+"""
+
+# Standardwerte der Kommandozeilenoptionen
+DEFAULT_PEERS = 4
+DEFAULT_MESSAGES = 1000
+DEFAULT_IMAGE_SIZES = "65536,1048576,8388608"
+DEFAULT_WHOISPORT = 4999
+DEFAULT_BASE_PORT = 47000
+# Broadcast-Adresse des Loopback-Netzes: erreicht alle lokalen Discovery-Sockets
+LOOPBACK_BROADCAST = "127.255.255.255"
+# Sekunden, die höchstens auf ein einzelnes Ereignis gewartet wird
+EVENT_TIMEOUT = 30
+
+
+class _Peer:
+    """Ein lokaler Peer mit Discovery- und Server-Prozess und den zugehörigen Queues."""
+
+    def __init__(self, index, args, workdir):
+        self.handle = f"bench{index}"
+        self.runtime = args.runtime
+        # Konfiguration wie in main.py mit --port, --whoisport und --broadcast
+        self.config = {
+            'handle': self.handle,
+            'port': args.base_port + index,
+            'whoisport': args.whoisport,
+            'broadcast': args.broadcast,
+            'imagepath': os.path.join(workdir, self.handle),
+        }
+        self.processes = []
+        self.async_runtime = None
+
+    def start(self):
+        if self.runtime == 'asyncio':
+            self.async_runtime = AsyncRuntime(self.config)
+            self.async_runtime.start()
+            self.net_to_interface, self.disc_to_interface, _, self.interface_to_disc = self.async_runtime.queues()
+        else:
+            self.net_to_interface = Queue()
+            self.disc_to_interface = Queue()
+            self.interface_to_disc = Queue()
+            self.processes = [
+                Process(target=discovery_service.discovery_loop,
+                        args=(self.config, self.disc_to_interface, self.interface_to_disc), daemon=True),
+                Process(target=server.server_loop, args=(self.config, self.net_to_interface), daemon=True),
+            ]
+            for proc in self.processes:
+                proc.start()
+        self.view = PeerView(self.interface_to_disc)
+
+    def wait_listening(self):
+        """Wartet, bis der Server des Peers Verbindungen annimmt."""
+        deadline = time.perf_counter() + EVENT_TIMEOUT
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.config['port']), timeout=1).close()
+                return
+            except OSError:
+                if time.perf_counter() > deadline:
+                    raise
+                time.sleep(0.001)
+
+    def stop(self):
+        if self.async_runtime is not None:
+            self.async_runtime.stop()
+        for proc in self.processes:
+            proc.terminate()
+            proc.join()
+
+    def join(self):
+        """Sendet JOIN und aktiviert die Heartbeats des Discovery-Prozesses."""
+        client.client_send_join(self.config)
+        self.interface_to_disc.put(('JOINED', self.handle, self.config['port']))
+
+    def drain_discovery(self):
+        """Übernimmt alle anstehenden Peer-Updates in die lokale Sicht."""
+        while True:
+            try:
+                self.view.apply(self.disc_to_interface.get_nowait())
+            except queue.Empty:
+                return
+
+    def next_event(self):
+        """Wartet auf das nächste Ereignis ('MSG'/'IMG') des Server-Prozesses."""
+        while True:
+            event = self.net_to_interface.get(timeout=EVENT_TIMEOUT)
+            # Metrik-Schnappschüsse zählen nicht als empfangene Nachricht
+            if event[0] != 'STATS':
+                return event
+
+
+def _percentiles(samples):
+    """Liefert min/p50/p90/p99/max einer Liste von Sekunden-Werten in Millisekunden."""
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+    return {'min_ms': pick(0), 'p50_ms': pick(0.5), 'p90_ms': pick(0.9),
+            'p99_ms': pick(0.99), 'max_ms': pick(1.0)}
+
+
+def bench_discovery(peers):
+    """Zeit vom ersten JOIN, bis jeder Peer alle Peers kennt."""
+    start = time.perf_counter()
+    for peer in peers:
+        peer.join()
+    handles = {peer.handle for peer in peers}
+    deadline = start + EVENT_TIMEOUT
+    while time.perf_counter() < deadline:
+        for peer in peers:
+            peer.drain_discovery()
+        if all(handles <= set(peer.view.peers) for peer in peers):
+            return {'converged': True, 'seconds': round(time.perf_counter() - start, 4)}
+        time.sleep(0.001)
+    return {'converged': False, 'seconds': None}
+
+
+def bench_msg(sender, receiver, count):
+    """MSG-Latenz (eine Nachricht nach der anderen) und Durchsatz (alle Nachrichten am Stück)."""
+    host, port = '127.0.0.1', receiver.config['port']
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        client.client_send_msg(host, port, sender.handle, f"latency {i}")
+        receiver.next_event()
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(count):
+        client.client_send_msg(host, port, sender.handle, f"throughput {i}")
+    for _ in range(count):
+        receiver.next_event()
+    elapsed = time.perf_counter() - start
+    return {'latency': _percentiles(latencies),
+            'messages_per_second': round(count / elapsed, 1)}
+
+
+def bench_images(sender, receiver, sizes, workdir):
+    """Übertragungsrate für Bilder verschiedener Größe (Datei senden bis gespeichert gemeldet)."""
+    results = {}
+    for size in sizes:
+        path = os.path.join(workdir, f"bench_{size}.jpg")
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        start = time.perf_counter()
+        client.client_send_img('127.0.0.1', receiver.config['port'], sender.handle, path)
+        receiver.next_event()
+        elapsed = time.perf_counter() - start
+        results[str(size)] = {'seconds': round(elapsed, 4),
+                              'mb_per_second': round(size / elapsed / 1e6, 2)}
+    return results
+
+
+def bench_msgall(sender, peers):
+    """Zeit, bis eine msgall-Nachricht bei allen Peers angekommen ist."""
+    targets = {peer.handle: ('127.0.0.1', peer.config['port']) for peer in peers}
+    start = time.perf_counter()
+    result = client.client_send_msg_all(targets, sender.handle, "fanout")
+    sent = time.perf_counter() - start
+    for peer in peers:
+        if peer.handle in result['ok']:
+            peer.next_event()
+    return {'send_seconds': round(sent, 4),
+            'delivered_seconds': round(time.perf_counter() - start, 4),
+            'ok': len(result['ok']), 'failed': len(result['failed']),
+            'timeout': len(result['timeout'])}
+
+
+def _git_commit():
+    """Aktueller Commit des Repositories (falls verfügbar)."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Startet den Cluster, führt alle Messungen aus und liefert das Ergebnis als Dictionary."""
+    workdir = tempfile.mkdtemp(prefix="slcp_bench_")
+    peers = [_Peer(i, args, workdir) for i in range(args.peers)]
+    try:
+        start = time.perf_counter()
+        for peer in peers:
+            peer.start()
+        for peer in peers:
+            peer.wait_listening()
+        startup = time.perf_counter() - start
+        # Discovery-Sockets hochfahren lassen, bevor das erste JOIN gesendet wird
+        time.sleep(args.warmup)
+        sizes = [int(s) for s in args.image_sizes.split(',') if s]
+        sender, receiver = peers[0], peers[-1]
+        return {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'params': {'peers': args.peers, 'messages': args.messages, 'image_sizes': sizes,
+                       'runtime': args.runtime},
+            'startup_seconds': round(startup, 4),
+            'discovery': bench_discovery(peers),
+            'msg': bench_msg(sender, receiver, args.messages),
+            'images': bench_images(sender, receiver, sizes, workdir),
+            'msgall': bench_msgall(sender, peers),
+        }
+    finally:
+        for peer in peers:
+            peer.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _numeric_leaves(data, prefix=''):
+    """Liefert alle Zahlenwerte eines verschachtelten Dictionaries als {pfad: wert}."""
+    leaves = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            leaves.update(_numeric_leaves(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            leaves[path] = value
+    return leaves
+
+
+def compare(old, new):
+    """Gibt für alle gemeinsamen Messwerte alten Wert, neuen Wert und Änderung in Prozent aus."""
+    old_values = _numeric_leaves(old)
+    for path, value in _numeric_leaves(new).items():
+        if path.startswith('params.') or path not in old_values:
+            continue
+        before = old_values[path]
+        change = (value - before) / before * 100 if before else 0.0
+        print(f"{path:45} {before:>12} -> {value:>12}  ({change:+.1f}%)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Loopback benchmark for a local SLCP cluster")
+    parser.add_argument("--peers", type=int, default=DEFAULT_PEERS, help="Number of local peers")
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES, help="Messages for latency/throughput")
+    parser.add_argument("--image-sizes", default=DEFAULT_IMAGE_SIZES, help="Comma-separated image sizes in bytes")
+    parser.add_argument("--port", dest="base_port", type=int, default=DEFAULT_BASE_PORT, help="TCP port of the first peer")
+    parser.add_argument("--whoisport", type=int, default=DEFAULT_WHOISPORT, help="Discovery port shared by all peers")
+    parser.add_argument("--broadcast", default=LOOPBACK_BROADCAST, help="Broadcast address for discovery")
+    parser.add_argument("--runtime", choices=["process", "asyncio"], default="process",
+                        help="Run each peer as separate processes or on an asyncio loop")
+    parser.add_argument("--warmup", type=float, default=0.5, help="Seconds to wait after starting the peers")
+    parser.add_argument("--output", help="Write JSON result to this file instead of stdout")
+    parser.add_argument("--compare", help="Previous JSON result to compare against")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
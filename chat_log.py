@@ -0,0 +1,260 @@
+# File: chat_log.py
+
+"""
+@file chat_log.py
+@brief Begrenzter, virtualisierter Chatverlauf für das Tk-Text-Widget der GUI.
+
+- Alle Einträge (Text oder Bild) werden als leichte Beschreibungen in einer Liste gehalten.
+- Im Text-Widget ist immer nur ein Fenster von höchstens `limit` Einträgen dargestellt.
+  Wird es größer, werden die ältesten Einträge aus dem Widget entfernt und ihre
+  PhotoImage-Referenzen freigegeben.
+- Neue Einträge werden gesammelt und mit flush() einmal pro GUI-Tick gemeinsam eingefügt.
+- Scrollt der Nutzer an den oberen (bzw. unteren) Rand, wird die nächste Seite älterer
+  (bzw. neuerer) Einträge nachgeladen.
+- Bilder werden asynchron geladen: liefert load_photo None, steht bis zum Aufruf von
+  photo_ready() ein Platzhalter im Widget, sodass der Tk-Hauptthread nie auf das Dekodieren wartet.
+- Mit load_older können noch ältere Einträge aus dem dauerhaften Verlauf (history.py)
+  seitenweise vorne angefügt werden, sobald der Speicher nach oben erschöpft ist.
+"""
+
+# Standardwert: maximale Anzahl gleichzeitig dargestellter Einträge
+SCROLLBACK_LIMIT = 500
+# Anzahl Einträge, die beim Scrollen an den Rand nachgeladen werden
+PAGE_SIZE = 100
+# Maximale Anzahl Eintragsbeschreibungen, die insgesamt im Speicher bleiben
+HISTORY_LIMIT = 5000
+
+
+class ChatLog:
+    """Verwaltet die Einträge des Chatverlaufs und deren Darstellung im Text-Widget."""
+
+    def __init__(self, text_widget, load_photo, limit=SCROLLBACK_LIMIT, page_size=PAGE_SIZE,
+                 history_limit=HISTORY_LIMIT, load_older=None):
+        """
+        text_widget: Tk-Text-Widget, in dem der Verlauf angezeigt wird.
+        load_photo: Funktion path -> PhotoImage oder None (wird später per photo_ready() geliefert);
+            wirft eine Exception, wenn das Bild nicht ladbar ist.
+        load_older: optionale Funktion (before, count) -> Liste von Einträgen mit Verlaufsposition
+            (älteste zuerst), die die bis zu count Einträge vor der Position before liefert.
+        """
+        self.text = text_widget
+        self.load_photo = load_photo
+        self.limit = limit
+        self.page_size = page_size
+        self.history_limit = max(history_limit, limit)
+        # Einträge: ('text', text, position) oder ('image', prefix, path, position);
+        # position ist die Position im dauerhaften Verlauf oder None
+        self.entries = []
+        # Fortlaufende Nummer des ersten Eintrags in self.entries
+        self.base = 0
+        # Nummern des ersten dargestellten Eintrags und des ersten nicht mehr dargestellten
+        self.first = 0
+        self.last = 0
+        # Noch nicht dargestellte neue Einträge
+        self._pending = []
+        # Nummer -> PhotoImage der aktuell dargestellten Bilder (verhindert Garbage Collection)
+        self._photos = {}
+        # path -> Nummern der Einträge, die auf das asynchron geladene Bild warten
+        self._waiting = {}
+        self.load_older = load_older
+        # Verlaufsposition, vor der nachgeladen wird, wenn kein Eintrag im Speicher eine hat
+        self.history_floor = 0
+
+        # Mausrad-Ereignisse (Windows/macOS und X11), um Nachladen an den Rändern auszulösen
+        self.text.bind("<MouseWheel>", self._on_wheel, add="+")
+        self.text.bind("<Button-4>", lambda e: self._after_scroll(up=True), add="+")
+        self.text.bind("<Button-5>", lambda e: self._after_scroll(up=False), add="+")
+
+    def add_text(self, text, position=None):
+        """Merkt einen Texteintrag zur Darstellung beim nächsten flush() vor."""
+        self._pending.append(('text', text, position))
+
+    def add_image(self, prefix, path, position=None):
+        """Merkt einen Bildeintrag zur Darstellung beim nächsten flush() vor."""
+        self._pending.append(('image', prefix, path, position))
+
+    def prepend_older(self):
+        """
+        Fügt die nächste Seite älterer Einträge aus load_older vorne an.
+        Ist noch nichts dargestellt (Start), werden die neuesten davon gleich angezeigt.
+        Rückgabe: Anzahl nachgeladener Einträge.
+        """
+        before = self._history_boundary()
+        if self.load_older is None or before <= 0:
+            return 0
+        older = self.load_older(before, self.page_size)
+        if not older:
+            return 0
+        self.entries[:0] = older
+        self.base -= len(older)
+        if self.first == self.last:
+            self._rerender(max(self.base, self.last - self.limit), self.last)
+            self.text.see("end")
+        return len(older)
+
+    def flush(self):
+        """Fügt alle vorgemerkten Einträge in einem Durchgang in das Widget ein."""
+        if not self._pending:
+            return
+        # Nur wenn das Fenster am Ende des Verlaufs steht, werden neue Einträge sofort gezeigt
+        following = self.last == self.base + len(self.entries)
+        self.entries.extend(self._pending)
+        self._pending = []
+        if not following:
+            self._trim_history()
+            return
+        self.text.configure(state="normal")
+        end = self.base + len(self.entries)
+        while self.last < end:
+            self._render(self.last)
+            self.last += 1
+        # Älteste Einträge aus dem Widget entfernen, wenn das Limit überschritten ist
+        while self.last - self.first > self.limit:
+            self._drop_first()
+        self.text.configure(state="disabled")
+        self.text.see("end")
+        self._trim_history()
+
+    def clear(self):
+        """Entfernt alle Einträge aus Widget und Speicher."""
+        self.text.configure(state="normal")
+        self.text.delete("1.0", "end")
+        self.text.configure(state="disabled")
+        for number in range(self.first, self.last):
+            self.text.mark_unset(self._mark(number))
+            self.text.tag_delete(self._pending_tag(number))
+        self._photos.clear()
+        self._waiting.clear()
+        self.base += len(self.entries)
+        self.entries = []
+        self.first = self.last = self.base
+
+    def _mark(self, number):
+        """Name der Tk-Markierung am Anfang des Eintrags mit der Nummer number."""
+        return f"entry{number}"
+
+    def _render(self, number):
+        """Hängt einen Eintrag an das Ende des Widgets an (Widget muss editierbar sein)."""
+        entry = self.entries[number - self.base]
+        # Markierung am Anfang des Eintrags; "left" hält sie vor dem eingefügten Inhalt
+        mark = self._mark(number)
+        self.text.mark_set(mark, "end-1c")
+        self.text.mark_gravity(mark, "left")
+        if entry[0] == 'text':
+            self.text.insert("end", entry[1])
+            return
+        _, prefix, path, _ = entry
+        photo = self._photos.get(number)
+        if photo is None:
+            try:
+                photo = self.load_photo(path)
+            except Exception:
+                self.text.insert("end", f"[Bild {prefix}] {path}\n")
+                return
+        if prefix:
+            self.text.insert("end", f"{prefix}: ")
+        if photo is None:
+            # Bild wird im Hintergrund geladen: Platzhalter mit eigenem Tag, den photo_ready() ersetzt
+            self.text.insert("end", "[Bild wird geladen …]", self._pending_tag(number))
+            self._waiting.setdefault(path, set()).add(number)
+        else:
+            self._photos[number] = photo
+            self.text.image_create("end", image=photo)
+        self.text.insert("end", "\n")
+
+    def _pending_tag(self, number):
+        """Name des Tags, der den Platzhalter eines noch ladenden Bildes markiert."""
+        return f"pending{number}"
+
+    def photo_ready(self, path, photo):
+        """
+        Ersetzt die Platzhalter aller dargestellten Einträge mit diesem Bild.
+        photo: PhotoImage oder None, wenn das Bild nicht geladen werden konnte.
+        """
+        numbers = self._waiting.pop(path, ())
+        if not numbers:
+            return
+        self.text.configure(state="normal")
+        for number in numbers:
+            # Inzwischen aus dem Widget entfernte Einträge laden beim nächsten Darstellen neu
+            tag = self._pending_tag(number)
+            ranges = self.text.tag_ranges(tag)
+            if not ranges or not self.first <= number < self.last:
+                continue
+            start, end = ranges[0], ranges[1]
+            self.text.delete(start, end)
+            self.text.tag_delete(tag)
+            if photo is None:
+                self.text.insert(start, f"[Bild] {path}")
+            else:
+                self._photos[number] = photo
+                self.text.image_create(start, image=photo)
+        self.text.configure(state="disabled")
+
+    def _drop_first(self):
+        """Entfernt den ältesten dargestellten Eintrag aus dem Widget und gibt sein Bild frei."""
+        self.text.delete(self._mark(self.first), self._mark(self.first + 1))
+        self.text.tag_delete(self._pending_tag(self.first))
+        self.text.mark_unset(self._mark(self.first))
+        self._photos.pop(self.first, None)
+        self.first += 1
+
+    def _rerender(self, first, last):
+        """Stellt das Fenster [first, last) komplett neu dar (beim Nachladen einer Seite)."""
+        self.text.configure(state="normal")
+        self.text.delete("1.0", "end")
+        for number in range(self.first, self.last):
+            self.text.mark_unset(self._mark(number))
+            self.text.tag_delete(self._pending_tag(number))
+        # Bilder außerhalb des neuen Fensters freigeben
+        self._photos = {n: p for n, p in self._photos.items() if first <= n < last}
+        self.first = self.last = first
+        while self.last < last:
+            self._render(self.last)
+            self.last += 1
+        self.text.configure(state="disabled")
+
+    def _history_boundary(self):
+        """Verlaufsposition des ältesten Eintrags im Speicher (bzw. history_floor)."""
+        for entry in self.entries:
+            if entry[-1] is not None:
+                return entry[-1]
+        return self.history_floor
+
+    def _trim_history(self):
+        """Vergisst die ältesten Eintragsbeschreibungen, die nicht mehr dargestellt werden."""
+        excess = len(self.entries) - self.history_limit
+        if excess > 0:
+            excess = min(excess, self.first - self.base)
+            # Vergessene Einträge aus dem Verlauf können später wieder nachgeladen werden
+            for entry in self.entries[:excess]:
+                if entry[-1] is not None:
+                    self.history_floor = entry[-1] + 1
+            del self.entries[:excess]
+            self.base += excess
+
+    def _on_wheel(self, event):
+        """Mausrad unter Windows/macOS: Richtung aus event.delta bestimmen."""
+        self._after_scroll(up=event.delta > 0)
+
+    def _after_scroll(self, up):
+        """Prüft nach dem Scrollen, ob am Rand eine weitere Seite nachgeladen werden muss."""
+        self.text.after_idle(self._load_page, up)
+
+    def _load_page(self, up):
+        """Lädt ältere (up=True) oder neuere Einträge nach, wenn der Nutzer am Rand steht."""
+        top, bottom = self.text.yview()
+        if up and top <= 0.0 and self.first == self.base:
+            # Speicher nach oben erschöpft: ältere Einträge aus dem dauerhaften Verlauf holen
+            self.prepend_older()
+        if up and top <= 0.0 and self.first > self.base:
+            anchor = self.first
+            first = max(self.base, self.first - self.page_size)
+            self._rerender(first, min(first + self.limit, self.last))
+            # Ansicht auf den bisher obersten Eintrag setzen, damit nichts springt
+            self.text.yview(self._mark(anchor))
+        elif not up and bottom >= 1.0 and self.last < self.base + len(self.entries):
+            anchor = self.last - 1
+            last = min(self.base + len(self.entries), self.last + self.page_size)
+            self._rerender(max(self.first, last - self.limit), last)
+            self.text.see(self._mark(anchor))
@@ -1,15 +1,27 @@
 # File: cli.py
 
 import cmd
-import threading
-import queue
+import json
+import os
 import socket
 import time
-from client import client_send_join, client_send_leave, client_send_who, client_send_msg, client_send_img
+from dispatcher import QueueDispatcher
+from peer_table import PeerView
+from metrics import REGISTRY, StatsCollector, STATS_INTERVAL, format_stats
+from history import open_history
+from outbox import Outbox
+from autoreply import AutoReplier
+from client import client_send_join, client_send_leave, client_send_who, SEND_TIMEOUT
+from discovery_service import RESPONSE_JITTER
 
 # Timeout für Auto-Reply (in Sekunden)
 # 30 Sekunden Inaktivität, bevor Auto-Reply ausgelöst wird
 AWAY_TIMEOUT = 30  
+# Anzahl Nachrichten, die 'history <user>' ohne Angabe von n anzeigt
+HISTORY_DEFAULT = 20
+# Sekunden, die 'who' zusätzlich zur zufälligen Antwortverzögerung der Peers (response_jitter)
+# auf KNOWUSERS wartet (Übertragung und Verarbeitung der Antwort)
+WHO_MARGIN = 0.2
 
 """
 @file cli.py
@@ -28,7 +40,7 @@ class ChatCLI(cmd.Cmd):
     # Prompt, der vor jeder Eingabe angezeigt wird (auch automatisch durch cmd gesetzt)
     prompt = "> "
 
-    def __init__(self, config, net_to_interface_queue, disc_to_interface_queue, interface_to_net_queue):
+    def __init__(self, config, net_to_interface_queue, disc_to_interface_queue, interface_to_net_queue, interface_to_disc_queue=None):
         """Konstruktor der ChatCLI-Klasse"""
         # Ruft den Konstruktor der Basisklasse cmd.Cmd auf 
         super().__init__()
@@ -38,79 +50,123 @@ class ChatCLI(cmd.Cmd):
         self.net_to_interface = net_to_interface_queue
         self.disc_to_interface = disc_to_interface_queue
         self.interface_to_net = interface_to_net_queue
+        self.interface_to_disc = interface_to_disc_queue
         # Flag, ob der Nutzer im Netzwerk eingeloggt ist
         # Wird auf True gesetzt, wenn der Nutzer dem Netzwerk beitritt
         self.joined = False
         # Dictionary, das die Peers (Nutzer) im Netzwerk speichert, dadruch können Funktionen wie who und msgall implementiert werden
         self.peers = {}
+        # Lokale Kopie der Peerliste, die per Delta vom Discovery-Service aktualisiert wird
+        self._peer_view = PeerView(interface_to_disc_queue)
+        # Sammelt die Metriken von Server, Discovery und CLI (Befehl 'stats', optional JSON-Datei)
+        self.stats = StatsCollector(config.get('stats_file'), config.get('stats_interval', STATS_INTERVAL),
+                                    {'net': net_to_interface_queue, 'disc': disc_to_interface_queue})
+        # True, wenn seit dem letzten Prompt etwas ausgegeben wurde (nur dann Prompt neu zeichnen)
+        self._printed = False
+        # Dauerhafter Verlauf des aktuellen Handles (wird bei 'join' geöffnet, None = abgeschaltet)
+        self.history = None
+        # Postausgang: msg, msgall, img und Auto-Reply werden im Hintergrund gesendet,
+        # Fehler werden nach dem letzten Versuch gemeldet
+        self.outbox = Outbox.from_config(config)
+        # Begrenzt Auto-Replies pro Peer und antwortet nie auf Auto-Replies
+        self.autoreplier = AutoReplier(config)
 
         # Zeitpunkt der letzten Nutzeraktivität (zur Auto-Reply-Erkennung)
         self.last_activity = time.time()
 
-        # Event-Objekt zum Stoppen des Polling-Threads (wird gesetzt, wenn die CLI beendet wird und beendet die Loop)
-        self._stop_event = threading.Event()
-        # Erstellt einen Daemon-Thread, der in _poll_queues() laufend (≈ alle 100 ms) die beiden
-        # Queues net_to_cli und disc_to_cli „pollt“, also wiederholt.  So erscheinen eingehende Chat-Nachrichten
-        # und Peer-Events sofort im Terminal, während der Haupt-Thread weiter Benutzereingaben
-        # verarbeiten kann.  daemon=True sorgt dafür, dass der Thread automatisch beendet wird,
-        # sobald der Haupt-Thread (cmdloop) endet – ohne explizites join().
-        self._poll_thread = threading.Thread(target=self._poll_queues, daemon=True)
-        # Startet den Polling-Thread self._poll_thread
-        self._poll_thread.start()
-
-    def _poll_queues(self): 
-        """Diese Methode wird im Hintergrund-Thread ausgeführt und pollt die Queues"""
-        #läuft bis das _stop_event gesetzt wird
-        while not self._stop_event.is_set():
-            # Aktualisiert den Zeitpunkt der letzten Aktivität, um Auto-Reply zu steuern
+        # Dispatcher, der blockierend auf beide Queues wartet und eingehende Ereignisse sofort
+        # an die Handler weitergibt. So erscheinen eingehende Chat-Nachrichten und Peer-Events
+        # ohne Verzögerung im Terminal, während der Haupt-Thread weiter Benutzereingaben
+        # verarbeiten kann. Im Leerlauf wird keine CPU-Zeit verbraucht (kein Polling, kein sleep).
+        # Die Threads sind Daemon-Threads und enden automatisch mit dem Haupt-Thread (cmdloop).
+        self._dispatcher = QueueDispatcher(
+            [(self.net_to_interface, self._handle_net_event),
+             (self.disc_to_interface, self._handle_disc_event)],
+            on_batch_end=self._redraw_prompt,
+        )
+        # Startet die Dispatcher-Threads
+        self._dispatcher.start()
+
+    def _handle_net_event(self, msg):
+        """Verarbeitet ein Ereignis aus der Netzwerk-Queue (wird im Dispatcher-Thread ausgeführt)"""
+        # --- Fall A: Textnachricht ---
+        if msg[0] == 'MSG':
+            from_handle = msg[1] # Absender der Nachricht
+            text = msg[2] # Inhalt der Nachricht
+
+            # Auto-Reply, falls Nutzer länger als AWAY_TIMEOUT “away” ist
             now = time.time()
+            if now - self.last_activity > AWAY_TIMEOUT and self.joined and from_handle in self.peers:
+                # Text der Auto-Reply aus der Konfigurationsdatei, sofern der Peer in dieser
+                # Abwesenheit noch eine Antwort bekommen darf (None = keine Antwort)
+                auto_msg = self.autoreplier.reply_for(from_handle, text, self.last_activity, now)
+                # Wenn eine Auto-Reply-Nachricht definiert ist, wird sie an den Absender gesendet
+                if auto_msg:
+                    # Sende die Auto-Reply-Nachricht an den Absender falls einer vorhanden ist
+                    thost, tport = self.peers[from_handle]
+                    # Im Hintergrund senden: der Empfang weiterer Nachrichten wartet nicht darauf
+                    if self.outbox.send_msg(from_handle, thost, tport, auto_msg, self._on_sent):
+                        REGISTRY.inc('autoreplies_sent')
+                        self._record(from_handle, 'out', 'text', auto_msg)
 
-            # 1. Eingehende Chat-Nachrichten abholen
-            try:
-                # get nowait() holt eine Nachricht aus der Queue, ohne zu blockieren
-                msg = self.net_to_interface.get_nowait()
-                # --- Fall A: Textnachricht ---
-                if msg[0] == 'MSG':
-                    from_handle = msg[1] # Absender der Nachricht
-                    text = msg[2] # Inhalt der Nachricht
-
-                    # Auto-Reply, falls Nutzer länger als AWAY_TIMEOUT “away” ist
-                    if now - self.last_activity > AWAY_TIMEOUT and self.joined:
-                        # Die Auto-Reply-Nachricht aus der Konfigurationsdatei auslesen
-                        auto_msg = self.config.get('autoreply', None)
-                        # Wenn eine Auto-Reply-Nachricht definiert ist, wird sie an den Absender gesendet
-                        if auto_msg and from_handle in self.peers:
-                            # Sende die Auto-Reply-Nachricht an den Absender falls einer vorhanden ist
-                            thost, tport = self.peers[from_handle]
-                            client_send_msg(thost, tport, self.config['handle'], auto_msg)
-
-                    # Ausgabe der eigentlichen Nachricht
-                    print(f"\n[Nachricht von {from_handle}]: {text}")
-
-                # --- Fall B: Bildnachricht ---
-                elif msg[0] == 'IMG':
-                    from_handle = msg[1]
-                    filepath = msg[2]
-                    print(f"\n[Bild empfangen von {from_handle}]: gespeichert als {filepath}")
-
-                # Prompt wieder anzeigen nach der Verarbeitung der Nachricht
-                print(self.prompt, end='', flush=True)
-
-            except queue.Empty:
-                pass
-
-            # 2. Updates der Peer-Liste abholen
-            try:
-                dmsg = self.disc_to_interface.get_nowait()
-                # Der Discovery-Service sendet Updates über die Peer-Liste
-                # ('PEERS', <dict>) – wir übernehmen das Dict.
-                if dmsg[0] == 'PEERS':
-                    self.peers = dmsg[1]
-            except queue.Empty:
-                pass
-        
-            # Pause damit die CPU nicht überlastet wird
-            time.sleep(0.1)
+            self._record(from_handle, 'in', 'text', text)
+            # Ausgabe der eigentlichen Nachricht
+            print(f"\n[Nachricht von {from_handle}]: {text}")
+            self._printed = True
+
+        # --- Fall B: Bildnachricht ---
+        elif msg[0] == 'IMG':
+            from_handle = msg[1]
+            filepath = msg[2]
+            self._record(from_handle, 'in', 'image', filepath)
+            print(f"\n[Bild empfangen von {from_handle}]: gespeichert als {filepath}")
+            self._printed = True
+
+        # --- Fall C: Metrik-Schnappschuss des Server-Prozesses ---
+        elif msg[0] == 'STATS':
+            self.stats.update(msg[1], msg[2])
+
+    def _handle_disc_event(self, dmsg):
+        """Verarbeitet ein Ereignis aus der Discovery-Queue (wird im Dispatcher-Thread ausgeführt)"""
+        # Der Discovery-Service sendet Änderungen der Peer-Liste als Delta
+        # ('PEERS_DELTA', ...) bzw. auf Anfrage vollständig ('PEERS', ...).
+        # Metrik-Schnappschüsse des Discovery-Prozesses kommen über dieselbe Queue.
+        if dmsg[0] == 'STATS':
+            self.stats.update(dmsg[1], dmsg[2])
+        elif self._peer_view.apply(dmsg) is not None:
+            # Die Kopie wird bei jeder Änderung ersetzt, daher ist die Zuweisung threadsicher
+            self.peers = self._peer_view.peers
+
+    def _redraw_prompt(self):
+        """Zeigt den Prompt nach einem Stapel verarbeiteter Ereignisse einmalig wieder an"""
+        # Stille Ereignisse (Peer-Updates, Metriken) unterbrechen die Eingabe nicht
+        if self._printed:
+            self._printed = False
+            print(self.prompt, end='', flush=True)
+
+    def _record(self, peer, direction, kind, body, peers=None):
+        """Speichert eine gesendete bzw. empfangene Nachricht im dauerhaften Verlauf"""
+        if self.history:
+            sender = peer if direction == 'in' else self.config['handle']
+            self.history.append(peer, direction, sender, kind, body, peers)
+
+    def _notify(self, text):
+        """Gibt eine Meldung aus einem Hintergrund-Thread aus und zeigt den Prompt wieder an"""
+        print(f"\n{text}")
+        print(self.prompt, end='', flush=True)
+
+    def _on_sent(self, peer, error):
+        """Rückmeldung des Postausgangs (Worker-Thread); nur Fehler werden angezeigt"""
+        if error is not None:
+            self._notify(f"Fehler beim Senden an {peer}: {error}")
+
+    def _on_sent_all(self, result, what="Nachricht"):
+        """Rückmeldung des Postausgangs, sobald msgall bzw. imgall an alle Peers abgeschlossen ist"""
+        lines = [f"Fehler beim Senden an {h}." for h in result['failed']]
+        lines += [f"Zeitüberschreitung beim Senden an {h}." for h in result['timeout']]
+        lines.append(f"{what} an alle gesendet: {len(result['ok'])} erfolgreich, "
+                     f"{len(result['failed'])} fehlgeschlagen, {len(result['timeout'])} Zeitüberschreitung.")
+        self._notify("\n".join(lines))
 
     # Die folgenden Methoden sind die Befehle, die der Nutzer in der CLI eingeben kann.
 
@@ -145,11 +201,18 @@ class ChatCLI(cmd.Cmd):
         # 2: Konfiguration aktualisieren
         self.config['handle'] = handle
         self.config['port'] = port
+        # Verlauf des neuen Handles öffnen (ein zuvor geöffneter gehört ggf. zu einem anderen Handle)
+        old_history, self.history = self.history, open_history(self.config, handle)
+        if old_history:
+            old_history.close()
         # Falls eine CLI-zu-Netzwerk-Queue existiert, wird der Port gesetzt
         if self.interface_to_net:
             self.interface_to_net.put(('SET_PORT', port))
         # 3: Beitrittsnachricht an das Netzwerk senden
         client_send_join(self.config)
+        # 4: Discovery-Service informieren, damit er regelmäßig Heartbeats (ALIVE) sendet
+        if self.interface_to_disc:
+            self.interface_to_disc.put(('JOINED', handle, port))
         self.joined = True
         print(f"Eingetreten als {handle} auf Port {port}")
 
@@ -164,6 +227,9 @@ class ChatCLI(cmd.Cmd):
         # Senden der Verlassen-Nachricht an das Netzwerk
         # Dadurch wird der Nutzer aus dem Netzwerk entfernt
         client_send_leave(self.config)
+        # Keine Heartbeats mehr senden
+        if self.interface_to_disc:
+            self.interface_to_disc.put(('LEFT',))
         self.joined = False
         print("Du hast das Netzwerk verlassen.")
 
@@ -174,9 +240,11 @@ class ChatCLI(cmd.Cmd):
         if not self.joined:
             print("Zuerst 'join', bevor du 'who' ausführst.")
             return
-        client_send_who(self.config)
-        # Kurze Pause, um sicherzustellen, dass die Peer-Liste aktualisiert wurde
-        time.sleep(0.2)
+        # Die eigene Sicht mitschicken: Peers mit derselben Peerliste antworten nicht
+        client_send_who(self.config, self.peers)
+        # Peers antworten erst nach einer zufälligen Wartezeit von bis zu response_jitter Sekunden;
+        # so lange (plus Übertragung) warten, bevor die Peer-Liste ausgegeben wird
+        time.sleep(self.config.get('response_jitter', RESPONSE_JITTER) + WHO_MARGIN)
         # Falls keine Peers gefunden wurden, wird eine entsprechende Nachricht ausgegeben
         if not self.peers:
             print("Keine Peers gefunden.")
@@ -206,7 +274,11 @@ class ChatCLI(cmd.Cmd):
         # Ansonsten wird eine Fehlermeldung ausgegeben
         if target in self.peers:
             thost, tport = self.peers[target]
-            client_send_msg(thost, tport, self.config['handle'], text)
+            # Kehrt sofort zurück; Fehler meldet _on_sent nach dem letzten Versuch
+            if self.outbox.send_msg(target, thost, tport, text, self._on_sent):
+                self._record(target, 'out', 'text', text)
+            else:
+                print("Sendewarteschlange voll, Nachricht verworfen.")
         else:
             print("Unbekannter Nutzer.")
     
@@ -230,13 +302,12 @@ class ChatCLI(cmd.Cmd):
         if not self.peers:
             print("Keine anderen Peers im Chat.")
             return
-        # Iteration über die Peers und Senden der Nachricht an jeden Peer
-        for peer_handle, (phost, pport) in self.peers.items():
-            try:
-                client_send_msg(phost, pport, self.config['handle'], text)
-            except Exception as e:
-                print(f"Fehler beim Senden an {peer_handle}: {e}")
-        print("Nachricht an alle gesendet.")
+        # Paralleles Senden an alle Peers über den Postausgang; die Zusammenfassung
+        # erscheint, sobald alle Peers erreicht wurden bzw. alle Versuche fehlgeschlagen sind
+        peers = dict(self.peers)
+        self.outbox.send_all(peers, text, self._on_sent_all)
+        # Ein Eintrag im Verlauf, indiziert unter allen adressierten Peers
+        self._record('*', 'out', 'text', text, peers=list(peers))
 
     def do_img(self, arg):
         """Implementierung des img-Befehls. img <user> <pfad> = Sendet ein Bild an <user>"""
@@ -254,14 +325,77 @@ class ChatCLI(cmd.Cmd):
         if target in self.peers:
             # Überprüfen, ob der Zielnutzer in der Peer-Liste vorhanden ist
             thost, tport = self.peers[target]
-            # Senden des Bildes an den Zielnutzer
-            success = client_send_img(thost, tport, self.config['handle'], path)
-            if not success:
+            if not os.path.isfile(path):
                 print("Datei nicht gefunden.")
+            # Senden des Bildes an den Zielnutzer im Hintergrund
+            elif self.outbox.send_img(target, thost, tport, path, self._on_sent):
+                self._record(target, 'out', 'image', path)
+            else:
+                print("Sendewarteschlange voll, Bild verworfen.")
         else:
             print("Unbekannter Nutzer.")
 
-    
+
+    def do_imgall(self, arg):
+        """Implementierung des imgall-Befehls. imgall <pfad> = Sendet ein Bild an alle Peers"""
+        self.last_activity = time.time()
+        if not self.joined:
+            print("Zuerst 'join', bevor du 'imgall' ausführst.")
+            return
+        path = arg.strip()
+        if not path:
+            print("Usage: imgall <pfad>")
+            return
+        if not os.path.isfile(path):
+            print("Datei nicht gefunden.")
+            return
+        if not self.peers:
+            print("Keine anderen Peers im Chat.")
+            return
+        peers = dict(self.peers)
+        # Die Datei wird einmal eingeblendet und parallel an alle Peers gesendet
+        try:
+            self.outbox.send_img_all(peers, path, lambda result: self._on_sent_all(result, "Bild"))
+        except OSError as e:
+            print(f"Datei kann nicht gelesen werden: {e}")
+            return
+        self._record('*', 'out', 'image', path, peers=list(peers))
+
+    def do_stats(self, arg):
+        """Implementierung des stats-Befehls. stats [json] = Zeigt die Laufzeit-Metriken aller Prozesse an"""
+        self.last_activity = time.time()
+        collected = self.stats.collect()
+        if arg.strip() == 'json':
+            print(json.dumps(collected, indent=2))
+        else:
+            print(format_stats(collected))
+
+    def do_history(self, arg):
+        """Implementierung des history-Befehls. history <user> [n] = Zeigt die letzten n Nachrichten mit <user> an"""
+        self.last_activity = time.time()
+        parts = arg.split()
+        if len(parts) not in (1, 2) or (len(parts) == 2 and not parts[1].isdigit()):
+            print("Usage: history <user> [n]")
+            return
+        if not self.history:
+            print("Kein Verlauf verfügbar (zuerst 'join' oder history_dir ist leer).")
+            return
+        target = parts[0]
+        n = int(parts[1]) if len(parts) == 2 else HISTORY_DEFAULT
+        # Liest nur die letzten n Einträge aus dem Index des Peers, nicht das ganze Log
+        records = self.history.last(target, n)
+        if not records:
+            print(f"Kein Verlauf mit {target}.")
+            return
+        for _, record in records:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record['t']))
+            if record['dir'] == 'in':
+                who = record['from']
+            else:
+                who = "Du -> Alle" if record['peer'] == '*' else f"Du -> {record['peer']}"
+            body = f"[Bild] {record['body']}" if record['kind'] == 'image' else record['body']
+            print(f"[{stamp}] {who}: {body}")
+
     def do_show_config(self, arg):
         """Implementierung des show_config-Befehls. show_config = Zeigt die aktuelle Konfiguration an"""
         self.last_activity = time.time()
@@ -297,11 +431,15 @@ class ChatCLI(cmd.Cmd):
         print(f"Konfig {key} = {val}")
 
     def do_exit(self, arg):
-        """Implementierung des exit-Befehls. exit = Beendet CLI und Hintergrund-Thread."""
+        """Implementierung des exit-Befehls. exit = Beendet CLI und Hintergrund-Threads."""
         self.last_activity = time.time()
         print("Beende CLI…")
-        # Setzen des Stop-Events, um den Polling-Thread zu beenden
-        self._stop_event.set()
+        # Noch ausstehende Nachrichten bis zu send_timeout Sekunden zustellen lassen
+        self.outbox.close(self.config.get('send_timeout', SEND_TIMEOUT))
+        # Dispatcher beenden, damit keine Ereignisse mehr ausgegeben werden
+        self._dispatcher.stop()
+        if self.history:
+            self.history.close()
         return True
 
     def default(self, line):
@@ -325,6 +463,9 @@ class ChatCLI(cmd.Cmd):
             'msg': "Usage: msg <user> <text>",
             'msgall': "Usage: msgall <text>",
             'img': "Usage: img <user> <pfad>",
+            'imgall': "Usage: imgall <pfad>",
+            'stats': "Usage: stats [json]",
+            'history': "Usage: history <user> [n]",
             'show_config': "Usage: show_config",
             'set_config': "Usage: set_config <parameter> <wert>",
             'help': "Usage: help",
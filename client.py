@@ -1,58 +1,339 @@
 # File: client.py
 
+import hashlib
 import socket
-from slcp_handler import build_join, build_leave, build_who, build_msg, build_img
+import select
+import threading
+import atexit
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from slcp_handler import (
+    build_join,
+    build_leave,
+    build_who,
+    build_msg,
+    build_img,
+    build_hello,
+    parse_hello,
+    parse_slcp_line,
+    build_msg_frame,
+    build_img_frame,
+    build_img_resume_frame,
+    msg_frame_payload,
+    encode_frame,
+    compress_payload,
+    FRAME_MSG,
+    FRAME_MSG_Z,
+    COMPRESS_THRESHOLD,
+)
+from metrics import REGISTRY
+from startup import PROFILE
+from discovery_service import discovery_address, configure_discovery_sender
 import os
 
 """
 @file client.py
 @brief Client-Funktionen (Network-Sender):
 
-- Broadcast (JOIN/WHO/LEAVE) an config['broadcast']:config['whoisport'].
+- Broadcast (JOIN/WHO/LEAVE) an config['broadcast']:config['whoisport'], im Multicast-Modus
+  (config['discovery_mode'] = "multicast") an config['multicast_group']:config['whoisport'].
 - Fallback auf localhost nur, wenn die Broadcast-Adresse bereits im
   Loopback-Bereich liegt, um unbeabsichtigtes Selbst-Senden im LAN zu
   vermeiden.
 - Unicast (MSG/IMG) an target_host:target_port erfolgt jetzt per TCP.
+- TCP-Verbindungen werden pro (host, port) in einem Keep-Alive-Pool gehalten und
+  wiederverwendet, damit nicht jede Nachricht einen eigenen Verbindungsauf- und -abbau kostet.
+  Unbenutzte Verbindungen werden nach POOL_IDLE_TIMEOUT Sekunden geschlossen.
+- msgall (client_send_msg_all) sendet parallel an alle Peers, jeweils mit eigener Deadline.
+- client_send_img_data sendet ein Bild aus einem bereits eingeblendeten Puffer (imgall: die Datei
+  wird nur einmal gelesen, egal an wie viele Peers).
+- Auf jeder neuen Verbindung wird per HELLO das binäre Frame-Format ausgehandelt. Kennt der
+  Peer HELLO nicht, wird das Textformat verwendet und das Ergebnis pro Peer gemerkt.
+  Solche älteren Server lesen nur eine Zeile pro Verbindung: An sie geht jede Nachricht über eine
+  eigene Verbindung, die danach geschlossen und nie in den Pool gelegt wird.
+- Bietet der Peer "resume" an, sind Bildübertragungen fortsetzbar: Der Kopf enthält den SHA-256 des
+  Bildes, der Server antwortet mit dem Offset der schon vorhandenen Bytes ("OFFSET <n>"), gesendet
+  wird nur der Rest. Nach dem letzten Byte bestätigt der Server die Prüfsumme ("ACK") oder verwirft
+  die Datei ("NAK", dann OSError, sodass der Postausgang von vorn beginnt). Der Hash einer Datei
+  wird pro (Pfad, Größe, Änderungszeit) zwischengespeichert, Wiederholungen lesen sie nicht erneut.
+- Bietet der Peer zusätzlich "zlib" an, werden Nachrichten ab compress_threshold Bytes komprimiert
+  gesendet (FRAME_MSG_Z). Größe vorher/nachher und Rechenzeit werden gezählt
+  ('compress_bytes_before', 'compress_bytes_after', 'compress_seconds').
+- Wiederholt wird nur, solange die Nutzdaten noch nicht vollständig gesendet waren (der Server
+  verwirft unvollständige Frames/Zeilen). Scheitert erst danach etwas, z. B. das Warten auf das ACK
+  eines Bildes, wird DeliveryUncertainError geworfen: Der Peer hat die Daten womöglich schon
+  verarbeitet, weder _send_pooled noch der Postausgang wiederholen sie dann (sonst Duplikate).
+- Gesendete Nachrichten/Bytes, Fehler und Sendedauern werden im REGISTRY des aufrufenden
+  Prozesses gezählt (siehe metrics).
 """
 
+# Sekunden, nach denen eine unbenutzte Verbindung im Pool geschlossen wird.
+# Muss kleiner sein als die Keep-Alive-Zeit des Servers (server.KEEPALIVE_TIMEOUT).
+POOL_IDLE_TIMEOUT = 30
+# Standardwert: Sekunden, die Verbindungsaufbau und Senden an einen Peer höchstens dauern dürfen
+SEND_TIMEOUT = 2
+# Maximale Anzahl gleichzeitiger Sende-Threads beim Senden an alle Peers
+FANOUT_WORKERS = 32
+# Fähigkeiten, die per HELLO angeboten werden (leere Menge = immer Textformat, kein HELLO)
+CAPABILITIES = {'framed', 'zlib', 'resume'}
+# Sekunden, die höchstens auf die HELLO-Antwort eines Peers gewartet wird
+HELLO_TIMEOUT = 0.5
+# Sekunden, die auf OFFSET/ACK gewartet wird, wenn für das Senden kein Timeout gesetzt ist
+REPLY_TIMEOUT = 30
+# Anzahl zwischengespeicherter Datei-Hashes für fortsetzbare Bildübertragungen
+DIGEST_CACHE_SIZE = 64
+# Markierung in _ConnectionPool._caps: Peer kennt HELLO nicht (älterer Server, eine Nachricht pro Verbindung)
+_LEGACY = None
+
+
+class DeliveryUncertainError(OSError):
+    """Fehler nach vollständig gesendeten Nutzdaten: Der Peer hat sie möglicherweise schon verarbeitet."""
+
+
+class _Channel:
+    """Eine gepoolte TCP-Verbindung samt dem darauf ausgehandelten Format."""
+
+    def __init__(self, sock, framed, compress=False, resume=False, reusable=True):
+        self.sock = sock
+        # False: Server verarbeitet nur eine Nachricht pro Verbindung; nach dem Senden schließen
+        self.reusable = reusable
+        # True, wenn auf dieser Verbindung das binäre Frame-Format ausgehandelt wurde
+        self.framed = framed
+        # True, wenn der Server komprimierte Frames annimmt (nur zusammen mit dem Frame-Format)
+        self.compress = framed and compress
+        # True, wenn der Server fortsetzbare Bildübertragungen unterstützt
+        self.resume = framed and resume
+        # Zeitpunkt der letzten Nutzung (für die Leerlauf-Räumung)
+        self.last_used = time.monotonic()
+
+
+class _ConnectionPool:
+    """Hält offene TCP-Verbindungen pro (host, port) zur Wiederverwendung bereit."""
+
+    def __init__(self, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        # Schützt _idle und _caps, da mehrere Threads gleichzeitig senden können
+        self._lock = threading.Lock()
+        # (host, port) -> Liste freier _Channel-Objekte
+        self._idle = {}
+        # (host, port) -> vom Server per HELLO bestätigte Fähigkeiten (fehlt = noch unbekannt,
+        # _LEGACY = Server kennt HELLO nicht; eine leere Menge heißt dagegen: HELLO ohne Frame-Format)
+        self._caps = {}
+
+    def _evict_expired(self, now):
+        """Schließt alle Verbindungen, die länger als idle_timeout unbenutzt sind."""
+        for key in list(self._idle):
+            alive = []
+            for channel in self._idle[key]:
+                if now - channel.last_used > self.idle_timeout:
+                    channel.sock.close()
+                else:
+                    alive.append(channel)
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
+
+    @staticmethod
+    def _is_usable(sock):
+        """
+        Prüft ohne zu blockieren, ob eine gepoolte Verbindung noch offen ist.
+        Nach dem HELLO antwortet der Server nur noch auf fortsetzbare Bilder (OFFSET, ACK/NAK).
+        Diese Antworten werden vollständig gelesen, bevor ein Kanal mit release() zurück in den
+        Pool geht (bei NAK oder Fehlern wird er geschlossen). Ist ein freier Socket lesbar, hat
+        die Gegenseite also geschlossen (EOF) oder die Verbindung ist gestört.
+        """
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    @staticmethod
+    def _hello(sock):
+        """
+        Sendet HELLO mit den eigenen Fähigkeiten und liest die Antwortzeile des Servers.
+        Rückgabe: Menge der gemeinsamen Fähigkeiten oder None, wenn der Server HELLO
+        nicht kennt (Verbindung ohne Antwort geschlossen oder eine andere Zeile als HELLO).
+        Wirft OSError (auch socket.timeout), wenn keine Antwort innerhalb HELLO_TIMEOUT kam
+        oder die Verbindung gestört ist; das sagt nichts über die Fähigkeiten des Servers aus.
+        """
+        timeout = sock.gettimeout()
+        sock.settimeout(HELLO_TIMEOUT if timeout is None else min(timeout, HELLO_TIMEOUT))
+        try:
+            sock.sendall(build_hello(CAPABILITIES))
+            reply = b''
+            while not reply.endswith(b'\n'):
+                chunk = sock.recv(256)
+                if not chunk:
+                    return None
+                reply += chunk
+        finally:
+            sock.settimeout(timeout)
+        cmd, args = parse_slcp_line(reply.decode('utf-8', errors='ignore'))
+        return parse_hello(args) if cmd == 'HELLO' else None
+
+    def connect(self, host, port, timeout=None):
+        """Baut eine neue Verbindung auf und handelt (falls möglich) das Frame-Format aus."""
+        key = (host, port)
+        start = time.perf_counter()
+        sock = socket.create_connection(key, timeout=timeout)
+        sock.settimeout(timeout)
+        REGISTRY.inc('connections_opened')
+        REGISTRY.observe('connect_seconds', time.perf_counter() - start)
+        with self._lock:
+            known = key in self._caps
+            caps = self._caps.get(key)
+        if not CAPABILITIES:
+            return _Channel(sock, False)
+        # Peers, die HELLO nachweislich nicht kennen, bekommen direkt das Textformat (einmalige Verbindung)
+        if known and caps is _LEGACY:
+            return _Channel(sock, False, reusable=False)
+        if known and not caps:
+            # HELLO bekannt, aber kein Frame-Format: Textformat auf einer Keep-Alive-Verbindung
+            return _Channel(sock, False)
+        try:
+            caps = self._hello(sock)
+        except OSError:
+            # Langsame Antwort oder gestörte Verbindung: nur diese Verbindung im Textformat und
+            # ohne Wiederverwendung (ein älterer Server könnte nur gerade beschäftigt sein);
+            # beim nächsten Verbindungsaufbau wird erneut ausgehandelt
+            REGISTRY.inc('hello_failures')
+            caps = None
+        else:
+            # Nur eine echte Antwort (HELLO bzw. keine HELLO-Zeile) wird für den Peer gemerkt
+            with self._lock:
+                self._caps[key] = caps
+        if caps is None:
+            # Älterer Server bzw. HELLO gescheitert: Verbindung ist unbrauchbar, neu aufbauen
+            sock.close()
+            sock = socket.create_connection(key, timeout=timeout)
+            sock.settimeout(timeout)
+            return _Channel(sock, False, reusable=False)
+        return _Channel(sock, 'framed' in caps, 'zlib' in caps, 'resume' in caps)
+
+    def acquire(self, host, port, timeout=None):
+        """
+        Liefert (kanal, wiederverwendet) für das Ziel. Der Kanal gehört bis zu
+        release() exklusiv dem Aufrufer. timeout gilt für Verbindungsaufbau und Senden.
+        """
+        key = (host, port)
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            entries = self._idle.get(key, [])
+            while entries:
+                channel = entries.pop()
+                if self._is_usable(channel.sock):
+                    channel.sock.settimeout(timeout)
+                    REGISTRY.inc('connections_reused')
+                    return channel, True
+                channel.sock.close()
+        # Keine offene Verbindung vorhanden: neue aufbauen (außerhalb des Locks)
+        return self.connect(host, port, timeout), False
+
+    def release(self, host, port, channel):
+        """
+        Gibt eine intakte Verbindung nach dem Senden an den Pool zurück.
+        Alle Antworten des Servers auf diesem Kanal müssen bereits gelesen sein (siehe _is_usable).
+        """
+        channel.last_used = time.monotonic()
+        with self._lock:
+            self._idle.setdefault((host, port), []).append(channel)
+
+    def close_all(self):
+        """Schließt alle Verbindungen im Pool (z. B. beim Beenden)."""
+        with self._lock:
+            for entries in self._idle.values():
+                for channel in entries:
+                    channel.sock.close()
+            self._idle.clear()
+
+
+# Gemeinsamer Pool für alle Sende-Funktionen dieses Prozesses
+_pool = _ConnectionPool()
+atexit.register(_pool.close_all)
+
+
+# Thread-Pool für das parallele Senden an mehrere Peers (wird bei Bedarf erzeugt)
+_fanout_executor = None
+
+
+def _send_pooled(target_host, target_port, send, timeout=None):
+    """
+    Führt send(kanal) über eine gepoolte Verbindung aus. Einmalige Verbindungen zu älteren
+    Servern (nicht reusable) werden danach geschlossen statt zurück in den Pool gelegt.
+    Schlägt das Senden über eine wiederverwendete Verbindung fehl (z. B. weil der
+    Server sie gerade geschlossen hat), wird einmal über eine neue Verbindung wiederholt –
+    außer bei DeliveryUncertainError, dann waren die Nutzdaten schon vollständig gesendet.
+    """
+    channel, reused = _pool.acquire(target_host, target_port, timeout)
+    try:
+        send(channel)
+    except DeliveryUncertainError:
+        channel.sock.close()
+        raise
+    except OSError:
+        channel.sock.close()
+        if not reused:
+            raise
+        # Zweiter Versuch über eine frische Verbindung
+        REGISTRY.inc('send_retries')
+        channel = _pool.connect(target_host, target_port, timeout)
+        try:
+            send(channel)
+        except OSError:
+            channel.sock.close()
+            raise
+    if not channel.reusable:
+        # Älterer Server liest nur diese eine Nachricht; die Verbindung wird nicht wiederverwendet
+        channel.sock.close()
+        return
+    _pool.release(target_host, target_port, channel)
+
 def _send_discovery(msg: bytes, config: dict) -> None:
     """Funktion zum Senden von Discovery-Nachrichten (JOIN, WHO, LEAVE) an den Server.
 
 
-    Senden einer discovery message via broadcast.
+    Senden einer discovery message via Broadcast bzw. an die Multicast-Gruppe.
 
     Fällt nur dann auf 127.0.0.1 zurück, wenn die konfigurierte
     Broadcast-Adresse selbst im 127.0.0.0/8-Netz liegt. Dadurch wird
     vermieden, dass Peers im LAN versehentlich die localhost-Adresse
     austauschen und Nachrichten an sich selbst schicken.
     """
-    # Erstelle einen UDP-Socket für den Broadcast
+    # Erstelle einen UDP-Socket für den Broadcast bzw. Multicast
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    # Setze die Socket-Optionen für Wiederverwendbarkeit und Broadcast
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    # Setze die Socket-Optionen für Broadcast bzw. Multicast (TTL, Loopback, Schnittstelle)
+    configure_discovery_sender(sock, config)
+    target = discovery_address(config)
     try:
-        # Sende die Nachricht an die konfigurierte Broadcast-Adresse und den Port
-        sock.sendto(msg, (config['broadcast'], config['whoisport']))
+        # Sende die Nachricht an die konfigurierte Broadcast-Adresse bzw. Gruppe und den Port
+        sock.sendto(msg, target)
     except OSError as e:
         # Fallback nur bei lokalen Broadcast-Adressen verwenden
-        if e.errno == 101 and config['broadcast'].startswith('127.'):
+        if e.errno == 101 and target[0].startswith('127.'):
             # Sende die Nachricht an localhost, wenn die Broadcast-Adresse im Loopback-Bereich liegt
             sock.sendto(msg, ("127.0.0.1", config['whoisport']))
         else:
             raise
     finally:
         sock.close()
+    REGISTRY.inc('discovery_sent')
 
 def client_send_join(config):
     """Funktion zum Senden einer JOIN-Nachricht an den Server"""
     # Erstelle eine JOIN-Nachricht mit dem Handle und Port aus der Konfiguration
     msg = build_join(config['handle'], config['port'])
     _send_discovery(msg, config)
+    PROFILE.mark_once("erstes JOIN gesendet")
 
-def client_send_who(config):
-    """Funktion zum Senden einer WHO-Nachricht an den Server"""
+def client_send_who(config, peers=None):
+    """
+    Funktion zum Senden einer WHO-Nachricht an den Server.
+    peers: eigene bekannte Peerliste; Peers, die nichts darüber hinaus wissen, antworten dann nicht.
+    """
     # Erstelle eine WHO-Nachricht, um die Liste der aktiven Clients abzufragen
-    msg = build_who()
+    msg = build_who(peers)
     _send_discovery(msg, config)
 
 def client_send_leave(config):
@@ -62,29 +343,212 @@ def client_send_leave(config):
     # Sende die LEAVE-Nachricht an den Server
     _send_discovery(msg, config)
 
-def client_send_msg(target_host: str, target_port: int, from_handle: str, text: str):
-    """Funktion zum Senden einer MSG-Nachricht an einen bestimmten Host und Port"""
-    # Sende eine Textnachricht über TCP.
-    with socket.create_connection((target_host, target_port)) as sock:
-        # Erstelle die Nachricht im SLCP-Format
-        data = build_msg(from_handle, text)
-        # Sende die Nachricht an den angegebenen Host und Port
-        sock.sendall(data)
+def client_send_msg(target_host: str, target_port: int, from_handle: str, text: str, timeout=None,
+                    compress_threshold=COMPRESS_THRESHOLD):
+    """
+    Funktion zum Senden einer MSG-Nachricht an einen bestimmten Host und Port.
+    compress_threshold: Nachrichten ab dieser Größe (Bytes) komprimiert senden, falls der Peer zlib kann (0 = nie).
+    """
+    def send(channel):
+        # Erstelle die Nachricht im ausgehandelten Format (komprimierter Frame, Frame oder SLCP-Textzeile)
+        if channel.compress:
+            data = _build_msg_frame_compressed(from_handle, text, compress_threshold)
+        elif channel.framed:
+            data = build_msg_frame(from_handle, text)
+        else:
+            data = build_msg(from_handle, text)
+        channel.sock.sendall(data)
+        REGISTRY.inc('bytes_sent', len(data))
+
+    start = time.perf_counter()
+    # Sende die Nachricht über eine (möglichst bereits offene) TCP-Verbindung
+    try:
+        _send_pooled(target_host, target_port, send, timeout)
+    except OSError:
+        REGISTRY.inc('send_failures')
+        raise
+    REGISTRY.inc('messages_sent')
+    REGISTRY.observe('send_msg_seconds', time.perf_counter() - start)
+
+def _build_msg_frame_compressed(from_handle, text, threshold):
+    """MSG-Frame, ab threshold Bytes komprimiert; zählt die Größe vorher/nachher für die Metriken."""
+    payload = msg_frame_payload(from_handle, text)
+    if not threshold or len(payload) < threshold:
+        return encode_frame(FRAME_MSG, payload)
+    # Rechenzeit auch zählen, wenn sich die Kompression nicht lohnt (Ergebnis nicht kleiner)
+    start = time.perf_counter()
+    packed = compress_payload(payload, threshold)
+    REGISTRY.observe('compress_seconds', time.perf_counter() - start)
+    if packed is None:
+        return encode_frame(FRAME_MSG, payload)
+    REGISTRY.inc('compress_bytes_before', len(payload))
+    REGISTRY.inc('compress_bytes_after', len(packed))
+    return encode_frame(FRAME_MSG_Z, packed)
+
+def client_send_msg_all(peers: dict, from_handle: str, text: str, timeout=SEND_TIMEOUT):
+    """
+    Funktion zum parallelen Senden einer MSG-Nachricht an alle Peers (handle -> (host, port)).
+    Jeder Peer hat eine eigene Deadline von timeout Sekunden, sodass ein nicht erreichbarer
+    Peer die anderen nicht aufhält.
+    Rückgabe: Dictionary mit den Listen 'ok', 'failed' und 'timeout' (jeweils Handles).
+    """
+    global _fanout_executor
+    result = {'ok': [], 'failed': [], 'timeout': []}
+    if not peers:
+        return result
+    if _fanout_executor is None:
+        _fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS)
+    start = time.perf_counter()
+    # Pro Peer einen Sende-Auftrag starten
+    futures = {
+        _fanout_executor.submit(client_send_msg, host, port, from_handle, text, timeout): handle
+        for handle, (host, port) in peers.items()
+    }
+    # Gesamtdauer: eine Deadline pro "Runde" von FANOUT_WORKERS gleichzeitigen Sendungen
+    rounds = -(-len(futures) // FANOUT_WORKERS)
+    done, not_done = wait(futures, timeout=timeout * rounds + 0.5)
+    for future in done:
+        handle = futures[future]
+        error = future.exception()
+        if error is None:
+            result['ok'].append(handle)
+        elif isinstance(error, socket.timeout):
+            result['timeout'].append(handle)
+        else:
+            result['failed'].append(handle)
+    # Aufträge, die bis zur Deadline nicht fertig wurden, gelten als Timeout
+    for future in not_done:
+        result['timeout'].append(futures[future])
+    REGISTRY.observe('msgall_seconds', time.perf_counter() - start)
+    REGISTRY.inc('msgall_failed', len(result['failed']))
+    REGISTRY.inc('msgall_timeout', len(result['timeout']))
+    return result
     
-def client_send_img(target_host: str, target_port: int, from_handle: str, img_path: str):
+# (Pfad, Größe, Änderungszeit) -> SHA-256 (hex), älteste zuerst
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def _file_digest(path):
+    """SHA-256 einer Datei; wiederholte Sendeversuche derselben unveränderten Datei lesen sie nicht erneut."""
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_cache.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        with _digest_lock:
+            _digest_cache[key] = digest
+            while len(_digest_cache) > DIGEST_CACHE_SIZE:
+                del _digest_cache[next(iter(_digest_cache))]
+    return digest
+
+
+def _read_reply(sock):
+    """Liest eine Antwortzeile des Servers (OFFSET/ACK/NAK) byteweise, damit nichts darüber hinaus gelesen wird."""
+    timeout = sock.gettimeout()
+    if timeout is None:
+        sock.settimeout(REPLY_TIMEOUT)
+    try:
+        line = b''
+        while not line.endswith(b'\n'):
+            char = sock.recv(1)
+            if not char:
+                raise ConnectionError("Verbindung während der Bildübertragung geschlossen")
+            line += char
+    finally:
+        sock.settimeout(timeout)
+    return parse_slcp_line(line.decode('utf-8', errors='ignore'))
+
+
+def _send_img(target_host, target_port, from_handle, size, send_body, timeout, digest=None):
+    """
+    Sendet einen IMG-Header und danach den Bildinhalt über send_body(sock, offset).
+    digest: Funktion, die den SHA-256 (hex) des Inhalts liefert; wird nur für fortsetzbare Übertragungen aufgerufen.
+    """
+    def send(channel):
+        if channel.resume and digest is not None:
+            _send_img_resumable(channel.sock, from_handle, size, digest(), send_body)
+            return
+        # Erstelle den Header mit dem Handle und der Größe des Bildes im ausgehandelten Format
+        if channel.framed:
+            header = build_img_frame(from_handle, size)
+        else:
+            header = build_img(from_handle, size)
+        # Sende den Header und dann den Bildinhalt
+        channel.sock.sendall(header)
+        send_body(channel.sock, 0)
+
+    start = time.perf_counter()
+    try:
+        _send_pooled(target_host, target_port, send, timeout)
+    except OSError:
+        REGISTRY.inc('send_failures')
+        raise
+    REGISTRY.inc('images_sent')
+    REGISTRY.inc('bytes_sent', size)
+    REGISTRY.observe('send_img_seconds', time.perf_counter() - start)
+
+def _send_img_resumable(sock, from_handle, size, digest, send_body):
+    """Fortsetzbare Übertragung: Kopf senden, Offset abwarten, Rest senden, Prüfsummen-Bestätigung abwarten."""
+    sock.sendall(build_img_resume_frame(from_handle, size, digest))
+    cmd, args = _read_reply(sock)
+    try:
+        offset = int(args[0]) if cmd == 'OFFSET' and args else -1
+    except ValueError:
+        offset = -1
+    if not 0 <= offset <= size:
+        raise ConnectionError(f"Ungültige Antwort auf IMG_RESUME: {cmd}")
+    if offset:
+        REGISTRY.inc('images_resumed')
+        REGISTRY.inc('resume_bytes_skipped', offset)
+    if offset < size:
+        send_body(sock, offset)
+    # Abschlusszeile immer lesen: erst danach ist der Kanal leer und darf zurück in den Pool
+    try:
+        cmd, _ = _read_reply(sock)
+    except OSError as e:
+        # Alle Bytes sind beim Empfänger; ob er das Bild schon gemeldet hat, ist unbekannt
+        REGISTRY.inc('send_uncertain')
+        raise DeliveryUncertainError(f"Keine Bestätigung für das Bild: {e}") from e
+    if cmd != 'ACK':
+        # Prüfsumme stimmt nicht: Empfänger hat die Datei verworfen, der nächste Versuch beginnt von vorn
+        REGISTRY.inc('images_nak')
+        raise ConnectionError("Empfänger hat das Bild verworfen (Prüfsumme)")
+
+def client_send_img(target_host: str, target_port: int, from_handle: str, img_path: str, timeout=None):
     """Funktion zum Senden eines Bildes an einen bestimmten Host und Port"""
    # Überprüfe, ob der angegebene Pfad zu einem Bild existiert
     if not os.path.isfile(img_path):
         return False
     size = os.path.getsize(img_path)
-    # Überprüfe, ob die Bildgröße größer als 0 ist
-    with socket.create_connection((target_host, target_port)) as sock:
-        # Sende den Header mit dem Handle und der Größe des Bildes
-        header = build_img(from_handle, size)
-        # Sende den Header und dann den Bildinhalt
-        sock.sendall(header)
-        # Öffne das Bild im Binärmodus und sende den Inhalt
+    def send_body(sock, offset):
+        # Öffne das Bild im Binärmodus und sende den Inhalt (ab offset)
         with open(img_path, 'rb') as f:
-            # Sende den Bildinhalt über den Socket
-            sock.sendall(f.read())
-    return True
\ No newline at end of file
+            # sendfile überträgt die Datei ohne Umweg über den Python-Speicher (zero-copy);
+            # genau die im Header angekündigten Bytes, auch wenn die Datei inzwischen gewachsen ist
+            sent = sock.sendfile(f, offset, size - offset)
+        if sent != size - offset:
+            # Datei ist geschrumpft: Der Empfänger würde auf Bytes warten, die nie kommen
+            raise ConnectionError(f"{img_path}: nur {sent} von {size - offset} Bytes gesendet (Datei verändert)")
+
+    _send_img(target_host, target_port, from_handle, size, send_body, timeout, lambda: _file_digest(img_path))
+    return True
+
+def client_send_img_data(target_host: str, target_port: int, from_handle: str, data, timeout=None, digest=None):
+    """
+    Sendet ein bereits gelesenes bzw. per mmap eingeblendetes Bild (bytes-artiges Objekt).
+    Wird von imgall genutzt: die Datei wird einmal gelesen und derselbe Puffer an alle Peers gesendet.
+    digest: SHA-256 (hex) des Inhalts, falls schon bekannt (sonst bei Bedarf berechnet).
+    """
+    def send_body(sock, offset):
+        # Über einen memoryview senden, damit der Puffer nicht kopiert wird
+        with memoryview(data) as view, view[offset:] as rest:
+            sock.sendall(rest)
+
+    _send_img(target_host, target_port, from_handle, len(data), send_body, timeout,
+              (lambda: digest) if digest is not None else (lambda: hashlib.sha256(data).hexdigest()))
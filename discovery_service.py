@@ -1,103 +1,566 @@
 # File: discovery_service.py
 
 import socket
-from slcp_handler import parse_slcp_line, build_knowusers
-import toml
+import struct
+import sys
+import queue
+import random
+import select
+import time
+from slcp_handler import (parse_slcp_line, build_knowusers_pages, parse_knowusers, build_alive, build_caps, peer_digest,
+                          compress_knowusers, decompress_payload, KNOWUSERS_PAGE_SIZE, KNOWUSERS_Z_PREFIX,
+                          COMPRESS_THRESHOLD)
+from peer_table import PeerTable
+from metrics import REGISTRY, STATS_INTERVAL, queue_depth
 
 """
 @file discovery_service.py
 @brief Discovery Service:
  - Lauscht per UDP auf dem in der Konfiguration angegebenen Port (config['whoisport'])
- - Verarbeitet SLCP-Befehle: JOIN, WHO, LEAVE und KNOWUSERS.
+ - Verarbeitet SLCP-Befehle: JOIN, WHO, LEAVE, KNOWUSERS und ALIVE.
  - Speichert eine lokale Peerliste, die jedem Handle (Benutzername) eine IP und einen Port zuordnet.
- - Sendet KNOWUSERS-Antworten per Broadcast an alle Peers.
+ - Sendet KNOWUSERS-Antworten per Broadcast an alle Peers. Große Peerlisten werden auf mehrere
+   Datagramme (Seiten) verteilt, die einzeln übernommen werden, sobald sie eintreffen.
+ - Antwortunterdrückung (wie bei mDNS): Auf JOIN und WHO antwortet nicht jeder Peer sofort, sondern
+   nach einer zufälligen Wartezeit von bis zu config['response_jitter'] Sekunden. Hat bis dahin ein
+   anderer Peer KNOWUSERS-Seiten geschickt, die alle eigenen Einträge enthalten, entfällt die eigene
+   Antwort. Ein JOIN kostet so etwa eine Antwort statt einer pro Peer, der Verkehr wächst linear
+   statt quadratisch mit der Anzahl der Peers.
+   "WHO <anzahl> <digest>" enthält den Fingerabdruck der Peerliste des Fragenden; Peers mit
+   demselben Digest haben nichts Neues und antworten nicht. Ein einfaches "WHO" (ältere Clients)
+   wird wie bisher sofort direkt an den Absender beantwortet.
+ - Meldet der Oberfläche nur tatsächliche Änderungen der Peerliste als versioniertes Delta
+   ('PEERS_DELTA', ...) und auf Anfrage ('RESYNC',) eine vollständige Kopie ('PEERS', ...).
+ - Lebendigkeit: Solange der Nutzer beigetreten ist (('JOINED', handle, port) von der Oberfläche),
+   wird alle config['heartbeat_interval'] Sekunden ein leichtgewichtiges ALIVE gesendet.
+   Peers, von denen länger als config['peer_ttl'] Sekunden nichts (JOIN/ALIVE) kam, werden
+   entfernt – auch ohne LEAVE, z. B. nach einem Absturz. Abgelaufene oder gegangene Peers werden
+   danach eine TTL lang nicht aus den KNOWUSERS-Listen Dritter übernommen, sondern nur durch ein
+   eigenes JOIN/ALIVE; sonst würden sich die Knoten einen toten Peer gegenseitig zurückgeben.
+ - Zählt empfangene/gesendete Pakete und Bytes pro Befehl (siehe metrics) und schickt alle
+   config['stats_interval'] Sekunden einen Schnappschuss ('STATS', 'discovery', ...) an die Oberfläche.
+ - Transport: Mit config['discovery_mode'] = "multicast" läuft die gesamte Discovery (JOIN/WHO/LEAVE,
+   KNOWUSERS, ALIVE) statt per Broadcast über die IP-Multicast-Gruppe config['multicast_group'].
+   Nur Rechner, die der Gruppe beigetreten sind, bekommen die Pakete; alle anderen Rechner im
+   Segment müssen sie nicht mehr empfangen und verwerfen. TTL (config['multicast_ttl']), Loopback
+   (config['multicast_loop']) und Schnittstelle (config['multicast_interface'], z. B. "127.0.0.1"
+   zum Testen auf einem Rechner) sind einstellbar. Alle Peers müssen denselben Modus verwenden.
+ - Kompression: Jeder Peer meldet mit "CAPS <handle> zlib" (beim Beitreten und mit jedem Heartbeat),
+   dass er komprimierte KNOWUSERS-Datagramme versteht. Nur wenn das alle bekannten Peers getan haben,
+   werden Antworten an alle ab config['compress_threshold'] Bytes als "KNOWUSERSZ <zlib>" gesendet;
+   eine komprimierte Seite fasst dann bis zu COMPRESSED_PAGE_FACTOR-mal so viele Einträge. Ältere
+   Peers ignorieren CAPS, deshalb bekommen sie weiterhin unkomprimierte Listen.
+   Gezählt werden 'compress_bytes_before'/'compress_bytes_after' und 'compress_seconds'.
+ - Empfang in Stapeln: Der Socket wird nicht blockierend geleert (bis config['discovery_batch']
+   Datagramme pro Durchgang, Empfangspuffer config['discovery_rcvbuf'] Bytes). Erst werden alle
+   Änderungen des Stapels übernommen, danach folgen eine gemeinsame KNOWUSERS-Antwort und ein
+   einziges Delta an die Oberfläche. Startet ein ganzer Raum voller Clients gleichzeitig, wird die
+   Peerliste so einmal pro Stapel statt einmal pro JOIN aufgebaut und verschickt.
+   Gezählt werden 'packets_late' (lagen beim Lesen schon im Empfangspuffer) und unter Linux
+   'packets_dropped' (vom Kernel wegen vollen Empfangspuffers verworfen, über SO_RXQ_OVFL).
+ - Die Protokolllogik steckt in DiscoveryService und ist unabhängig von der Ereignisschleife:
+   discovery_loop betreibt sie blockierend im eigenen Prozess, async_runtime auf einer asyncio-Schleife.
 """
 
-def discovery_loop(config, interface_queue):
-    """Funktion namens `discovery_loop`, die den Discovery-Service implementiert."""
-    # Erstelle ein leeres Array zum Speichern der bekannten Peers.
-    # Jeder Eintrag hat die Form: handle -> (IP-Adresse, Port)
-    peers = {} 
-    
-    # Liest den UDP-Port für Discovery aus der Konfiguration
-    whoisport = config['whoisport']
+# Standardwert: Sekunden zwischen zwei eigenen ALIVE-Nachrichten
+HEARTBEAT_INTERVAL = 10
+# Standardwert: Sekunden ohne Lebenszeichen, nach denen ein Peer als verschwunden gilt
+PEER_TTL = 35
+# Befehle, für die eigene Empfangszähler geführt werden
+COUNTED_COMMANDS = ('JOIN', 'WHO', 'LEAVE', 'KNOWUSERS', 'ALIVE', 'CAPS')
+# Unkomprimierte Größe einer komprimierten KNOWUSERS-Seite im Verhältnis zu discovery_page_size
+COMPRESSED_PAGE_FACTOR = 4
+# Maximale Größe eines entpackten KNOWUSERS-Datagramms
+MAX_DATAGRAM = 65535
+# Standardwert: maximale zufällige Wartezeit in Sekunden vor einer KNOWUSERS-Antwort an alle
+RESPONSE_JITTER = 0.25
+# Standardwert: maximale Anzahl Datagramme, die in einem Durchgang gelesen und gemeinsam beantwortet werden
+DISCOVERY_BATCH = 256
+# Standardwert: gewünschte Größe des Empfangspuffers des Discovery-Sockets in Bytes
+DISCOVERY_RCVBUF = 1024 * 1024
+# Socket-Option für den Zähler verworfener Datagramme (nur Linux; Python kennt keine Konstante dafür)
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
+# Standardwert: Transport der Discovery ("broadcast" oder "multicast")
+DISCOVERY_MODE = "broadcast"
+# Standardwert: Multicast-Gruppe (organisationslokaler Bereich 239.255.0.0/16)
+MULTICAST_GROUP = "239.255.42.99"
+# Standardwert: TTL der Multicast-Pakete (1 = bleibt im lokalen Segment)
+MULTICAST_TTL = 1
+# Standardwert: eigene Multicast-Pakete auch selbst empfangen (mehrere Clients auf einem Rechner)
+MULTICAST_LOOP = True
 
-    # Erstellt einen UDP-Socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    # Setze SO_REUSEADDR, damit der Socket sofort wieder genutzt werden kann,
-    # falls er kürzlich geschlossen wurde. Zusätzlich SO_REUSEPORT, um mehrere
-    # Clients auf dem gleichen Discovery-Port zu erlauben.
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    if hasattr(socket, "SO_REUSEPORT"):
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-    
-    # Binde den Socket an alle verfügbaren Netzwerkschnittstellen und den Discovery-Port.
-    sock.bind(("", whoisport))
+def is_multicast(config):
+    """True, wenn die Discovery per Multicast statt per Broadcast läuft."""
+    return config.get('discovery_mode', DISCOVERY_MODE) == 'multicast'
 
-    print(f"[Discovery] Service gestartet auf Port {whoisport}")
 
-    # Loop, der Discovery-Service hört auf eingehende UDP-Nachrichten.
-    while True:
-        # Empfang der Daten (bis zu 65535 Bytes) sowie der Absenderadresse (IP, Port)
-        data, addr = sock.recvfrom(65535)
-        
+def discovery_address(config):
+    """Zieladresse (host, port) für Discovery-Pakete an alle: Broadcast-Adresse bzw. Multicast-Gruppe."""
+    if is_multicast(config):
+        return (config.get('multicast_group', MULTICAST_GROUP), config['whoisport'])
+    return (config['broadcast'], config['whoisport'])
+
+
+def describe_transport(config):
+    """Kurzbeschreibung des Transports für Startmeldungen."""
+    if is_multicast(config):
+        return f"Multicast {config.get('multicast_group', MULTICAST_GROUP)}"
+    return f"Broadcast {config['broadcast']}"
+
+
+def configure_discovery_sender(sock, config):
+    """Setzt die Sendeoptionen eines UDP-Sockets für discovery_address() (Broadcast bzw. Multicast)."""
+    if is_multicast(config):
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, config.get('multicast_ttl', MULTICAST_TTL))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP,
+                        1 if config.get('multicast_loop', MULTICAST_LOOP) else 0)
+        interface = config.get('multicast_interface', "")
+        if interface:
+            # Ausgehende Schnittstelle (sonst die der Standardroute)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+
+class DiscoveryService:
+    """
+    Zustand und Protokolllogik des Discovery-Service.
+    Die Klasse besitzt keinen eigenen Socket: Empfangene Datagramme werden mit handle_batch()
+    bzw. handle_datagram() übergeben, gesendet wird über die Funktion send_datagram(data, (host, port)).
+    """
+
+    def __init__(self, config, interface_queue, send_datagram, metrics=REGISTRY):
+        self.config = config
+        # Queue zur Oberfläche (Deltas, vollständige Kopien und Metriken)
+        self.interface_queue = interface_queue
+        self.send_datagram = send_datagram
+        self.metrics = metrics
+        # Erstelle eine leere, versionierte Peerliste zum Speichern der bekannten Peers.
+        # Jeder Eintrag hat die Form: handle -> (IP-Adresse, Port)
+        self.table = PeerTable()
+        self.peers = self.table.peers
+        # Liest den UDP-Port für Discovery aus der Konfiguration
+        self.whoisport = config['whoisport']
+        # Ziel für Pakete an alle (Broadcast-Adresse oder Multicast-Gruppe)
+        self.group_address = discovery_address(config)
+        # Maximale Größe einer KNOWUSERS-Seite (unterhalb der MTU, damit nicht fragmentiert wird)
+        self.page_size = config.get('discovery_page_size', KNOWUSERS_PAGE_SIZE)
+        # Heartbeat-Intervall und Lebensdauer eines Peers ohne Lebenszeichen
+        self.heartbeat_interval = config.get('heartbeat_interval', HEARTBEAT_INTERVAL)
+        self.peer_ttl = config.get('peer_ttl', PEER_TTL)
+        # Abstand zwischen zwei Metrik-Schnappschüssen an die Oberfläche
+        self.stats_interval = config.get('stats_interval', STATS_INTERVAL)
+        # handle -> Zeitpunkt (time.monotonic) des letzten Lebenszeichens
+        self.last_seen = {}
+        # handle -> Zeitpunkt, zu dem der Peer abgelaufen ist bzw. LEAVE gesendet hat
+        self.departed = {}
+        # Eigener Handle und Port, solange der Nutzer beigetreten ist (sonst None)
+        self.own_handle = None
+        self.own_port = None
+        # Zeitpunkt des nächsten eigenen Heartbeats
+        self.next_heartbeat = 0.0
+        # Komprimierte KNOWUSERS ab dieser Größe (0 = aus); eigene und bekannte Fähigkeiten der Peers
+        self.compress_threshold = config.get('compress_threshold', COMPRESS_THRESHOLD)
+        self.capabilities = {'zlib'} if self.compress_threshold else set()
+        self.peer_caps = {}
+        # Maximale zufällige Wartezeit vor einer Antwort an alle
+        self.response_jitter = config.get('response_jitter', RESPONSE_JITTER)
+        # Antworten, die am Ende des aktuellen Stapels gemeinsam gesendet bzw. eingeplant werden:
+        # ob die Liste an alle geht, IPs neuer Peers (direkt) und Adressen einfacher WHO-Anfragen
+        self._announce = False
+        self._direct = set()
+        self._who = set()
+        # Zeitpunkt (time.monotonic) der eingeplanten Antwort an alle (None = keine)
+        self.response_due = None
+        # Seit dem Einplanen von anderen gesendete Einträge (handle, host, port)
+        self._seen = set()
+
+    def send(self, data, target):
+        """Sendet ein Datagramm und zählt es für die Metriken."""
+        self.send_datagram(data, target)
+        self.metrics.inc('packets_sent')
+        self.metrics.inc('bytes_sent', len(data))
+
+    def publish_changes(self):
+        """Schickt der Oberfläche ein Delta, falls sich die Peerliste geändert hat."""
+        delta = self.table.take_delta()
+        if delta is not None:
+            self.interface_queue.put(delta)
+
+    def handle_request(self, request):
+        """Bearbeitet eine Anfrage der Oberfläche."""
+        # Resync: vollständige Kopie der Peerliste senden
+        if request[0] == 'RESYNC':
+            self.interface_queue.put(self.table.snapshot())
+        # Nutzer ist beigetreten: ab jetzt Heartbeats für diesen Handle senden
+        elif request[0] == 'JOINED':
+            self.own_handle, self.own_port = request[1], request[2]
+            self.next_heartbeat = time.monotonic() + self.heartbeat_interval
+            self._announce_caps()
+        # Nutzer hat das Netzwerk verlassen: keine Heartbeats mehr
+        elif request[0] == 'LEFT':
+            self.own_handle = None
+
+    def tick(self, now):
+        """Regelmäßige Aufgaben: fällige Antwort senden, Heartbeat senden, abgelaufene Peers entfernen, Metriken melden."""
+        self.respond_due(now)
+        # Eigenen Heartbeat an alle senden (Broadcast bzw. Multicast-Gruppe)
+        if self.own_handle is not None and now >= self.next_heartbeat:
+            self.next_heartbeat = now + self.heartbeat_interval
+            try:
+                self.send(build_alive(self.own_handle, self.own_port), self.group_address)
+            except OSError:
+                pass
+            # Fähigkeiten mit jedem Heartbeat wiederholen, damit auch später gestartete Peers sie kennen
+            self._announce_caps()
+        # Peers ohne Lebenszeichen innerhalb der TTL entfernen (der eigene Eintrag bleibt bestehen)
+        expired = [h for h, seen in self.last_seen.items()
+                   if now - seen > self.peer_ttl and h != self.own_handle]
+        for h in expired:
+            del self.last_seen[h]
+            self.departed[h] = now
+            self.peer_caps.pop(h, None)
+            self.table.remove(h)
+            self.metrics.inc('peers_expired')
+        # Nach einer weiteren TTL dürfen Dritte den Peer wieder melden
+        for h in [h for h, gone in self.departed.items() if now - gone > self.peer_ttl]:
+            del self.departed[h]
+        # Regelmäßig Momentanwerte erfassen und einen Schnappschuss an die Oberfläche schicken
+        if self.metrics.publish_due(self.stats_interval):
+            self.metrics.set_gauge('peers', len(self.peers))
+            self.metrics.set_gauge('queue_depth', queue_depth(self.interface_queue))
+            self.metrics.publish(self.interface_queue, 'discovery')
+
+    def handle_datagram(self, data, addr, now):
+        """Verarbeitet ein einzelnes empfangenes Datagramm von addr (IP, Port)."""
+        self.handle_batch([(data, addr)], now)
+
+    def handle_batch(self, datagrams, now):
+        """
+        Verarbeitet einen Stapel empfangener Datagramme [(data, addr)]: erst alle Änderungen,
+        dann gemeinsame Antworten und höchstens ein Delta an die Oberfläche.
+        """
+        start = time.perf_counter()
+        self.metrics.inc('batches')
+        # Alle außer dem ersten Datagramm haben im Empfangspuffer gewartet
+        if len(datagrams) > 1:
+            self.metrics.inc('packets_late', len(datagrams) - 1)
+        for data, addr in datagrams:
+            self._apply(data, addr, now)
+        self._flush_responses(now)
+        # Ohne Wartezeit (response_jitter = 0) wird die Antwort sofort gesendet
+        self.respond_due(now)
+        # Informiere die übergeordnete Anwendung (z.B. die CLI) über Änderungen in der Peerliste.
+        # Es wird nur ein Delta verschickt, wenn sich durch den Stapel tatsächlich etwas geändert hat.
+        self.publish_changes()
+        self.metrics.observe('handle_seconds', time.perf_counter() - start)
+
+    def _flush_responses(self, now):
+        """Beantwortet einfache WHO-Anfragen des Stapels und plant die Antwort an alle ein."""
+        if self._who:
+            # Antwort an jeden anfragenden Peer (Adresse aus der WHO-Anfrage)
+            self._send_pages(build_knowusers_pages(self.peers, self.page_size), self._who)
+            self._who.clear()
+        if self._announce:
+            self._announce = False
+            if self.response_due is None:
+                # Zufällige Wartezeit, damit nicht alle Peers gleichzeitig antworten
+                self.response_due = now + random.uniform(0, self.response_jitter)
+                self._seen.clear()
+            else:
+                # Eine Antwort ist schon eingeplant und enthält dann auch diese Änderungen
+                self.metrics.inc('responses_coalesced')
+
+    def respond_due(self, now):
+        """Sendet die eingeplante Antwort an alle, sobald sie fällig ist, sofern sie nicht überflüssig geworden ist."""
+        if self.response_due is None or now < self.response_due:
+            return
+        self.response_due = None
+        direct = [(host, self.whoisport) for host in self._direct]
+        self._direct.clear()
+        view = {(h, host, port) for h, (host, port) in self.peers.items()}
+        if view <= self._seen:
+            # Ein anderer Peer hat bereits alles geschickt, was wir wissen
+            self.metrics.inc('responses_suppressed')
+            return
+        # An alle (Broadcast bzw. Multicast-Gruppe), damit alle Instanzen aktualisieren,
+        # zusätzlich direkt an jeden neuen Peer
+        self._send_pages(self._group_pages(), [self.group_address] + direct)
+
+    def _announce_caps(self):
+        """Gibt die eigenen Discovery-Fähigkeiten an alle bekannt (nur, wenn es welche gibt)."""
+        if self.capabilities and self.own_handle is not None:
+            try:
+                self.send(build_caps(self.own_handle, self.capabilities), self.group_address)
+            except OSError:
+                pass
+
+    def _group_pages(self):
+        """KNOWUSERS-Seiten für eine Antwort an alle; komprimiert, wenn alle bekannten Peers zlib unterstützen."""
+        if 'zlib' not in self.capabilities or any(
+                'zlib' not in self.peer_caps.get(h, ()) for h in self.peers if h != self.own_handle):
+            return build_knowusers_pages(self.peers, self.page_size)
+        start = time.perf_counter()
+        # Größere Seiten komprimieren; passt eine nicht in ein Datagramm, mit normaler Seitengröße
+        for budget in (self.page_size * COMPRESSED_PAGE_FACTOR, self.page_size):
+            raw = build_knowusers_pages(self.peers, budget)
+            pages = [compress_knowusers(page, self.compress_threshold) or page for page in raw]
+            if all(len(page) <= self.page_size for page in pages):
+                break
+        self.metrics.observe('compress_seconds', time.perf_counter() - start)
+        self.metrics.inc('compress_bytes_before', sum(len(page) for page in raw))
+        self.metrics.inc('compress_bytes_after', sum(len(page) for page in pages))
+        return pages
+
+    def next_timeout(self, now, default):
+        """Sekunden bis zur eingeplanten Antwort, höchstens default (für das Warten auf Datagramme)."""
+        if self.response_due is None:
+            return default
+        return max(0.0, min(default, self.response_due - now))
+
+    def _send_pages(self, pages, targets):
+        """Sendet alle KNOWUSERS-Seiten an jedes Ziel."""
+        for target in targets:
+            for page in pages:
+                try:
+                    self.send(page, target)
+                except OSError:
+                    # Ein nicht erreichbares Ziel verhindert nicht die Antworten an die übrigen
+                    self.metrics.inc('send_errors')
+
+    def _apply(self, data, addr, now):
+        """Übernimmt ein Datagramm in die Peerliste und merkt nötige Antworten für _flush_responses vor."""
+        self.metrics.inc('packets_received')
+        self.metrics.inc('bytes_received', len(data))
         try:
+            # Komprimierte KNOWUSERS-Seite zuerst entpacken (begrenzt auf MAX_DATAGRAM Bytes)
+            if data.startswith(KNOWUSERS_Z_PREFIX):
+                packed = len(data)
+                data = decompress_payload(data[len(KNOWUSERS_Z_PREFIX):], MAX_DATAGRAM)
+                self.metrics.inc('decompress_bytes_before', packed)
+                self.metrics.inc('decompress_bytes_after', len(data))
             # Versucht, die empfangenen Daten als UTF-8-Zeichenkette zu decodieren.
             line = data.decode('utf-8')
             # Parset die Zeichenkette in einen Befehl (cmd) und eine Liste von Argumenten (args).
             cmd, args = parse_slcp_line(line)
         except:
             # Falls ein Fehler bei der Decodierung oder beim Parsen auftritt, ignoriere diese Nachricht.
-            continue
+            self.metrics.inc('packets_invalid')
+            return
+        # Pro bekanntem Befehl zählen (unbekannte gemeinsam, damit die Zählerzahl begrenzt bleibt)
+        self.metrics.inc(f'received_{cmd}' if cmd in COUNTED_COMMANDS else 'received_other')
+        table = self.table
+        last_seen = self.last_seen
 
         # Verarbeitet den "JOIN"-Befehl
         if cmd == 'JOIN' and len(args) == 2:
             new_handle = args[0]              # Der Benutzername des neuen Peers.
-            new_port = int(args[1])           # Der Port, unter dem der neue Peer erreichbar ist.
+            try:
+                new_port = int(args[1])       # Der Port, unter dem der neue Peer erreichbar ist.
+            except ValueError:
+                # Ein fehlerhaftes JOIN darf den übrigen Stapel nicht abbrechen
+                self.metrics.inc('packets_invalid')
+                return
             # Fügt den neuen Peer in die Peerliste ein, wobei die IP aus der Absenderadresse (addr[0]) stammt.
-            peers[new_handle] = (addr[0], new_port)
-            # Erstellt eine Antwortnachricht (KNOWUSERS), die alle bekannten Peers enthält.
-            response = build_knowusers(peers)
-            # Sende die Antwort per Broadcast, damit alle Instanzen aktualisieren
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.sendto(response, (config['broadcast'], whoisport))
-            # Zusätzlich die Liste direkt an den neuen Peer schicken
-            sock.sendto(response, (addr[0], whoisport))
+            table.set(new_handle, (addr[0], new_port))
+            last_seen[new_handle] = now
+            self.departed.pop(new_handle, None)
+            # Die Liste geht nach einer zufälligen Wartezeit an alle und direkt an den neuen Peer;
+            # mehrere JOINs teilen sich diese Antwort
+            if self._announce:
+                self.metrics.inc('responses_coalesced')
+            self._announce = True
+            self._direct.add(addr[0])
 
         # Verarbeitet den "WHO"-Befehl
         elif cmd == 'WHO':
-            # Erstellt die KNOWUSERS-Antwort mit der aktuellen Peerliste.
-            response = build_knowusers(peers)
-            # Sendet die Antwort an den anfragenden Peer (Adresse in "addr").
-            sock.sendto(response, addr)
+            if len(args) == 2:
+                # "WHO <anzahl> <digest>": nur antworten, wenn die eigene Sicht davon abweicht;
+                # die Antwort geht dann wie bei JOIN verzögert und unterdrückbar an alle
+                if args[1] == peer_digest(self.peers):
+                    self.metrics.inc('who_ignored')
+                else:
+                    self._announce = True
+            else:
+                # Die KNOWUSERS-Seiten gehen am Ende des Stapels an den anfragenden Peer (Adresse in "addr").
+                self._who.add(addr)
 
-        # Verarbeite eine KNOWUSERS-Antwort
+        # Verarbeite eine KNOWUSERS-Antwort (eine einzelne Seite oder die ungeteilte Liste)
         elif cmd == 'KNOWUSERS' and args:
-            # args[0] enthält kommagetrennt alle handle:host:port Einträge
-            entries = args[0].split(',') if args[0] else []
-            for entry in entries:
-                try:
-                    h, host, port_str = entry.split(':')
-                    peers[h] = (host, int(port_str))
-                except ValueError:
+            # Die Einträge jeder Seite werden sofort übernommen, ohne auf die übrigen Seiten zu warten
+            _, _, entries = parse_knowusers(args)
+            # Für die Antwortunterdrückung merken, was andere bereits verschickt haben
+            if self.response_due is not None:
+                self._seen.update(entries)
+            for h, host, port in entries:
+                # Kürzlich abgelaufene/gegangene Peers nur über ihr eigenes JOIN/ALIVE wieder aufnehmen
+                if h in self.departed:
+                    self.metrics.inc('entries_departed')
                     continue
+                table.set(h, (host, port))
+                # Unbekannte Peers bekommen eine volle TTL; bekannte werden nur durch
+                # eigene Lebenszeichen (JOIN/ALIVE) aufgefrischt, nicht durch Dritte
+                last_seen.setdefault(h, now)
+
+        # Verarbeite einen Heartbeat (ALIVE <handle> <port>)
+        elif cmd == 'ALIVE' and len(args) == 2:
+            try:
+                alive_port = int(args[1])
+            except ValueError:
+                return
+            table.set(args[0], (addr[0], alive_port))
+            last_seen[args[0]] = now
+            self.departed.pop(args[0], None)
+
+        # Verarbeite die Fähigkeiten eines Peers (CAPS <handle> <fähigkeit,...>)
+        elif cmd == 'CAPS' and args:
+            self.peer_caps[args[0]] = {cap for cap in args[1].split(',') if cap} if len(args) > 1 else set()
 
         # Verarbeite den "LEAVE"-Befehl
         elif cmd == 'LEAVE' and len(args) == 1:
             leaving = args[0]   # Der Handle des Peers, der geht.
             # Entferne den Peer aus dem Dictionary, falls er vorhanden ist.
-            if leaving in peers:
-                del peers[leaving]
+            table.remove(leaving)
+            last_seen.pop(leaving, None)
+            self.departed[leaving] = now
+            self.peer_caps.pop(leaving, None)
 
-        # Informiere die übergeordnete Anwendung (z.B. die CLI) über Änderungen in der Peerliste.
-        # Hier wird eine Kopie der aktuellen Peerliste über eine IPC-Queue (cli_queue) verschickt.
-        interface_queue.put(('PEERS', peers.copy()))
+
+def create_discovery_socket(config):
+    """
+    Erstellt den UDP-Socket des Discovery-Service, gebunden an config['whoisport'].
+    Im Multicast-Modus tritt der Socket der Gruppe bei; sonst wird Broadcast erlaubt.
+    Der Socket ist nicht blockierend und wird mit receive_batch() geleert.
+    """
+    # Erstellt einen UDP-Socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Setze SO_REUSEADDR, damit der Socket sofort wieder genutzt werden kann,
+    # falls er kürzlich geschlossen wurde. Zusätzlich SO_REUSEPORT, um mehrere
+    # Clients auf dem gleichen Discovery-Port zu erlauben.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    # Größerer Empfangspuffer, damit gleichzeitig eintreffende JOINs nicht verworfen werden,
+    # während ein Stapel verarbeitet wird (das System kann den Wert begrenzen, z. B. net.core.rmem_max)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.get('discovery_rcvbuf', DISCOVERY_RCVBUF))
+    except OSError:
+        pass
+    # Unter Linux liefert der Kernel zu jedem Datagramm die Anzahl bisher verworfener Datagramme mit
+    if SO_RXQ_OVFL is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        except OSError:
+            pass
+
+    # Binde den Socket an alle verfügbaren Netzwerkschnittstellen und den Discovery-Port.
+    sock.bind(("", config['whoisport']))
+    if is_multicast(config):
+        # Der Gruppe beitreten (auf config['multicast_interface'] bzw. der vom System gewählten Schnittstelle)
+        group = config.get('multicast_group', MULTICAST_GROUP)
+        interface = config.get('multicast_interface', "") or "0.0.0.0"
+        membership = socket.inet_aton(group) + socket.inet_aton(interface)
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError:
+            sock.close()
+            raise
+    # Sendeoptionen für KNOWUSERS-Antworten und Heartbeats (Broadcast bzw. Multicast-TTL/Loopback)
+    configure_discovery_sender(sock, config)
+    sock.setblocking(False)
+    return sock
+
+
+class DatagramReceiver:
+    """
+    Liest alle anstehenden Datagramme eines nicht blockierenden UDP-Sockets in einem Durchgang
+    und zählt dabei die vom Kernel verworfenen Datagramme (SO_RXQ_OVFL, sofern verfügbar).
+    """
+
+    def __init__(self, sock, batch=DISCOVERY_BATCH, metrics=REGISTRY):
+        self.sock = sock
+        self.batch = batch
+        self.metrics = metrics
+        # recvmsg mit Zusatzdaten nur, wenn der Kernel den Zähler liefert (nicht unter Windows)
+        self._overflow = (SO_RXQ_OVFL is not None and hasattr(sock, 'recvmsg')
+                          and sock.getsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL) != 0)
+        self._ancillary = socket.CMSG_SPACE(4) if self._overflow else 0
+        # Letzter Stand des Kernel-Zählers (gilt für die gesamte Lebensdauer des Sockets)
+        self._dropped = 0
+        self.metrics.set_gauge('rcvbuf_bytes', sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
+
+    def receive_batch(self):
+        """Liefert bis zu batch Datagramme [(data, addr)], ohne zu blockieren (leer, wenn nichts ansteht)."""
+        datagrams = []
+        while len(datagrams) < self.batch:
+            try:
+                if self._overflow:
+                    data, ancdata, _, addr = self.sock.recvmsg(65535, self._ancillary)
+                    self._count_drops(ancdata)
+                else:
+                    data, addr = self.sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                # Z. B. ICMP "Port nicht erreichbar" zu einem früheren Senden: nächstes Datagramm lesen
+                continue
+            datagrams.append((data, addr))
+        return datagrams
+
+    def _count_drops(self, ancdata):
+        """Übernimmt den Kernel-Zähler verworfener Datagramme aus den Zusatzdaten."""
+        for level, kind, value in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(value) >= 4:
+                dropped = struct.unpack('=I', value[:4])[0]
+                if dropped != self._dropped:
+                    self.metrics.inc('packets_dropped', (dropped - self._dropped) & 0xFFFFFFFF)
+                    self._dropped = dropped
+
+
+def discovery_loop(config, interface_queue, interface_to_disc_queue=None, ready=None):
+    """
+    Funktion namens `discovery_loop`, die den Discovery-Service implementiert.
+    ready: optionales Event, das gesetzt wird, sobald der Discovery-Socket empfangsbereit ist.
+    """
+    sock = create_discovery_socket(config)
+    service = DiscoveryService(config, interface_queue, sock.sendto)
+    receiver = DatagramReceiver(sock, config.get('discovery_batch', DISCOVERY_BATCH), service.metrics)
+
+    print(f"[Discovery] Service gestartet auf Port {config['whoisport']} ({describe_transport(config)})")
+    if ready is not None:
+        ready.set()
+
+    # Loop, der Discovery-Service hört auf eingehende UDP-Nachrichten.
+    while True:
+        # Anfragen der Oberfläche bearbeiten
+        if interface_to_disc_queue is not None:
+            try:
+                while True:
+                    service.handle_request(interface_to_disc_queue.get_nowait())
+            except queue.Empty:
+                pass
+
+        service.tick(time.monotonic())
+
+        # Auf Datagramme warten; regelmäßig aufwachen, um Anfragen der Oberfläche,
+        # Heartbeats und Ablaufzeiten zu bearbeiten, spätestens aber zur eingeplanten Antwort
+        readable, _, _ = select.select([sock], [], [], service.next_timeout(time.monotonic(), 0.5))
+        # Alle anstehenden Datagramme (je bis zu 65535 Bytes samt Absenderadresse) auf einmal lesen
+        datagrams = receiver.receive_batch() if readable else []
+        if not datagrams:
+            # Auch ohne Datagramm können abgelaufene Peers die Liste verändert haben
+            service.publish_changes()
+            continue
+        service.handle_batch(datagrams, time.monotonic())
 
 if __name__ == '__main__':
     """Importiere die Konfigurationsdatei (config.toml) und die SLCP-Handler-Funktionen."""
     # Lädt die Konfigurationsdatei (config.toml)
-    config = toml.load('config.toml')
+    from startup import load_config
+    config = load_config('config.toml')
     from multiprocessing import Queue
     # Erstellt eine Queue für die Kommunikation zwischen Discovery-Service und z.B. der CLI.
     q = Queue()
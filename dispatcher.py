@@ -0,0 +1,104 @@
+# File: dispatcher.py
+
+import queue
+import threading
+import traceback
+
+"""
+@file dispatcher.py
+@brief Ereignisgesteuerter Queue-Dispatcher:
+
+- Wartet blockierend auf mehrere Queues gleichzeitig (z. B. net_to_interface und disc_to_interface),
+  ohne zu pollen oder zu schlafen. Im Leerlauf wird daher keine CPU-Zeit verbraucht.
+- Für jede Queue blockiert ein eigener Zubringer-Thread in get(). Sobald ein Ereignis ankommt,
+  holt er alle weiteren bereits wartenden Ereignisse (bis batch_size) auf einmal ab und
+  reicht sie als Stapel an den Dispatcher-Thread weiter.
+- Der Dispatcher-Thread ruft die Handler aller Queues nacheinander auf, sodass die Handler
+  nie gleichzeitig laufen und keine eigene Synchronisation brauchen.
+- Wirft ein Handler eine Exception, wird sie samt Traceback ausgegeben und das nächste Ereignis
+  verarbeitet; der einzige Dispatcher-Thread darf nicht an einem fehlerhaften Ereignis sterben.
+"""
+
+# Standardwert: maximale Anzahl Ereignisse, die pro Queue auf einmal abgeholt werden
+BATCH_SIZE = 64
+
+# Markierung, die den Dispatcher-Thread beendet
+_STOP = object()
+
+
+class QueueDispatcher:
+    """Verteilt Ereignisse aus mehreren Queues an Handler, sobald sie eintreffen."""
+
+    def __init__(self, sources, on_batch_end=None, batch_size=BATCH_SIZE):
+        """
+        sources: Liste von (Queue, Handler)-Paaren; Handler bekommt jeweils ein Ereignis.
+        on_batch_end: optionale Funktion, die nach jedem abgearbeiteten Stapel aufgerufen wird.
+        """
+        self.sources = sources
+        self.on_batch_end = on_batch_end
+        self.batch_size = batch_size
+        # Interne Queue, über die die Zubringer-Threads Stapel an den Dispatcher übergeben
+        self._batches = queue.Queue()
+        self._threads = []
+
+    def start(self):
+        """Startet Zubringer-Threads und Dispatcher-Thread (alle als Daemon-Threads)."""
+        for source, handler in self.sources:
+            feeder = threading.Thread(target=self._feed, args=(source, handler), daemon=True)
+            self._threads.append(feeder)
+        self._threads.append(threading.Thread(target=self._dispatch, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Beendet den Dispatcher-Thread; bereits abgeholte Ereignisse werden noch verarbeitet."""
+        self._batches.put(_STOP)
+
+    def _feed(self, source, handler):
+        """Blockiert auf einer Queue und leitet Ereignisse stapelweise weiter."""
+        while True:
+            # Blockierendes Warten ohne Timeout: kein Polling im Leerlauf
+            try:
+                batch = [source.get()]
+            except (EOFError, OSError):
+                # Queue wurde geschlossen (z. B. beim Beenden des Programms)
+                return
+            # Alle bereits wartenden Ereignisse gleich mitnehmen
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(source.get_nowait())
+                except queue.Empty:
+                    break
+            self._batches.put((handler, batch))
+
+    def _dispatch(self):
+        """Ruft die Handler für alle eingehenden Stapel nacheinander auf."""
+        while True:
+            item = self._batches.get()
+            # Weitere bereits wartende Stapel (auch von anderen Queues) gemeinsam abarbeiten
+            pending = [item]
+            while True:
+                try:
+                    pending.append(self._batches.get_nowait())
+                except queue.Empty:
+                    break
+            for entry in pending:
+                if entry is _STOP:
+                    return
+                handler, batch = entry
+                for event in batch:
+                    try:
+                        handler(event)
+                    except Exception as e:
+                        _report(f"Fehler bei Ereignis {event!r}", e)
+            if self.on_batch_end is not None:
+                try:
+                    self.on_batch_end()
+                except Exception as e:
+                    _report("Fehler nach dem Stapel", e)
+
+
+def _report(what, error):
+    """Gibt einen Fehler aus einem Handler aus (nur innerhalb von except aufrufen)."""
+    print(f"[Dispatcher] {what}: {error!r}")
+    traceback.print_exc()
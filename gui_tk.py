@@ -2,16 +2,23 @@
 
 import tkinter as tk
 from tkinter import simpledialog, filedialog, font as tkfont, messagebox
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import queue
 import time
 import socket
+import bisect
+from chat_log import ChatLog, SCROLLBACK_LIMIT
+from history import open_history
+from thumbnails import ThumbnailCache, THUMBNAIL_DIR
+from peer_table import PeerView
+from metrics import REGISTRY, StatsCollector, STATS_INTERVAL
+from outbox import Outbox
+from autoreply import AutoReplier
 from client import (
     client_send_join,
     client_send_leave,
-    client_send_msg,
-    client_send_img,
     client_send_who,
+    SEND_TIMEOUT,
 )
 
 AWAY_TIMEOUT = 30
@@ -20,18 +27,31 @@ AWAY_TIMEOUT = 30
 @file gui_tk.py
 @brief Implementiert eine Chat-GUI mit Tkinter. Behandelt Benutzereingaben,
 stellt Nachrichten- und Bildversand/empfang dar, verwaltet die Peer-Liste und bietet Auto-Reply bei Inaktivität.
+Nachrichten und Bilder werden über den Postausgang (outbox.py) im Hintergrund gesendet, der Tk-Thread
+wartet nie auf das Netzwerk; Zustellfehler erscheinen nach dem letzten Versuch im Chat.
+Bildvorschauen werden im Hintergrund dekodiert und dauerhaft zwischengespeichert (thumbnails.py).
+Gesendete und empfangene Nachrichten werden im dauerhaften Verlauf (history.py) gespeichert; beim Start
+und beim Hochscrollen werden ältere Nachrichten seitenweise daraus nachgeladen.
 """
 
 
 class ChatGUI(tk.Tk):
     """Die Hauptklasse für die Chat-GUI, die das Tkinter-Fenster verwaltet."""
-    def __init__(self, config, net_to_interface, disc_to_interface, interface_to_net):
+    def __init__(self, config, net_to_interface, disc_to_interface, interface_to_net, interface_to_disc=None):
         super().__init__()
         self.config = config
         self.net_to_interface = net_to_interface
         self.disc_to_interface = disc_to_interface
         self.interface_to_net = interface_to_net
+        self.interface_to_disc = interface_to_disc
         self.peers = {}
+        # Lokale Kopie der Peerliste, die per Delta vom Discovery-Service aktualisiert wird
+        self._peer_view = PeerView(interface_to_disc)
+        # Sammelt die Metriken von Server, Discovery und GUI (optional als JSON-Datei)
+        self.stats = StatsCollector(config.get('stats_file'), config.get('stats_interval', STATS_INTERVAL),
+                                    {'net': net_to_interface, 'disc': disc_to_interface})
+        # Sortierte Handles, wie sie in der Listbox angezeigt werden
+        self._peer_order = []
         self.last_activity = time.time()
         self.joined = False
         self.base_width = 800
@@ -40,9 +60,19 @@ class ChatGUI(tk.Tk):
         self.base_font = tkfont.Font(family="Helvetica", size=11)
         self.image_size_base = 200
         self.image_size = self.image_size_base
+        # Dekodiert Vorschaubilder im Hintergrund; fertige werden in _poll_queues eingefügt
+        self.thumbnails = ThumbnailCache(config.get("thumbnail_dir", THUMBNAIL_DIR))
+        # Postausgang für msg, msgall, Bilder und Auto-Reply
+        self.outbox = Outbox.from_config(config)
+        # Rückmeldungen des Postausgangs (aus dessen Worker-Threads) für den Tk-Thread
+        self._send_results = queue.Queue()
+        # Begrenzt Auto-Replies pro Peer und antwortet nie auf Auto-Replies
+        self.autoreplier = AutoReplier(config)
 
         self.bind("<Configure>", self._on_resize)
         self._ask_user_info()
+        # Dauerhafter Verlauf des eingegebenen Namens (None, wenn abgeschaltet)
+        self.history = open_history(self.config, self.config.get("user", {}).get("name"))
         self._setup_ui()
         self._join_network()
         self._poll_queues()
@@ -66,7 +96,6 @@ class ChatGUI(tk.Tk):
         self.title("Messenger")
         self.geometry("800x600")
         self.configure(bg="#2b2b2b")
-        self.images = []
 
         # Main Frame
         main_frame = tk.Frame(self, bg="#2b2b2b")
@@ -89,6 +118,13 @@ class ChatGUI(tk.Tk):
         chat_frame.grid(row=0, column=0, sticky="nsew", padx=(0, 3))
         self.chat_text = tk.Text(chat_frame, font=self.base_font, bg="#1e1e1e", fg="#dcdcdc", wrap="word", state="disabled")
         self.chat_text.pack(fill="both", expand=True)
+        # Begrenzter Verlauf: alte Einträge (und ihre Bilder) werden entfernt, beim Hochscrollen nachgeladen
+        self.chat_log = ChatLog(self.chat_text, self._load_photo, limit=self.config.get("scrollback_lines", SCROLLBACK_LIMIT),
+                                load_older=self._load_history if self.history else None)
+        if self.history:
+            # Letzte Seite des Verlaufs der vorherigen Sitzungen anzeigen
+            self.chat_log.history_floor = self.history.count()
+            self.chat_log.prepend_older()
 
         # Peer List Frame
         peer_frame = tk.Frame(upper_frame, bg="#2b2b2b")
@@ -132,9 +168,12 @@ class ChatGUI(tk.Tk):
                 self.interface_to_net.put(("SET_PORT", port))
             # Sende Join-Nachricht an das Netzwerk
             client_send_join(self.config)
+            # Discovery-Service informieren, damit er regelmäßig Heartbeats (ALIVE) sendet
+            if self.interface_to_disc:
+                self.interface_to_disc.put(("JOINED", handle, port))
             self.joined = True
             # Sende Who-Nachricht, um die Peers zu erhalten
-            client_send_who(self.config)
+            client_send_who(self.config, self.peers)
 
     def _poll_queues(self):
         """Pollt die Nachrichten- und Diskussionswarteschlangen und aktualisiert die GUI."""
@@ -150,69 +189,138 @@ class ChatGUI(tk.Tk):
                 from_handle = msg[1]
                 text = msg[2]
                 # Überprüfe, ob der Absender in der Peer-Liste ist
-                if now - self.last_activity > AWAY_TIMEOUT and self.joined:
-                    auto_msg = self.config.get("autoreply")
+                if now - self.last_activity > AWAY_TIMEOUT and self.joined and from_handle in self.peers:
+                    # Antworttext, sofern konfiguriert und für diesen Peer nicht begrenzt
+                    auto_msg = self.autoreplier.reply_for(from_handle, text, self.last_activity, now)
                     # Sende automatische Antwort, wenn konfiguriert
-                    if auto_msg and from_handle in self.peers:
+                    if auto_msg:
                         thost, tport = self.peers[from_handle]
-                        # Sende die automatische Antwort-Nachricht
-                        client_send_msg(thost, tport, self.config["handle"], auto_msg)
-                self._append_text(f"{from_handle}: {text}\n")
+                        # Sende die automatische Antwort-Nachricht im Hintergrund
+                        if self.outbox.send_msg(from_handle, thost, tport, auto_msg, self._on_sent):
+                            REGISTRY.inc('autoreplies_sent')
+                            self._record(from_handle, "out", "text", auto_msg)
+                # Nur vormerken: alle Einträge dieses Ticks werden unten gemeinsam eingefügt
+                position = self._record(from_handle, "in", "text", text)
+                self.chat_log.add_text(f"{from_handle}: {text}\n", position)
                 # Wenn img im Text enthalten ist, wird es als Bild behandelt
             elif msg[0] == "IMG":
                 # Überprüfe, ob der Absender in der Peer-Liste ist
                 from_handle = msg[1]
                 path = msg[2]
-                self._append_image(from_handle, path)
+                position = self._record(from_handle, "in", "image", path)
+                self.chat_log.add_image(from_handle, path, position)
+            elif msg[0] == "STATS":
+                # Metrik-Schnappschuss des Server-Prozesses
+                self.stats.update(msg[1], msg[2])
+        # Alle in diesem Tick empfangenen Nachrichten in einem Durchgang darstellen
+        self.chat_log.flush()
+        # Zustellfehler des Postausgangs anzeigen
+        while True:
+            try:
+                peer, error = self._send_results.get_nowait()
+            except queue.Empty:
+                break
+            if peer == "*":
+                # Ergebnis von msgall: error ist das Ergebnis-Dictionary
+                missed = error["failed"] + error["timeout"]
+                if missed:
+                    self._append_text(f"[Fehler] Nicht zugestellt an: {', '.join(missed)}\n")
+            else:
+                self._append_text(f"[Fehler] Nicht zugestellt an {peer}: {error}\n")
+        # Im Hintergrund fertig dekodierte Vorschauen anstelle der Platzhalter einfügen
+        for path, _, image in self.thumbnails.ready():
+            self.chat_log.photo_ready(path, ImageTk.PhotoImage(image) if image is not None else None)
         while True:
             try:
                 # Polling for messages from the discussion queue
                 dmsg = self.disc_to_interface.get_nowait()
             except queue.Empty:
                 break
-            # Verarbeite die empfangenen Diskussionsnachrichten
-            if dmsg[0] == "PEERS":
-                self.peers = dmsg[1]
+            # Metrik-Schnappschuss des Discovery-Prozesses
+            if dmsg[0] == "STATS":
+                self.stats.update(dmsg[1], dmsg[2])
+                continue
+            # Verarbeite die empfangenen Änderungen der Peer-Liste (Delta oder vollständige Kopie)
+            change = self._peer_view.apply(dmsg)
+            if change is None:
+                continue
+            full, changed, removed = change
+            self.peers = self._peer_view.peers
+            if full:
                 self._update_peer_list()
+            else:
+                self._patch_peer_list(changed, removed)
         self.after(100, self._poll_queues)
 
     def _update_peer_list(self):
-        """Aktualisiert die Liste der Peers in der GUI."""
+        """Baut die Liste der Peers in der GUI vollständig neu auf."""
         self.peer_list.delete(0, "end")
         # Sortiere die Peers nach ihrem Handle und füge sie der Liste hinzu
-        for h in sorted(self.peers.keys()):
-            # Füge den Handle in die Peer-Liste ein
-            self.peer_list.insert("end", h)
-
-    def _append_text(self, text):
-        """Fügt Text in den Chat ein, formatiert und skaliert."""
-        self.chat_text.configure(state="normal")
-        # Entferne Zeilenumbrüche am Ende des Textes
-        self.chat_text.insert("end", text)
-        # Skaliere den Text
-        self.chat_text.configure(state="disabled")
-        # Scrolle zum Ende des Textes
-        self.chat_text.see("end")
-
-    def _append_image(self, prefix, path):
-        """Fügt ein Bild in den Chat ein, skaliert es und fügt es hinzu."""
-        try:
-            img = Image.open(path)
-            # Skaliere das Bild auf die definierte Größe
-            img.thumbnail((self.image_size, self.image_size))
-            # Konvertiere das Bild in ein Tkinter-kompatibles Format
-            photo = ImageTk.PhotoImage(img)
-            # Füge das Bild in die Chat-Textbox ein
-            self.images.append(photo)
-            self.chat_text.configure(state="normal")
-            if prefix:
-                self.chat_text.insert("end", f"{prefix}: ")
-            self.chat_text.image_create("end", image=photo)
-            self.chat_text.insert("end", "\n")
-            self.chat_text.configure(state="disabled")
-            self.chat_text.see("end")
-        except Exception:
-            self._append_text(f"[Bild {prefix}] {path}\n")
+        self._peer_order = sorted(self.peers.keys())
+        if self._peer_order:
+            # Füge alle Handles mit einem Aufruf in die Peer-Liste ein
+            self.peer_list.insert("end", *self._peer_order)
+
+    def _patch_peer_list(self, changed, removed):
+        """Fügt neue Peers sortiert ein und entfernt gegangene, ohne die Liste neu aufzubauen."""
+        for h in removed:
+            i = bisect.bisect_left(self._peer_order, h)
+            if i < len(self._peer_order) and self._peer_order[i] == h:
+                del self._peer_order[i]
+                self.peer_list.delete(i)
+        for h in changed:
+            i = bisect.bisect_left(self._peer_order, h)
+            # Nur neue Handles einfügen; geänderte Adressen ändern die Anzeige nicht
+            if i == len(self._peer_order) or self._peer_order[i] != h:
+                self._peer_order.insert(i, h)
+                self.peer_list.insert(i, h)
+
+    def _append_text(self, text, position=None):
+        """Fügt Text sofort in den Chat ein (der Verlauf scrollt automatisch ans Ende)."""
+        self.chat_log.add_text(text, position)
+        self.chat_log.flush()
+
+    def _append_image(self, prefix, path, position=None):
+        """Fügt ein Bild sofort in den Chat ein; ist es nicht ladbar, wird der Pfad angezeigt."""
+        self.chat_log.add_image(prefix, path, position)
+        self.chat_log.flush()
+
+    def _on_sent(self, peer, error):
+        """Rückmeldung des Postausgangs (Worker-Thread): Fehler an den Tk-Thread weiterreichen."""
+        if error is not None:
+            self._send_results.put((peer, error))
+
+    def _on_sent_all(self, result):
+        """Rückmeldung des Postausgangs nach msgall (Worker-Thread)."""
+        self._send_results.put(("*", result))
+
+    def _record(self, peer, direction, kind, body, peers=None):
+        """Speichert eine Nachricht im dauerhaften Verlauf; liefert ihre Position oder None."""
+        if not self.history:
+            return None
+        sender = peer if direction == "in" else self.config.get("handle")
+        return self.history.append(peer, direction, sender, kind, body, peers)
+
+    def _load_history(self, before, count):
+        """Liefert bis zu count Chat-Einträge vor der Verlaufsposition before (für ChatLog)."""
+        entries = []
+        for position, record in self.history.range(None, before - count, before):
+            if record["dir"] == "in":
+                prefix = record["from"]
+            elif record["peer"] == "*":
+                prefix = "Du -> Alle"
+            else:
+                prefix = f"Du -> {record['peer']}"
+            if record["kind"] == "image":
+                entries.append(("image", prefix, record["body"], position))
+            else:
+                entries.append(("text", f"{prefix}: {record['body']}\n", position))
+        return entries
+
+    def _load_photo(self, path):
+        """Fordert die Vorschau in der aktuellen Größe im Hintergrund an (ChatLog zeigt bis dahin einen Platzhalter)."""
+        self.thumbnails.request(path, self.image_size)
+        return None
 
     def _show_help(self):
         """Zeigt eine kurze Hilfestellung analog zur CLI an."""
@@ -222,6 +330,7 @@ class ChatGUI(tk.Tk):
             " ihn in der Liste aus und gib eine Nachricht ein.\n"
             "- Wenn du allen schreiben möchtest schreibe msgall vor deine Nachricht.\n"
             "- Mit dem Kamerasymbol Bilder auswählen und senden.\n"
+            "- Wenn du allen ein Bild schicken möchtest schreibe imgall (optional mit Pfad).\n"
             "- 'help' in das Textfeld schreiben, um diese Hilfe zu sehen.\n"
             "- 'leave' um das Netzwerk zu verlassen.\n"
         )
@@ -248,6 +357,9 @@ class ChatGUI(tk.Tk):
             else:
                 # Sende Leave-Nachricht an das Netzwerk
                 client_send_leave(self.config)
+                # Keine Heartbeats mehr senden
+                if self.interface_to_disc:
+                    self.interface_to_disc.put(("LEFT",))
                 # Setze den Status auf nicht eingeloggt
                 self.joined = False
                 # prompte den Benutzer, dass er das Netzwerk verlassen hat
@@ -259,6 +371,15 @@ class ChatGUI(tk.Tk):
             # Leere das Textfeld nach dem Senden
             self.text_entry.delete("1.0", "end")
             return
+        # Überprüfe, ob der Text mit "imgall" beginnt (Bild an alle, ohne Pfad per Dateidialog)
+        if text.lower().startswith("imgall"):
+            path = text[6:].strip() or filedialog.askopenfilename(
+                title="Bild an alle senden", filetypes=[("Bilder", "*.png *.jpg *.jpeg *.bmp *.gif")])
+            if path:
+                self._send_image_all(path)
+            # Leere das Textfeld nach dem Senden
+            self.text_entry.delete("1.0", "end")
+            return
         # Überprüfe, ob der Text mit "msgall" beginnt
         if text.lower().startswith("msgall"):
             # Entferne "msgall" und führende Leerzeichen
@@ -275,11 +396,13 @@ class ChatGUI(tk.Tk):
                 # Leere das Textfeld nach dem Senden
                 self.text_entry.delete("1.0", "end")
                 return
-            for h, (host, port) in self.peers.items():
-                # Sende die Nachricht an alle Peers
-                client_send_msg(host, port, self.config["handle"], msg_text)
-                # Füge die Nachricht in den Chat ein
-            self._append_text(f"Du -> Alle: {msg_text}\n")
+            # Sende die Nachricht im Hintergrund an alle Peers; nicht erreichte Peers
+            # werden gemeldet, sobald alle Versuche abgeschlossen sind
+            peers = dict(self.peers)
+            self.outbox.send_all(peers, msg_text, self._on_sent_all)
+            # Füge die Nachricht in den Chat ein (im Verlauf unter allen adressierten Peers indiziert)
+            position = self._record("*", "out", "text", msg_text, peers=list(peers))
+            self._append_text(f"Du -> Alle: {msg_text}\n", position)
             # Leere das Textfeld nach dem Senden
             self.text_entry.delete("1.0", "end")
             return
@@ -296,16 +419,34 @@ class ChatGUI(tk.Tk):
         if handle in self.peers:
             # Hole die Host- und Port-Informationen des ausgewählten Peers
             host, port = self.peers[handle]
-            # Sende die Nachricht an den ausgewählten Peer
-            client_send_msg(host, port, self.config["handle"], text)
-            # Füge die Nachricht in den Chat ein
-            self._append_text(f"Du -> {handle}: {text}\n")
+            # Sende die Nachricht im Hintergrund an den ausgewählten Peer
+            if self.outbox.send_msg(handle, host, port, text, self._on_sent):
+                # Füge die Nachricht in den Chat ein
+                position = self._record(handle, "out", "text", text)
+                self._append_text(f"Du -> {handle}: {text}\n", position)
+            else:
+                self._append_text("[Fehler] Sendewarteschlange voll\n")
         else:
             # Wenn der Peer nicht in der Liste ist, zeige eine Fehlermeldung an
             self._append_text("[Fehler] Unbekannter Peer\n")
         # Leere das Textfeld nach dem Senden
         self.text_entry.delete("1.0", "end")
 
+    def _send_image_all(self, path):
+        """Sendet ein Bild an alle Peers; die Datei wird einmal gelesen und parallel verschickt."""
+        if not self.peers:
+            self._append_text("[Fehler] Keine anderen Peers im Chat\n")
+            return
+        peers = dict(self.peers)
+        try:
+            self.outbox.send_img_all(peers, path, self._on_sent_all)
+        except OSError:
+            self._append_text("[Fehler] Datei nicht gefunden\n")
+            return
+        # Füge das Bild in den Chat ein (im Verlauf unter allen adressierten Peers indiziert)
+        position = self._record("*", "out", "image", path, peers=list(peers))
+        self._append_image("Du -> Alle", path, position)
+
     def _send_message_event(self, event):
         """Sendet die Nachricht bei Drücken der Eingabetaste."""
         self._send_message()
@@ -345,24 +486,30 @@ class ChatGUI(tk.Tk):
             handle = self.peer_list.get(sel[0])
             if handle in self.peers:
                 host, port = self.peers[handle]
-                # Sende das Bild an den ausgewählten Peer
-                if client_send_img(host, port, self.config["handle"], filename):
+                # Sende das Bild im Hintergrund an den ausgewählten Peer
+                if self.outbox.send_img(handle, host, port, filename, self._on_sent):
                     # Füge das Bild in den Chat ein
-                    self._append_image(f"Du -> {handle}", filename)
+                    position = self._record(handle, "out", "image", filename)
+                    self._append_image(f"Du -> {handle}", filename, position)
                 else:
-                    # Wenn das Senden des Bildes fehlschlägt, zeige eine Fehlermeldung an
-                    self._append_text("[Fehler] Datei nicht gefunden\n")
+                    # Warteschlange voll: Bild wird nicht gesendet
+                    self._append_text("[Fehler] Sendewarteschlange voll\n")
 
     def on_close(self):
         """Behandelt das Schließen des Fensters."""
         if self.joined:
             # Sende Leave-Nachricht, wenn der Benutzer im Netzwerk ist
             client_send_leave(self.config)
+        # Noch ausstehende Nachrichten kurz zustellen lassen
+        self.outbox.close(self.config.get("send_timeout", SEND_TIMEOUT))
+        if self.history:
+            self.history.close()
+        self.thumbnails.close()
         self.destroy()
 
-def startGui(config, net_to_interface, disc_to_interface, interface_to_net):
+def startGui(config, net_to_interface, disc_to_interface, interface_to_net, interface_to_disc=None):
     """Startet die Chat-GUI."""
     # Erstelle eine Instanz der ChatGUI und starte die Hauptschleife
-    app = ChatGUI(config, net_to_interface, disc_to_interface, interface_to_net)
+    app = ChatGUI(config, net_to_interface, disc_to_interface, interface_to_net, interface_to_disc)
     app.protocol("WM_DELETE_WINDOW", app.on_close)
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,194 @@
+# File: history.py
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl # Dateisperre (nur Unix); unter Windows wird ohne Sperre gearbeitet
+except ImportError:
+    fcntl = None
+
+"""
+@file history.py
+@brief Dauerhafter Chatverlauf: nur angehängtes Nachrichtenprotokoll mit Offset-Index pro Peer.
+
+- messages.log enthält jede gesendete und empfangene Nachricht als eine JSON-Zeile:
+      {"t": <Zeit>, "dir": "in"/"out", "peer": <Handle oder "*">, "from": <Absender>,
+       "kind": "text"/"image", "body": <Text bzw. Bildpfad>}
+- all.idx und peers/<hex(handle)>.idx enthalten nur die Byte-Offsets der Zeilen
+  (je 8 Bytes, little endian). Eintrag i eines Index ist also die i-te Nachricht
+  insgesamt bzw. mit diesem Peer.
+- Anhängen ist O(1): eine Zeile ans Log, je 8 Bytes an die betroffenen Indizes.
+- Lesen der letzten N Nachrichten eines Peers liest genau N Offsets aus dessen Index
+  und die zugehörigen Zeilen über ein mmap des Logs; das Log wird nie durchsucht.
+- Nach einem Absturz wird eine unvollständige letzte Zeile bzw. ein unvollständiger
+  Indexeintrag beim Öffnen abgeschlossen bzw. abgeschnitten.
+"""
+
+# Standardwert: Verzeichnis für den Verlauf (pro Handle ein Unterverzeichnis)
+HISTORY_DIR = "./history"
+
+# Format eines Indexeintrags (Offset der Zeile im Log)
+_OFFSET = struct.Struct('<Q')
+
+
+def _index_name(handle):
+    """Dateiname des Index eines Peers (hex, damit beliebige Handles gültige Dateinamen sind)."""
+    return handle.encode('utf-8').hex() + '.idx'
+
+
+def _dir_name(handle):
+    """Lesbarer Verzeichnisname für das eigene Handle."""
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in handle)
+
+
+def _open_index(path):
+    """Öffnet (bzw. erzeugt) eine Indexdatei und schneidet einen unvollständigen letzten Eintrag ab."""
+    f = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+    size = f.seek(0, os.SEEK_END)
+    if size % _OFFSET.size:
+        f.truncate(size - size % _OFFSET.size)
+    return f
+
+
+def open_history(config, handle):
+    """Öffnet den Verlauf für handle oder liefert None (abgeschaltet oder schon in Benutzung)."""
+    directory = config.get('history_dir', HISTORY_DIR)
+    if not directory or not handle:
+        return None
+    try:
+        return HistoryLog(os.path.join(directory, _dir_name(handle)))
+    except OSError as e:
+        print(f"[History] Verlauf nicht verfügbar: {e}")
+        return None
+
+
+class HistoryLog:
+    """Nur angehängtes Nachrichtenprotokoll mit globalem Index und einem Index pro Peer."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'peers'), exist_ok=True)
+        # Nur eine Instanz pro Verzeichnis darf schreiben (zweites Fenster mit gleichem Namen)
+        self._lock_file = open(os.path.join(directory, 'lock'), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise OSError(f"{directory} wird bereits von einem anderen Client verwendet")
+        # Schreiben aus dem Dispatcher-Thread (Empfang) und dem Eingabe-Thread (Senden)
+        self._lock = threading.Lock()
+        self._log = open(os.path.join(directory, 'messages.log'), 'a+b')
+        self._size = self._log.seek(0, os.SEEK_END)
+        # Unvollständige letzte Zeile (Absturz beim Schreiben) abschließen
+        if self._size:
+            self._log.seek(self._size - 1)
+            if self._log.read(1) != b'\n':
+                self._log.write(b'\n')
+                self._log.flush()
+                self._size += 1
+        self._all = _open_index(os.path.join(directory, 'all.idx'))
+        # handle -> geöffnete Indexdatei (erst beim ersten Zugriff geöffnet)
+        self._peer_files = {}
+        # Lesezugriff auf das Log; wird neu angelegt, wenn das Log gewachsen ist
+        self._map = None
+        self.closed = False
+
+    def close(self):
+        """Schließt alle Dateien und gibt die Sperre frei."""
+        with self._lock:
+            self.closed = True
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            for f in self._peer_files.values():
+                f.close()
+            self._peer_files.clear()
+            self._all.close()
+            self._log.close()
+            self._lock_file.close()
+
+    def _peer_file(self, peer, create):
+        """Indexdatei eines Peers; None, wenn sie nicht existiert und create False ist."""
+        f = self._peer_files.get(peer)
+        if f is None:
+            path = os.path.join(self.directory, 'peers', _index_name(peer))
+            if not create and not os.path.exists(path):
+                return None
+            f = self._peer_files[peer] = _open_index(path)
+        return f
+
+    def append(self, peer, direction, sender, kind, body, peers=None, timestamp=None):
+        """
+        Hängt eine Nachricht an und liefert ihre Position im globalen Index (None nach close()).
+        peer: Gesprächspartner ("*" für msgall); peers: Handles, unter denen die Nachricht
+        zusätzlich indiziert wird (Standard: nur peer).
+        """
+        record = {"t": time.time() if timestamp is None else timestamp, "dir": direction,
+                  "peer": peer, "from": sender, "kind": kind, "body": body}
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+        with self._lock:
+            # Nach close() (z. B. erneutes 'join') eintreffende Nachrichten werden nicht gespeichert
+            if self.closed:
+                return None
+            offset = self._size
+            # Erst das Log, dann die Indizes: ein Index zeigt nie auf eine fehlende Zeile
+            self._log.write(line)
+            self._log.flush()
+            self._size += len(line)
+            entry = _OFFSET.pack(offset)
+            position = self._all.seek(0, os.SEEK_END) // _OFFSET.size
+            self._all.write(entry)
+            self._all.flush()
+            for handle in (peers if peers is not None else [peer]):
+                f = self._peer_file(handle, create=True)
+                f.seek(0, os.SEEK_END)
+                f.write(entry)
+                f.flush()
+        return position
+
+    def count(self, peer=None):
+        """Anzahl Nachrichten insgesamt (peer=None) bzw. mit einem Peer."""
+        with self._lock:
+            f = self._all if peer is None else self._peer_file(peer, create=False)
+            if f is None:
+                return 0
+            return f.seek(0, os.SEEK_END) // _OFFSET.size
+
+    def range(self, peer, start, stop):
+        """Liefert [(position, record)] für die Indexeinträge [start, stop), älteste zuerst."""
+        with self._lock:
+            f = self._all if peer is None else self._peer_file(peer, create=False)
+            if f is None:
+                return []
+            total = f.seek(0, os.SEEK_END) // _OFFSET.size
+            start = max(0, start)
+            stop = min(stop, total)
+            if start >= stop:
+                return []
+            f.seek(start * _OFFSET.size)
+            raw = f.read((stop - start) * _OFFSET.size)
+            offsets = [o for (o,) in _OFFSET.iter_unpack(raw)]
+            return [(start + i, self._read_record(o)) for i, o in enumerate(offsets)]
+
+    def last(self, peer, n):
+        """Liefert die letzten n Nachrichten insgesamt bzw. mit einem Peer, älteste zuerst."""
+        total = self.count(peer)
+        return self.range(peer, total - n, total)
+
+    def _read_record(self, offset):
+        """Liest die Zeile ab offset über das mmap des Logs (Aufrufer hält self._lock)."""
+        if self._map is None or offset >= len(self._map):
+            # Log ist seit dem letzten Lesen gewachsen: neu einblenden
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._log.fileno(), self._size, access=mmap.ACCESS_READ)
+        end = self._map.find(b'\n', offset)
+        if end < 0:
+            end = len(self._map)
+        return json.loads(self._map[offset:end])
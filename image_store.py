@@ -0,0 +1,114 @@
+# File: image_store.py
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+"""
+@file image_store.py
+@brief Inhaltsadressierte Ablage empfangener Bilder mit Speicherkontingent.
+
+- Jedes Bild wird unter imagepath/<sha256>.jpg abgelegt. Der Hash wird vom Server schon
+  während des Empfangs berechnet (siehe server._write_image_data), die Ablage ist nur noch
+  ein Umbenennen der temporären Datei.
+- Gleicher Inhalt wird nur einmal gespeichert: Jede Nachricht bekommt denselben Pfad
+  (Verweis pro Nachricht über das IMG-Ereignis bzw. den Chatverlauf), die doppelte
+  temporäre Datei wird verworfen. Zeitgleich empfangene Bilder eines Absenders können
+  sich nicht mehr gegenseitig überschreiben.
+- Übersteigt die Summe aller Bilder das Kontingent (config['image_quota'] Bytes, 0 = unbegrenzt),
+  werden die am längsten nicht mehr empfangenen Bilder gelöscht (LRU). Der Zeitpunkt der letzten
+  Verwendung ist die Änderungszeit der Datei, so bleibt die Reihenfolge über Neustarts erhalten.
+"""
+
+# Standardwert: maximale Gesamtgröße aller gespeicherten Bilder in Bytes (512 MiB)
+IMAGE_QUOTA = 512 * 1024 * 1024
+
+# Dateinamen, die von der Ablage verwaltet werden (ältere Dateien im Ordner bleiben unberührt)
+_OBJECT_NAME = re.compile(r'^[0-9a-f]{64}\.jpg$')
+
+
+class ImageStore:
+    """Verwaltet die inhaltsadressierten Bilddateien eines Bildordners."""
+
+    def __init__(self, directory, quota=IMAGE_QUOTA, metrics=None):
+        self.directory = directory
+        self.quota = quota
+        self.metrics = metrics
+        # Ablage erfolgt aus mehreren Worker-Threads des Servers
+        self._lock = threading.Lock()
+        # digest -> Größe, geordnet nach letzter Verwendung (älteste zuerst)
+        self._objects = OrderedDict()
+        self.total = 0
+        os.makedirs(directory, exist_ok=True)
+        # Bestand beim Start einlesen und nach Änderungszeit ordnen
+        found = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if _OBJECT_NAME.match(entry.name):
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.name[:-4], st.st_size))
+        for _, digest, size in sorted(found):
+            self._objects[digest] = size
+            self.total += size
+
+    def path(self, digest):
+        """Pfad der Datei zu einem Inhalt."""
+        return os.path.join(self.directory, digest + '.jpg')
+
+    def lookup(self, digest):
+        """Pfad eines bereits gespeicherten Inhalts (als zuletzt verwendet markiert) oder None."""
+        path = self.path(digest)
+        with self._lock:
+            if digest not in self._objects or not os.path.exists(path):
+                return None
+            now = time.time()
+            os.utime(path, (now, now))
+            self._objects.move_to_end(digest)
+            self._count('images_deduplicated')
+        return path
+
+    def add(self, tmp_path, digest):
+        """
+        Übernimmt eine vollständig empfangene temporäre Datei mit dem SHA-256-Hash digest.
+        Rückgabe: Pfad der (ggf. schon vorhandenen) Datei mit diesem Inhalt.
+        """
+        path = self.path(digest)
+        now = time.time()
+        with self._lock:
+            known = self._objects.get(digest)
+            if known is not None and os.path.exists(path):
+                # Inhalt schon vorhanden: nur als zuletzt verwendet markieren
+                os.unlink(tmp_path)
+                os.utime(path, (now, now))
+                self._objects.move_to_end(digest)
+                self._count('images_deduplicated')
+                return path
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+            if known is not None:
+                # Datei wurde von außen gelöscht: Größe neu erfassen
+                self.total -= known
+            self._objects[digest] = size
+            self._objects.move_to_end(digest)
+            self.total += size
+            self._evict()
+        return path
+
+    def _evict(self):
+        """Löscht die am längsten nicht verwendeten Bilder, bis das Kontingent eingehalten ist."""
+        # Das zuletzt empfangene Bild (am Ende) bleibt immer erhalten, auch wenn es allein zu groß ist
+        while self.quota and self.total > self.quota and len(self._objects) > 1:
+            digest, size = self._objects.popitem(last=False)
+            try:
+                os.unlink(self.path(digest))
+            except FileNotFoundError:
+                pass
+            self.total -= size
+            self._count('images_evicted')
+
+    def _count(self, name):
+        """Zählt ein Ereignis in den Metriken (falls vorhanden)."""
+        if self.metrics is not None:
+            self.metrics.inc(name)
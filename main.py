@@ -1,21 +1,26 @@
 # File: main.py
 
+from startup import PROFILE, load_config # Zuerst importieren: Bezugszeitpunkt der Startmessung
 import argparse # ArgumentParser für Kommandozeilenargumente
-import toml # Zum Laden der Konfigurationsdatei
-from multiprocessing import Process, Queue # Multiprocessing für parallele Prozesse
-import discovery_service # Discovery-Service für Peer-Erkennung
-import server # Server-Modul für Netzwerkkommunikation
-from cli import ChatCLI # CLI-Modul für Kommandozeileninteraktion
+# Alle weiteren Module (Multiprocessing, Discovery, Server, CLI, GUI mit Tk/PIL) werden erst
+# importiert, wenn sie gebraucht werden. Das verkürzt den Start und den Import von main.py
+# in Kindprozessen (Startmethode "spawn"/"forkserver").
 
 """
 @file main.py
 @brief Main Entry Point:
 
-- Lädt config.toml
+- Lädt config.toml (über tomllib, siehe startup.load_config)
 - Startet im Hintergrund jeweils:
     * Discovery-Service (Process A)
     * Server/Network-Empfang (Process B)
+  bzw. mit --runtime asyncio beide als Protokolle auf einer asyncio-Schleife im Hauptprozess
 - Anschließend startet CLI (ChatCLI) oder GUI (je nach Eingabe) im Hauptprozess
+- Server und Discovery schicken regelmäßig Metriken über ihre Queues an die Oberfläche, die sie
+  zusammenführt (CLI-Befehl 'stats', optional als JSON-Datei über --stats-file)
+- --start-method wählt die Startmethode der Kindprozesse (fork/spawn/forkserver),
+  --startup-profile gibt aus, wie lange die einzelnen Schritte bis zum ersten JOIN dauern
+- --multicast GROUP schaltet die Discovery von Broadcast auf IP-Multicast mit dieser Gruppe um
 """
 
 if __name__ == '__main__': # main.py wird direkt ausgeführt
@@ -24,9 +29,20 @@ if __name__ == '__main__': # main.py wird direkt ausgeführt
     parser.add_argument("--port", type=int, help="UDP port for this client") # Port für den Client
     parser.add_argument("--broadcast", help="Broadcast address for discovery") # Broadcast-Adresse für Discovery
     parser.add_argument("--whoisport", type=int, help="Port for discovery service") # Port für den Discovery-Service
+    parser.add_argument("--multicast", metavar="GROUP", help="Use IP multicast discovery with this group instead of broadcast") # Multicast statt Broadcast
+    parser.add_argument("--stats-file", help="Write periodic JSON metrics snapshots to this file") # Datei für Metrik-Schnappschüsse
+    parser.add_argument("--runtime", choices=["process", "asyncio"], default="process",
+                        help="Run discovery/server as separate processes or on one asyncio loop") # Laufzeitmodell
+    parser.add_argument("--stats-interval", type=float, help="Seconds between metrics snapshots") # Abstand der Schnappschüsse
+    parser.add_argument("--start-method", choices=["fork", "spawn", "forkserver"],
+                        help="multiprocessing start method for the background processes") # Startmethode der Kindprozesse
+    parser.add_argument("--startup-profile", action="store_true", help="Print a startup timing breakdown") # Startzeiten ausgeben
     args = parser.parse_args() # Argumente parsen
+    PROFILE.enabled = args.startup_profile # Startmessung ein-/ausschalten
+    PROFILE.mark("Argumente gelesen")
 
-    config = toml.load('config.toml') # Konfiguration aus config.toml laden
+    config = load_config('config.toml') # Konfiguration aus config.toml laden
+    PROFILE.mark("Konfiguration geladen")
     if args.port is not None: # Wenn ein Port angegeben wurde, diesen verwenden
         config['port'] = args.port # Port in der Konfiguration setzen
     else: # Wenn kein Port angegeben wurde, auf 0 setzen
@@ -35,33 +51,71 @@ if __name__ == '__main__': # main.py wird direkt ausgeführt
         config['broadcast'] = args.broadcast # Broadcast-Adresse in der Konfiguration setzen
     if args.whoisport: # Wenn ein Port für den Discovery-Service angegeben wurde
         config['whoisport'] = args.whoisport # Port für den Discovery-Service in der Konfiguration setzen
+    if args.multicast: # Wenn eine Multicast-Gruppe angegeben wurde
+        config['discovery_mode'] = 'multicast' # Discovery über die Gruppe statt per Broadcast
+        config['multicast_group'] = args.multicast # Gruppe in der Konfiguration setzen
+    if args.stats_file: # Wenn eine Datei für Metriken angegeben wurde
+        config['stats_file'] = args.stats_file # Oberfläche schreibt dort regelmäßig alle Metriken als JSON
+    if args.stats_interval: # Wenn ein Intervall für Metriken angegeben wurde
+        config['stats_interval'] = args.stats_interval # Gilt für Server, Discovery und Oberfläche
     
 
-    """IPC-Queues (für Prozesskommunikation zwischen CLI, Server und Discovery)"""
-    interface_to_net = Queue() # Queue für Kommunikation von CLI zu Netzwerk
-    interface_to_disc = Queue() # Queue für Kommunikation von CLI zu Discovery
-    net_to_interface = Queue() # Queue für Kommunikation von Netzwerk zu CLI
-    disc_to_interface = Queue() # Queue für Kommunikation von Discovery zu CLI
-    
-    
-    disc_proc = Process(target=discovery_service.discovery_loop, args=(config, disc_to_interface)) # Discovery-Service starten
-    disc_proc.daemon = True # Daemon-Prozess, der im Hintergrund läuft
-    disc_proc.start() # Discovery-Service starten
-    print("Discovery-Service gestartet") # Ausgabe, dass der Discovery-Service gestartet wurde
+    if args.runtime == 'asyncio': # Einprozess-Betrieb: Discovery und Server auf einer asyncio-Schleife
+        from async_runtime import AsyncRuntime # Nur bei Bedarf importieren
+        PROFILE.mark("Module geladen (asyncio)")
+        runtime = AsyncRuntime(config) # Discovery und Server im Hintergrund-Thread
+        runtime.start() # Startet die Ereignisschleife und wartet, bis beide bereit sind
+        # Dieselben vier Queues wie im Mehrprozess-Betrieb, aber ohne Prozessgrenze
+        net_to_interface, disc_to_interface, interface_to_net, interface_to_disc = runtime.queues()
+        PROFILE.mark("asyncio-Laufzeit bereit (Discovery und Server)")
+    else: # Standard: Discovery und Server als eigene Prozesse
+        import multiprocessing # Multiprocessing für parallele Prozesse
+        import discovery_service # Discovery-Service für Peer-Erkennung
+        import server # Server-Modul für Netzwerkkommunikation
+        # Kontext mit der gewählten Startmethode (ohne Angabe: Standard des Betriebssystems)
+        mp = multiprocessing.get_context(args.start_method)
+        if args.start_method == 'forkserver':
+            # Der Forkserver importiert die Dienste einmal vorab; Kindprozesse erben sie dann
+            mp.set_forkserver_preload(['discovery_service', 'server'])
+        PROFILE.mark(f"Module geladen (Startmethode {mp.get_start_method()})")
+
+        """IPC-Queues (für Prozesskommunikation zwischen CLI, Server und Discovery)"""
+        interface_to_net = mp.Queue() # Queue für Kommunikation von CLI zu Netzwerk
+        interface_to_disc = mp.Queue() # Queue für Kommunikation von CLI zu Discovery
+        net_to_interface = mp.Queue() # Queue für Kommunikation von Netzwerk zu CLI
+        disc_to_interface = mp.Queue() # Queue für Kommunikation von Discovery zu CLI
+        # Nur für die Startmessung: Events, die die Kindprozesse setzen, sobald sie empfangsbereit sind
+        disc_ready = mp.Event() if args.startup_profile else None
+        net_ready = mp.Event() if args.startup_profile else None
+
+        disc_proc = mp.Process(target=discovery_service.discovery_loop, args=(config, disc_to_interface, interface_to_disc, disc_ready)) # Discovery-Service starten
+        disc_proc.daemon = True # Daemon-Prozess, der im Hintergrund läuft
+        disc_proc.start() # Discovery-Service starten
+        print("Discovery-Service gestartet") # Ausgabe, dass der Discovery-Service gestartet wurde
 
-    """Server/Network als eigener Process"""
-    net_proc = Process(target=server.server_loop, args=(config, net_to_interface, interface_to_net)) # Netzwerk-Server starten
-    net_proc.daemon = True # Daemon-Prozess, der im Hintergrund läuft
-    net_proc.start() # Netzwerk-Server starten
+        """Server/Network als eigener Process"""
+        net_proc = mp.Process(target=server.server_loop, args=(config, net_to_interface, interface_to_net, net_ready)) # Netzwerk-Server starten
+        net_proc.daemon = True # Daemon-Prozess, der im Hintergrund läuft
+        net_proc.start() # Netzwerk-Server starten
+        PROFILE.mark("Prozesse gestartet")
+        if args.startup_profile: # Nur bei der Startmessung auf die Kindprozesse warten
+            disc_ready.wait(10)
+            PROFILE.mark("Discovery-Prozess bereit")
+            net_ready.wait(10)
+            PROFILE.mark("Server-Prozess bereit")
 
     
     mode = input("Modus wählen: [g] GUI  |  [c] CLI  > ").strip().lower() # Eingabe für den Modus (GUI oder CLI)
+    PROFILE.mark("Modus gewählt (enthält Wartezeit auf die Eingabe)")
     if mode == 'g': # Wenn GUI-Modus gewählt wurde
-        from gui_tk import startGui  # Tkinter-basierte GUI importieren
-        startGui(config, net_to_interface, disc_to_interface, interface_to_net)  # GUI starten
+        from gui_tk import startGui  # Tkinter-basierte GUI (mit Tk und PIL) erst jetzt importieren
+        PROFILE.mark("GUI geladen")
+        startGui(config, net_to_interface, disc_to_interface, interface_to_net, interface_to_disc)  # GUI starten
     else: # Standardmäßig CLI-Modus
         # Fallback zu CLI
-        cli = ChatCLI(config, net_to_interface, disc_to_interface, interface_to_net) # CLI-Instanz erstellen
+        from cli import ChatCLI # CLI-Modul für Kommandozeileninteraktion
+        PROFILE.mark("CLI geladen")
+        cli = ChatCLI(config, net_to_interface, disc_to_interface, interface_to_net, interface_to_disc) # CLI-Instanz erstellen
         try: # CLI starten
             cli.cmdloop() # Kommandozeilen-Loop starten
         except KeyboardInterrupt: # Abfangen von KeyboardInterrupt (Strg+C)
@@ -0,0 +1,208 @@
+# File: metrics.py
+
+import bisect
+import json
+import os
+import threading
+import time
+
+"""
+@file metrics.py
+@brief Laufzeit-Metriken (Zähler, Messwerte und Latenz-Histogramme) für alle Prozesse.
+
+- Jeder Prozess (Server, Discovery, Oberfläche) hat ein eigenes REGISTRY, in das er zählt.
+  Ein Eintrag kostet nur ein Dictionary-Update unter einem unbelasteten Lock, daher können
+  die Metriken dauerhaft eingeschaltet bleiben.
+- Server- und Discovery-Prozess schicken alle config['stats_interval'] Sekunden einen Schnappschuss
+  als ('STATS', <name>, <snapshot>) über ihre ohnehin vorhandene Queue an die Oberfläche.
+- Die Oberfläche sammelt die Schnappschüsse in einem StatsCollector, ergänzt ihre eigenen
+  Werte (inkl. der Sende-Funktionen aus client.py) und schreibt sie auf Wunsch regelmäßig
+  als JSON-Datei (config['stats_file']).
+"""
+
+# Standardwert: Sekunden zwischen zwei Schnappschüssen der Hintergrundprozesse
+STATS_INTERVAL = 5
+# Obergrenzen der Histogramm-Klassen in Sekunden (die letzte Klasse ist unbeschränkt)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Latenz-Histogramm mit festen Klassen; Perzentile werden aus den Klassengrenzen geschätzt."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """Obergrenze der Klasse, in der das Perzentil liegt (bzw. das Maximum in der letzten Klasse)."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': list(self.counts),
+        }
+
+
+class Metrics:
+    """Zähler, Messwerte (Gauges) und Histogramme eines Prozesses."""
+
+    def __init__(self):
+        # Mehrere Threads (z. B. Sende- und Worker-Threads) zählen gleichzeitig
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.monotonic()
+        # Zeitpunkt des nächsten Schnappschusses für publish_due()
+        self._next_publish = 0.0
+
+    def inc(self, name, amount=1):
+        """Erhöht einen Zähler."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        """Setzt einen Momentanwert (z. B. Queue-Tiefe oder offene Verbindungen)."""
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Trägt eine Dauer in Sekunden in ein Histogramm ein."""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Liefert alle Werte als JSON-fähiges Dictionary."""
+        with self._lock:
+            return {
+                'uptime': time.monotonic() - self.started,
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {name: h.snapshot() for name, h in self.histograms.items()},
+            }
+
+    def publish_due(self, interval=STATS_INTERVAL):
+        """True (höchstens alle interval Sekunden), wenn ein neuer Schnappschuss fällig ist."""
+        now = time.monotonic()
+        if now < self._next_publish:
+            return False
+        self._next_publish = now + interval
+        return True
+
+    def publish(self, out_queue, name):
+        """Schickt einen Schnappschuss als ('STATS', name, snapshot) an die Oberfläche."""
+        out_queue.put(('STATS', name, self.snapshot()))
+
+
+# Metriken des aktuellen Prozesses
+REGISTRY = Metrics()
+
+
+def queue_depth(q):
+    """Anzahl wartender Einträge einer Queue oder None, wenn das System es nicht unterstützt (macOS)."""
+    try:
+        return q.qsize()
+    except (NotImplementedError, OSError):
+        return None
+
+
+class StatsCollector:
+    """Sammelt in der Oberfläche die Schnappschüsse aller Prozesse und schreibt sie als JSON."""
+
+    def __init__(self, path=None, interval=STATS_INTERVAL, queues=None):
+        """
+        path: Datei für regelmäßige JSON-Schnappschüsse (None oder leer = keine Datei).
+        queues: Dictionary name -> Queue, deren Tiefe als Messwert der Oberfläche erfasst wird.
+        """
+        self.path = path or None
+        self.interval = interval
+        self.queues = queues or {}
+        # Prozessname -> letzter Schnappschuss (inkl. berechneter Raten)
+        self.processes = {}
+        self._next_write = 0.0
+
+    def update(self, name, snapshot):
+        """Übernimmt einen Schnappschuss und berechnet Raten pro Sekunde gegenüber dem vorherigen."""
+        previous = self.processes.get(name)
+        rates = {}
+        if previous is not None:
+            elapsed = snapshot['uptime'] - previous['uptime']
+            if elapsed > 0:
+                for key, value in snapshot['counters'].items():
+                    rates[key] = (value - previous['counters'].get(key, 0)) / elapsed
+        snapshot['rates'] = rates
+        self.processes[name] = snapshot
+        self.maybe_write()
+
+    def collect(self):
+        """Liefert die Schnappschüsse aller Prozesse samt aktuellem Stand der Oberfläche."""
+        for name, q in self.queues.items():
+            REGISTRY.set_gauge(f'{name}_queue_depth', queue_depth(q))
+        processes = dict(self.processes)
+        processes['ui'] = REGISTRY.snapshot()
+        return {'time': time.time(), 'processes': processes}
+
+    def maybe_write(self):
+        """Schreibt höchstens alle interval Sekunden einen Schnappschuss in die JSON-Datei."""
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if now < self._next_write:
+            return
+        self._next_write = now + self.interval
+        # Erst in eine temporäre Datei schreiben, damit Leser nie eine halbe Datei sehen
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.collect(), f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+def format_stats(collected):
+    """Formatiert das Ergebnis von StatsCollector.collect() als lesbaren Text (für die CLI)."""
+    lines = []
+    for name, snap in sorted(collected['processes'].items()):
+        lines.append(f"[{name}] Laufzeit {snap['uptime']:.0f} s")
+        rates = snap.get('rates', {})
+        for key, value in sorted(snap['counters'].items()):
+            rate = f"  ({rates[key]:.1f}/s)" if key in rates else ""
+            lines.append(f"  {key:28} {value}{rate}")
+        for key, value in sorted(snap['gauges'].items()):
+            lines.append(f"  {key:28} {'-' if value is None else value}")
+        for key, h in sorted(snap['histograms'].items()):
+            lines.append(f"  {key:28} n={h['count']} p50={_ms(h['p50'])} p90={_ms(h['p90'])} "
+                         f"p99={_ms(h['p99'])} max={_ms(h['max'])}")
+    return "\n".join(lines)
+
+
+def _ms(seconds):
+    """Sekunden als Millisekunden-Text."""
+    return "-" if seconds is None else f"{seconds * 1000:.2f}ms"
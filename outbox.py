@@ -0,0 +1,271 @@
+# File: outbox.py
+
+import hashlib
+import heapq
+import itertools
+import mmap
+import os
+import socket
+import threading
+import time
+from collections import deque
+from client import client_send_msg, client_send_img, client_send_img_data, DeliveryUncertainError, SEND_TIMEOUT
+from slcp_handler import COMPRESS_THRESHOLD
+from metrics import REGISTRY
+
+"""
+@file outbox.py
+@brief Asynchroner Versand von MSG/IMG für CLI und GUI (Postausgang).
+
+- send_msg()/send_img()/send_all()/send_img_all() legen Aufträge nur in eine begrenzte Warteschlange und kehren
+  sofort zurück; der Aufrufer (Tk-Thread, Empfangs-Handler) wartet nie auf das Netzwerk.
+  Ist die Warteschlange voll (config['outbox_size']), wird der Auftrag abgelehnt (Rückgabe False).
+- Ein Pool von Worker-Threads (config['outbox_workers']) arbeitet die Aufträge ab. Pro Peer-Adresse
+  gibt es eine eigene FIFO-Schlange, von der immer nur ein Worker gleichzeitig sendet: Nachrichten an
+  denselben Peer kommen in der Reihenfolge an, in der sie eingestellt wurden (sie können sonst über
+  verschiedene gepoolte Verbindungen überholen), und ein langsamer Peer belegt höchstens einen Worker.
+- Schlägt ein Versand fehl, wird er nach RETRY_BACKOFF * 2^n Sekunden erneut versucht (insgesamt
+  config['send_retries'] Versuche). Während der Wartezeit ist kein Worker blockiert.
+  Ein DeliveryUncertainError (Daten schon vollständig gesendet, nur die Bestätigung fehlt) wird nicht
+  wiederholt, damit der Peer nichts doppelt erhält; die Verbindungsebene (client) wiederholt ebenfalls nicht.
+- Nach dem letzten Versuch wird on_done(peer, fehler) im Worker-Thread aufgerufen
+  (fehler = None bei Erfolg). Die GUI reicht das Ergebnis über eine Queue an den Tk-Thread weiter.
+- send_img_all() blendet die Bilddatei einmal per mmap ein; alle Peers werden parallel aus
+  demselben Puffer bedient, die Datei wird also unabhängig von der Anzahl der Peers nur einmal gelesen.
+  Auch der SHA-256 für fortsetzbare Übertragungen wird dafür nur einmal berechnet.
+- Bilder an Peers, die "resume" unterstützen, werden bei einer Wiederholung ab dem Offset fortgesetzt,
+  den der Empfänger bestätigt; nur die fehlenden Bytes werden erneut gesendet (siehe client).
+"""
+
+# Standardwert: maximale Anzahl wartender Aufträge
+OUTBOX_SIZE = 1000
+# Standardwert: Anzahl der Sende-Threads
+OUTBOX_WORKERS = 8
+# Standardwert: Anzahl Versuche pro Auftrag (inklusive des ersten)
+SEND_RETRIES = 3
+# Wartezeit in Sekunden vor dem ersten erneuten Versuch; verdoppelt sich mit jedem weiteren
+RETRY_BACKOFF = 0.5
+
+
+class _Job:
+    """Ein einzelner Sendeauftrag an einen Peer."""
+
+    __slots__ = ('kind', 'peer', 'host', 'port', 'payload', 'on_done', 'attempts', 'queued')
+
+    @property
+    def target(self):
+        """Schlüssel der FIFO-Schlange: die Adresse, nicht das Handle."""
+        return (self.host, self.port)
+
+    def __init__(self, kind, peer, host, port, payload, on_done):
+        self.kind = kind
+        self.peer = peer
+        self.host = host
+        self.port = port
+        # Text (MSG), Dateipfad (IMG) bzw. (eingeblendeter Bildinhalt, SHA-256) (IMGDATA)
+        self.payload = payload
+        self.on_done = on_done
+        self.attempts = 0
+        self.queued = time.perf_counter()
+
+
+class Outbox:
+    """Begrenzte Sendewarteschlange mit Worker-Pool, Reihenfolge pro Peer und Wiederholung."""
+
+    def __init__(self, from_handle, size=OUTBOX_SIZE, workers=OUTBOX_WORKERS, retries=SEND_RETRIES,
+                 timeout=SEND_TIMEOUT, backoff=RETRY_BACKOFF, compress_threshold=COMPRESS_THRESHOLD, metrics=REGISTRY):
+        """from_handle: Funktion ohne Argumente, die das aktuelle eigene Handle liefert."""
+        self.from_handle = from_handle
+        # Nachrichten ab dieser Größe werden komprimiert, sofern der Peer zlib unterstützt
+        self.compress_threshold = compress_threshold
+        self.size = size
+        self.retries = max(1, retries)
+        self.timeout = timeout
+        self.backoff = backoff
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        # Weckt Worker, wenn ein Auftrag bereit oder eine Wiederholung fällig wird
+        self._cond = threading.Condition(self._lock)
+        # Weckt close(), sobald keine Aufträge mehr ausstehen
+        self._drained = threading.Condition(self._lock)
+        # (host, port) -> deque der Aufträge; der erste Auftrag ist der nächste zu sendende
+        self._queues = {}
+        # Adressen, deren nächster Auftrag sofort gesendet werden kann
+        self._ready = deque()
+        # (fällig, laufende Nummer, adresse) für Adressen, deren Auftrag auf eine Wiederholung wartet
+        self._delayed = []
+        self._seq = itertools.count()
+        self.pending = 0
+        self._closed = False
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    @classmethod
+    def from_config(cls, config):
+        """Erzeugt den Postausgang mit den Einstellungen aus config.toml."""
+        return cls(lambda: config['handle'],
+                   size=config.get('outbox_size', OUTBOX_SIZE),
+                   workers=config.get('outbox_workers', OUTBOX_WORKERS),
+                   retries=config.get('send_retries', SEND_RETRIES),
+                   timeout=config.get('send_timeout', SEND_TIMEOUT),
+                   compress_threshold=config.get('compress_threshold', COMPRESS_THRESHOLD))
+
+    def send_msg(self, peer, host, port, text, on_done=None):
+        """Stellt eine Textnachricht ein. Rückgabe: False, wenn die Warteschlange voll ist."""
+        return self._put(_Job('MSG', peer, host, port, text, on_done))
+
+    def send_img(self, peer, host, port, path, on_done=None):
+        """Stellt ein Bild ein. Rückgabe: False, wenn die Warteschlange voll ist."""
+        return self._put(_Job('IMG', peer, host, port, path, on_done))
+
+    def send_all(self, peers, text, on_done=None):
+        """
+        Stellt eine Textnachricht an alle Peers (handle -> (host, port)) ein. Sobald alle Aufträge
+        abgeschlossen sind, wird on_done mit {'ok': [...], 'failed': [...], 'timeout': [...]} aufgerufen.
+        Peers, für die die Warteschlange voll war, zählen als 'failed'.
+        """
+        self._put_all('MSG', peers, text, on_done)
+
+    def send_img_all(self, peers, path, on_done=None):
+        """
+        Stellt ein Bild an alle Peers ein (Ergebnis wie bei send_all). Die Datei wird einmal
+        eingeblendet und nach dem letzten Auftrag wieder freigegeben.
+        Wirft OSError, wenn die Datei nicht gelesen werden kann.
+        """
+        with open(path, 'rb') as f:
+            # Leere Dateien lassen sich nicht einblenden
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+        # Prüfsumme einmal für alle Peers (Transfer-ID der fortsetzbaren Übertragung)
+        digest = hashlib.sha256(data).hexdigest() if peers else None
+        self._put_all('IMGDATA', peers, (data, digest), on_done,
+                      cleanup=data.close if isinstance(data, mmap.mmap) else None)
+
+    def _put_all(self, kind, peers, payload, on_done, cleanup=None):
+        """Stellt denselben Auftrag für jeden Peer ein und fasst die Ergebnisse zusammen."""
+        result = {'ok': [], 'failed': [], 'timeout': []}
+        remaining = [len(peers)]
+        lock = threading.Lock()
+
+        def finish():
+            if cleanup is not None:
+                cleanup()
+            if on_done is not None:
+                on_done(result)
+
+        def done(peer, error):
+            with lock:
+                if error is None:
+                    result['ok'].append(peer)
+                elif isinstance(error, socket.timeout):
+                    result['timeout'].append(peer)
+                else:
+                    result['failed'].append(peer)
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                finish()
+
+        if not peers:
+            finish()
+            return
+        for peer, (host, port) in list(peers.items()):
+            if not self._put(_Job(kind, peer, host, port, payload, done)):
+                done(peer, OSError("Warteschlange voll"))
+
+    def close(self, timeout=0):
+        """Wartet bis zu timeout Sekunden auf ausstehende Aufträge und beendet die Worker."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self.pending and time.monotonic() < deadline:
+                self._drained.wait(deadline - time.monotonic())
+            self._closed = True
+            self._cond.notify_all()
+
+    def _put(self, job):
+        with self._cond:
+            if self._closed or self.pending >= self.size:
+                self.metrics.inc('outbox_rejected')
+                return False
+            self.pending += 1
+            self.metrics.set_gauge('outbox_pending', self.pending)
+            peer_queue = self._queues.get(job.target)
+            if peer_queue is None:
+                # Peer hat keine offenen Aufträge: sofort bereit
+                self._queues[job.target] = deque([job])
+                self._ready.append(job.target)
+                self._cond.notify()
+            else:
+                # Wird gesendet, sobald die vorherigen Aufträge an diesen Peer erledigt sind
+                peer_queue.append(job)
+        return True
+
+    def _next_job(self):
+        """Wartet auf den nächsten sendebereiten Auftrag; None, wenn der Postausgang geschlossen ist."""
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[2])
+                if self._ready:
+                    return self._queues[self._ready.popleft()][0]
+                self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+        return None
+
+    def _worker(self):
+        """Worker-Thread: sendet Aufträge, bis der Postausgang geschlossen wird."""
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            error = self._attempt(job)
+            self._finish(job, error)
+
+    def _attempt(self, job):
+        """Ein Sendeversuch. Rückgabe: None bei Erfolg, sonst die Exception."""
+        if job.attempts == 0:
+            self.metrics.observe('outbox_wait_seconds', time.perf_counter() - job.queued)
+        job.attempts += 1
+        try:
+            if job.kind == 'MSG':
+                client_send_msg(job.host, job.port, self.from_handle(), job.payload, self.timeout,
+                                self.compress_threshold)
+            elif job.kind == 'IMGDATA':
+                data, digest = job.payload
+                client_send_img_data(job.host, job.port, self.from_handle(), data, self.timeout, digest)
+            elif not client_send_img(job.host, job.port, self.from_handle(), job.payload, self.timeout):
+                # Datei existiert nicht (mehr): Wiederholen ist zwecklos
+                job.attempts = self.retries
+                return FileNotFoundError(job.payload)
+        except DeliveryUncertainError as e:
+            # Der Peer hat die Daten womöglich schon: eine Wiederholung könnte sie doppelt zustellen
+            job.attempts = self.retries
+            return e
+        except OSError as e:
+            return e
+        return None
+
+    def _finish(self, job, error):
+        """Plant eine Wiederholung ein oder schließt den Auftrag ab und gibt den Peer frei."""
+        with self._cond:
+            if error is not None and job.attempts < self.retries:
+                self.metrics.inc('outbox_retries')
+                due = time.monotonic() + self.backoff * 2 ** (job.attempts - 1)
+                heapq.heappush(self._delayed, (due, next(self._seq), job.target))
+                self._cond.notify()
+                return
+            peer_queue = self._queues[job.target]
+            peer_queue.popleft()
+            if peer_queue:
+                self._ready.append(job.target)
+                self._cond.notify()
+            else:
+                del self._queues[job.target]
+            self.pending -= 1
+            self.metrics.set_gauge('outbox_pending', self.pending)
+            if not self.pending:
+                self._drained.notify_all()
+        if error is not None:
+            self.metrics.inc('outbox_failed')
+        if job.on_done is not None:
+            job.on_done(job.peer, error)
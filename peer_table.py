@@ -0,0 +1,106 @@
+# File: peer_table.py
+
+"""
+@file peer_table.py
+@brief Versionierte Peerliste und Delta-Updates zwischen Discovery-Service und Oberfläche.
+
+- PeerTable (Discovery-Seite) merkt sich alle Änderungen (hinzugefügt/geändert/entfernt)
+  und erzeugt daraus nur dann ein Delta, wenn sich tatsächlich etwas geändert hat:
+      ('PEERS_DELTA', <version>, {handle: (host, port)}, [entfernte handles])
+  Auf Anfrage ('RESYNC',) wird eine vollständige Kopie verschickt:
+      ('PEERS', {handle: (host, port)}, <version>)
+- PeerView (Oberflächen-Seite) wendet Deltas auf die lokale Kopie an. Fehlt eine Version
+  (z. B. weil die Oberfläche später gestartet ist), wird einmalig ein Resync angefordert.
+"""
+
+
+class PeerTable:
+    """Peerliste des Discovery-Service mit Versionsnummer und Änderungsprotokoll."""
+
+    def __init__(self):
+        # handle -> (host, port)
+        self.peers = {}
+        # Wird bei jedem verschickten Delta um 1 erhöht
+        self.version = 0
+        # Änderungen seit dem letzten Delta
+        self._changed = {}
+        self._removed = set()
+
+    def set(self, handle, addr):
+        """Setzt die Adresse eines Peers. Rückgabe: True, wenn sich etwas geändert hat."""
+        if self.peers.get(handle) == addr:
+            return False
+        self.peers[handle] = addr
+        self._changed[handle] = addr
+        self._removed.discard(handle)
+        return True
+
+    def remove(self, handle):
+        """Entfernt einen Peer. Rückgabe: True, wenn er vorhanden war."""
+        if handle not in self.peers:
+            return False
+        del self.peers[handle]
+        self._changed.pop(handle, None)
+        self._removed.add(handle)
+        return True
+
+    def take_delta(self):
+        """Liefert ein Delta-Ereignis für alle Änderungen seit dem letzten Aufruf oder None."""
+        if not self._changed and not self._removed:
+            return None
+        self.version += 1
+        event = ('PEERS_DELTA', self.version, self._changed, sorted(self._removed))
+        self._changed = {}
+        self._removed = set()
+        return event
+
+    def snapshot(self):
+        """Liefert ein Ereignis mit der vollständigen Peerliste und der aktuellen Version."""
+        return ('PEERS', dict(self.peers), self.version)
+
+
+class PeerView:
+    """Lokale Kopie der Peerliste in der Oberfläche, die per Delta aktualisiert wird."""
+
+    def __init__(self, resync_queue=None):
+        # handle -> (host, port); wird bei Änderungen ersetzt, nie verändert,
+        # damit andere Threads gefahrlos über eine ältere Kopie iterieren können
+        self.peers = {}
+        self.version = 0
+        # Queue zum Discovery-Service, über die ein Resync angefordert wird
+        self.resync_queue = resync_queue
+        # True, solange auf eine vollständige Kopie gewartet wird
+        self._awaiting_snapshot = False
+
+    def apply(self, event):
+        """
+        Wendet ein 'PEERS'- oder 'PEERS_DELTA'-Ereignis an.
+        Rückgabe: None, wenn sich nichts geändert hat, sonst (vollständig, geändert, entfernt),
+        wobei vollständig=True bedeutet, dass die ganze Liste ersetzt wurde.
+        """
+        if event[0] == 'PEERS':
+            self.peers = dict(event[1])
+            # Ältere Ereignisse ohne Versionsnummer werden ebenfalls unterstützt
+            self.version = event[2] if len(event) > 2 else self.version
+            self._awaiting_snapshot = False
+            return True, self.peers, []
+        if event[0] != 'PEERS_DELTA':
+            return None
+        _, version, changed, removed = event
+        if version != self.version + 1 and self.resync_queue is not None:
+            # Lücke in den Versionen: vollständige Kopie anfordern und Deltas bis dahin ignorieren
+            self.request_resync()
+            return None
+        peers = dict(self.peers)
+        peers.update(changed)
+        for handle in removed:
+            peers.pop(handle, None)
+        self.peers = peers
+        self.version = version
+        return False, changed, removed
+
+    def request_resync(self):
+        """Fordert beim Discovery-Service eine vollständige Kopie der Peerliste an."""
+        if self.resync_queue is not None and not self._awaiting_snapshot:
+            self._awaiting_snapshot = True
+            self.resync_queue.put(('RESYNC',))
@@ -3,7 +3,32 @@
 import socket
 import os
 import time
-from slcp_handler import parse_slcp_line
+import selectors
+import tempfile
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from slcp_handler import (
+    parse_slcp_line,
+    parse_hello,
+    build_hello,
+    parse_frame,
+    frame_length,
+    decode_msg_frame,
+    decode_img_frame,
+    decode_img_resume_frame,
+    decompress_payload,
+    build_offset,
+    build_ack,
+    FRAME_MSG,
+    FRAME_IMG,
+    FRAME_MSG_Z,
+    FRAME_IMG_RESUME,
+    COMPRESS_THRESHOLD,
+)
+from metrics import REGISTRY, STATS_INTERVAL, queue_depth
+from image_store import ImageStore, IMAGE_QUOTA
 import queue
 
 """
@@ -11,20 +36,542 @@ import queue
 @brief Server-Prozess (Network-Empfang):
 
 - Lauscht per TCP auf config['port'] auf eingehende SLCP-Nachrichten (MSG, IMG).
+- Alle Verbindungen werden gleichzeitig über einen Selector (selectors-Modul) bedient,
+  sodass ein langsamer Bild-Sender keine anderen Nachrichten mehr aufhält.
+- Verbindungen bleiben nach einer Nachricht offen (Keep-Alive), sodass ein Client mehrere
+  SLCP-Nachrichten über denselben Socket schicken kann.
 - Bei MSG: Gibt Nachricht über IPC an CLI weiter.
 - Bei IMG: Liest erst Header (IMG <handle> <size>), dann liest er anschließend den Raw-JPEG-Binärstrom der Länge <size>.
-  Speichert empfangenes Bild unter imagepath/<handle>_<timestamp>.jpg und meldet der CLI den Pfad.
-
+  Die Daten werden stückweise direkt in eine temporäre Datei unter imagepath geschrieben, sodass der
+  Speicherbedarf nicht mit der Bildgröße wächst. Bilder über config['max_image_size'] werden abgelehnt.
+  Dabei wird der SHA-256-Hash mitberechnet. Nach vollständigem Empfang übernimmt ein begrenzter
+  Worker-Pool die Datei in die inhaltsadressierte Ablage (image_store: imagepath/<sha256>.jpg,
+  gleicher Inhalt nur einmal, Kontingent config['image_quota']) und meldet der CLI den Pfad.
+  Abgebrochene Übertragungen werden verworfen.
+- Fortsetzbare Bildübertragung (per HELLO "resume" ausgehandelt, nur im Frame-Format): Der Kopf
+  (FRAME_IMG_RESUME) enthält Größe und SHA-256 des Bildes, der Hash ist zugleich die Transfer-ID.
+  Die Daten landen in imagepath/.resume_<absender>_<sha256>.part; bricht die Verbindung ab, bleibt
+  die Teildatei erhalten. Der Server antwortet mit "OFFSET <n>" (so viele Bytes liegen schon vor,
+  der Hash des vorhandenen Anfangs wird dafür einmal neu berechnet), der Client sendet nur den Rest.
+  Das Neuberechnen läuft im Worker-Pool; die Verbindung wartet solange (kein OFFSET, keine
+  Verarbeitung), alle anderen Verbindungen werden weiter bedient. Das Ergebnis wird über
+  ctx.call_soon im Thread der Ereignisschleife übernommen.
+  Nach dem letzten Byte wird die Prüfsumme verglichen: Nur ein bestätigtes Bild wird abgelegt und
+  als ('IMG', ...) gemeldet (Antwort "ACK"), sonst wird die Teildatei gelöscht ("NAK").
+  Ist der Inhalt schon in der Bildablage, lautet die Antwort sofort "OFFSET <größe>" und "ACK".
+  Teildateien, die länger als config['resume_ttl'] Sekunden unberührt sind, werden beim Start gelöscht.
+- Jede Verbindung hat eine Lese-Deadline (config['read_timeout']). Wer mitten in einer Nachricht
+  in dieser Zeit keine Daten mehr schickt (z. B. halb offene Verbindung), wird getrennt.
+  Leerlaufende Keep-Alive-Verbindungen werden nach config['keepalive_timeout'] geschlossen.
+- Beginnt eine Verbindung mit "HELLO framed" und ist config['framing'] aktiv, antwortet der Server
+  mit "HELLO framed" und liest danach binäre Frames (siehe slcp_handler) statt Textzeilen.
+  Zusätzlich wird "zlib" angeboten (außer bei config['compress_threshold'] = 0): Dann dürfen
+  MSG-Frames komprimiert sein (FRAME_MSG_Z). Entpackt wird höchstens MAX_LINE Bytes pro Nachricht;
+  Größe vorher/nachher wird als 'decompress_bytes_before'/'decompress_bytes_after' gezählt.
+- Zählt Verbindungen, empfangene Bytes/Nachrichten/Bilder und Fehler (siehe metrics) und schickt
+  alle config['stats_interval'] Sekunden einen Schnappschuss ('STATS', 'server', ...) an die Oberfläche.
+- Die Verarbeitung einer Verbindung (_Connection, _receive_data, _process_buffer) ist unabhängig von
+  der Ereignisschleife; async_runtime nutzt sie ebenso wie server_loop.
 """
 
-def server_loop(config, net_to_interface_queue, interface_to_net_queue=None):
-    """Funktion namens `server_loop`, die den Serverprozess implementiert."""
+# Standardwert: Sekunden ohne neue Daten, nach denen eine Verbindung geschlossen wird
+READ_TIMEOUT = 10
+# Standardwert: Sekunden, die eine Verbindung zwischen zwei Nachrichten offen bleiben darf.
+# Muss größer sein als die Leerlaufzeit des Client-Pools (client.POOL_IDLE_TIMEOUT).
+KEEPALIVE_TIMEOUT = 60
+# Standardwert: Anzahl der Threads, die empfangene Bilder auf die Festplatte schreiben
+DISK_WORKERS = 4
+# Standardwert: maximale Bildgröße in Bytes, die angenommen wird (20 MiB)
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+# Maximale Anzahl Bytes, die pro recv()-Aufruf gelesen werden
+RECV_SIZE = 65536
+# Maximale Länge einer SLCP-Textzeile, bevor die Verbindung als fehlerhaft gilt
+MAX_LINE = 65536
+# Standardwert: Sekunden, nach denen eine nicht fortgesetzte Teildatei beim Start gelöscht wird (1 Tag)
+RESUME_TTL = 24 * 60 * 60
+# Namensanfang der Teildateien fortsetzbarer Übertragungen im Bildordner
+RESUME_PREFIX = '.resume_'
+
+
+class _Connection:
+    """Zustand einer einzelnen eingehenden TCP-Verbindung."""
+
+    def __init__(self, sock, addr):
+        # Socket und Adresse des Absenders
+        self.sock = sock
+        self.addr = addr
+        # Empfangene, aber noch nicht verarbeitete Bytes
+        self.buffer = bytearray()
+        # Absender und Restgröße eines gerade laufenden IMG-Transfers
+        self.img_handle = None
+        self.img_remaining = 0
+        # Temporäre Datei (Dateiobjekt und Pfad), in die das Bild geschrieben wird
+        self.img_file = None
+        self.img_tmp_path = None
+        # SHA-256 der bisher empfangenen Bilddaten (Adresse in der Bildablage)
+        self.img_hash = None
+        # Startzeitpunkt des laufenden IMG-Transfers (für das Latenz-Histogramm)
+        self.img_started = 0.0
+        # Fortsetzbare Übertragung: erwarteter SHA-256 (hex) und Schlüssel (handle, digest); sonst None
+        self.img_expected = None
+        self.img_resume_key = None
+        # Pfad der Teildatei, deren Hash gerade im Worker-Pool berechnet wird (sonst None);
+        # solange wird nichts aus dem Puffer verarbeitet
+        self.img_pending = None
+        # True, wenn eine neuere Verbindung die Übertragung übernommen hat (wird beim nächsten Empfang geschlossen)
+        self.superseded = False
+        # True, sobald auf dieser Verbindung das Frame-Format ausgehandelt wurde
+        self.framed = False
+        # True, wenn zusätzlich komprimierte Frames (zlib) ausgehandelt wurden
+        self.compressed = False
+        # Zeitpunkt des letzten Empfangs (für die Lese-Deadline)
+        self.last_read = time.monotonic()
+
+    def idle(self):
+        """True, wenn die Verbindung gerade zwischen zwei Nachrichten steht."""
+        return self.img_handle is None and self.img_pending is None and not self.buffer
+
+    def expired(self, now, ctx):
+        """True, wenn die Lese-Deadline bzw. die Keep-Alive-Leerlaufzeit abgelaufen ist."""
+        return now - self.last_read > (ctx.keepalive_timeout if self.idle() else ctx.read_timeout)
+
+    def abort_transfer(self, ctx):
+        """Verwirft eine unvollständige Bildübertragung samt temporärer Datei (Teildateien bleiben erhalten)."""
+        if self.img_file is not None:
+            self.img_file.close()
+            if self.img_expected is not None:
+                # Fortsetzbar: Teildatei bleibt für die Wiederaufnahme erhalten
+                ctx.metrics.inc('images_interrupted')
+            else:
+                os.unlink(self.img_tmp_path)
+                ctx.metrics.inc('images_aborted')
+        if ctx.resuming.get(self.img_resume_key) is self:
+            del ctx.resuming[self.img_resume_key]
+        # Ein noch laufendes Neuberechnen des Hashes wird bei seinem Ende ignoriert
+        self.img_pending = None
+        self.img_handle = None
+        self.img_file = None
+        self.img_tmp_path = None
+        self.img_hash = None
+        self.img_expected = None
+        self.img_resume_key = None
+
+
+class _ServerContext:
+    """Gemeinsame Einstellungen und Ressourcen aller Verbindungen eines Servers."""
+
+    def __init__(self, config, net_to_interface_queue, metrics=REGISTRY):
+        # Zielordner für empfangene Bilder
+        self.imagepath = os.path.abspath(config['imagepath'])
+        # Queue zur Weitergabe empfangener Nachrichten an die Oberfläche
+        self.queue = net_to_interface_queue
+        # Maximale Bildgröße in Bytes
+        self.max_image_size = config.get('max_image_size', MAX_IMAGE_SIZE)
+        # Metriken und Abstand zwischen zwei Schnappschüssen an die Oberfläche
+        self.metrics = metrics
+        self.stats_interval = config.get('stats_interval', STATS_INTERVAL)
+        # Inhaltsadressierte Bildablage mit Kontingent (legt imagepath bei Bedarf an)
+        self.images = ImageStore(self.imagepath, config.get('image_quota', IMAGE_QUOTA), metrics)
+        # Begrenzter Worker-Pool für Dateioperationen
+        self.pool = ThreadPoolExecutor(max_workers=config.get('disk_workers', DISK_WORKERS))
+        # Fähigkeiten, die dieser Server per HELLO anbietet
+        self.capabilities = {'framed'} if config.get('framing', True) else set()
+        # Komprimierte Frames gibt es nur im Frame-Format
+        if self.capabilities and config.get('compress_threshold', COMPRESS_THRESHOLD):
+            self.capabilities.add('zlib')
+        # Fortsetzbare Bildübertragungen ebenfalls nur im Frame-Format
+        if self.capabilities:
+            self.capabilities.add('resume')
+        # (handle, digest) -> Verbindung, die diese fortsetzbare Übertragung gerade empfängt
+        self.resuming = {}
+        # call_soon(conn, fn): führt fn() im Thread der Ereignisschleife aus und schließt die Verbindung,
+        # wenn fn() True liefert; thread-sicher (wird von server_loop bzw. async_runtime gesetzt)
+        self.call_soon = None
+        _remove_stale_partials(self.imagepath, config.get('resume_ttl', RESUME_TTL))
+        # Lese-Deadline pro Verbindung und Keep-Alive-Leerlaufzeit
+        self.read_timeout = config.get('read_timeout', READ_TIMEOUT)
+        self.keepalive_timeout = config.get('keepalive_timeout', KEEPALIVE_TIMEOUT)
+
+    def publish_stats(self, open_connections):
+        """Schickt (höchstens alle stats_interval Sekunden) einen Metrik-Schnappschuss an die Oberfläche."""
+        if self.metrics.publish_due(self.stats_interval):
+            self.metrics.set_gauge('open_connections', open_connections)
+            self.metrics.set_gauge('queue_depth', queue_depth(self.queue))
+            self.metrics.set_gauge('image_store_bytes', self.images.total)
+            self.metrics.publish(self.queue, 'server')
+
+
+def _finish_image(ctx, from_handle, tmp_path, digest):
+    """Legt ein vollständig empfangenes Bild (im Worker-Thread) ab und meldet den Pfad."""
+    start = time.perf_counter()
+    # Speichere das Bild unter seinem Hash (vorhandener gleicher Inhalt wird wiederverwendet)
+    filepath = ctx.images.add(tmp_path, digest)
+    # Füge den Pfad des gespeicherten Bildes zur Queue hinzu
+    ctx.queue.put(('IMG', from_handle, filepath))
+    ctx.metrics.observe('image_store_seconds', time.perf_counter() - start)
+
+
+def _remove_stale_partials(imagepath, ttl):
+    """Löscht Teildateien fortsetzbarer Übertragungen, die seit ttl Sekunden nicht verändert wurden."""
+    limit = time.time() - ttl
+    with os.scandir(imagepath) as entries:
+        for entry in entries:
+            if entry.name.startswith(RESUME_PREFIX) and entry.name.endswith('.part'):
+                try:
+                    if entry.stat().st_mtime < limit:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass
+
+
+def _start_resumable_image(conn, ctx, from_handle, size, digest):
+    """
+    Beginnt bzw. setzt eine fortsetzbare Bildübertragung fort und antwortet mit "OFFSET <n>".
+    Rückgabe: False, wenn die angekündigte Größe abgelehnt wird oder die Antwort scheitert.
+    """
+    if size < 0 or size > ctx.max_image_size:
+        ctx.metrics.inc('images_rejected')
+        return False
+    # Inhalt schon vorhanden: nichts zu übertragen
+    stored = ctx.images.lookup(digest)
+    if stored is not None:
+        try:
+            conn.sock.send(build_offset(size) + build_ack(True))
+        except OSError:
+            return False
+        ctx.queue.put(('IMG', from_handle, stored))
+        ctx.metrics.inc('images_received')
+        return True
+    key = (from_handle, digest)
+    # Eine ältere Verbindung mit derselben Übertragung (z. B. halb offen) gibt sie ab
+    previous = ctx.resuming.get(key)
+    if previous is not None:
+        previous.abort_transfer(ctx)
+        # Deren restliche Bilddaten dürfen nicht als Frames gelesen werden
+        previous.superseded = True
+    name = f"{RESUME_PREFIX}{hashlib.sha256(from_handle.encode('utf-8')).hexdigest()[:16]}_{digest}.part"
+    path = os.path.join(ctx.imagepath, name)
+    ctx.resuming[key] = conn
+    conn.img_resume_key = key
+    if not os.path.exists(path):
+        return _accept_resumable(conn, ctx, from_handle, size, digest, path, open(path, 'wb'), hashlib.sha256(), 0)
+    # Vorhandenen Anfang im Worker-Pool neu hashen (bis zu max_image_size Bytes), damit die
+    # Schleife nicht blockiert; bis dahin ruht diese Verbindung
+    conn.img_pending = path
+    future = ctx.pool.submit(_hash_partial, path, size)
+    resume = partial(_resume_ready, conn, ctx, from_handle, size, digest, path, future)
+    future.add_done_callback(lambda _: ctx.call_soon(conn, resume))
+    return True
+
+
+def _hash_partial(path, size):
+    """
+    Worker-Thread: SHA-256 über den schon vorhandenen Anfang einer Teildatei (höchstens size Bytes).
+    hashlib-Zustände lassen sich nicht speichern, daher wird nach einem Abbruch neu gelesen.
+    Rückgabe: (hash-Objekt, Anzahl gelesener Bytes).
+    """
+    img_hash = hashlib.sha256()
+    offset = 0
+    with open(path, 'rb') as f:
+        while offset < size:
+            block = f.read(min(RECV_SIZE, size - offset))
+            if not block:
+                break
+            img_hash.update(block)
+            offset += len(block)
+    return img_hash, offset
+
+
+def _resume_ready(conn, ctx, from_handle, size, digest, path, future):
+    """
+    Im Thread der Ereignisschleife: übernimmt den im Worker-Pool berechneten Hash der Teildatei,
+    antwortet mit OFFSET und verarbeitet inzwischen gepufferte Daten.
+    Rückgabe: True, wenn die Verbindung geschlossen werden soll.
+    """
+    if conn.img_pending != path:
+        # Verbindung wurde inzwischen geschlossen oder von einer neueren abgelöst
+        return False
+    conn.img_pending = None
+    conn.last_read = time.monotonic()
+    try:
+        img_hash, offset = future.result()
+        f = open(path, 'r+b')
+    except FileNotFoundError:
+        # Teildatei ist verschwunden (z. B. von außen gelöscht): von vorn beginnen
+        img_hash, offset = hashlib.sha256(), 0
+        try:
+            f = open(path, 'wb')
+        except OSError:
+            return True
+    except OSError:
+        return True
+    f.truncate(offset)
+    f.seek(offset)
+    if offset:
+        ctx.metrics.inc('images_resumed')
+        ctx.metrics.inc('resume_bytes_skipped', offset)
+    if not _accept_resumable(conn, ctx, from_handle, size, digest, path, f, img_hash, offset):
+        return True
+    return bool(conn.buffer) and _process_buffer(conn, ctx)
+
+
+def _accept_resumable(conn, ctx, from_handle, size, digest, path, f, img_hash, offset):
+    """
+    Antwortet mit "OFFSET <offset>" und empfängt ab dort in die geöffnete Teildatei f.
+    Rückgabe: False, wenn die Antwort nicht gesendet werden kann.
+    """
+    try:
+        conn.sock.send(build_offset(offset))
+    except OSError:
+        f.close()
+        return False
+    conn.img_file = f
+    conn.img_tmp_path = path
+    conn.img_hash = img_hash
+    conn.img_handle = from_handle
+    conn.img_remaining = size - offset
+    conn.img_expected = digest
+    conn.img_started = time.perf_counter()
+    if conn.img_remaining == 0:
+        _write_image_data(conn, ctx, b'')
+    return True
+
+
+def _start_image(conn, ctx, from_handle, size):
+    """
+    Beginnt eine Bildübertragung in eine temporäre Datei.
+    Rückgabe: False, wenn die angekündigte Größe abgelehnt wird.
+    """
+    # Negative oder zu große Angaben werden abgelehnt, bevor Speicher belegt wird
+    if size < 0 or size > ctx.max_image_size:
+        ctx.metrics.inc('images_rejected')
+        return False
+    # Temporäre Datei im Bildordner anlegen, in die die Daten direkt geschrieben werden
+    fd, conn.img_tmp_path = tempfile.mkstemp(dir=ctx.imagepath, prefix='.incoming_', suffix='.part')
+    conn.img_file = os.fdopen(fd, 'wb')
+    conn.img_hash = hashlib.sha256()
+    conn.img_handle = from_handle
+    conn.img_remaining = size
+    conn.img_started = time.perf_counter()
+    if size == 0:
+        _write_image_data(conn, ctx, b'')
+    return True
+
+
+def _write_image_data(conn, ctx, data):
+    """
+    Schreibt Bilddaten (bytes, bytearray oder memoryview) bis zur angekündigten Größe in die Datei.
+    Ist das Bild vollständig, wird die Ablage an den Worker-Pool abgegeben.
+    Rückgabe: Anzahl der verbrauchten Bytes.
+    """
+    take = min(len(data), conn.img_remaining)
+    if take:
+        # Über einen memoryview schreiben, damit der Ausschnitt nicht kopiert wird
+        with memoryview(data) as view, view[:take] as chunk:
+            conn.img_file.write(chunk)
+            conn.img_hash.update(chunk)
+        conn.img_remaining -= take
+    if conn.img_remaining == 0:
+        # Bild vollständig: Datei schließen und Ablage an den Worker-Pool abgeben
+        conn.img_file.close()
+        digest = conn.img_hash.hexdigest()
+        verified = conn.img_expected is None or digest == conn.img_expected
+        if conn.img_expected is not None:
+            del ctx.resuming[conn.img_resume_key]
+            # Ergebnis der Prüfsummenprüfung an den Sender (der bei NAK von vorn beginnt)
+            try:
+                conn.sock.send(build_ack(verified))
+            except OSError:
+                pass
+        if verified:
+            ctx.metrics.inc('images_received')
+            ctx.metrics.observe('image_receive_seconds', time.perf_counter() - conn.img_started)
+            ctx.pool.submit(_finish_image, ctx, conn.img_handle, conn.img_tmp_path, digest)
+        else:
+            # Prüfsumme stimmt nicht: Teildatei verwerfen, nichts melden
+            os.unlink(conn.img_tmp_path)
+            ctx.metrics.inc('images_corrupt')
+        conn.img_handle = None
+        conn.img_file = None
+        conn.img_tmp_path = None
+        conn.img_hash = None
+        conn.img_expected = None
+        conn.img_resume_key = None
+    return take
+
+
+def _process_frames(conn, ctx):
+    """
+    Verarbeitet alle vollständigen Frames im Puffer einer Verbindung im Frame-Format.
+    Die Frames werden direkt aus einem memoryview gelesen; erst am Ende wird der
+    verarbeitete Teil einmalig aus dem Puffer entfernt.
+    Rückgabe: True, wenn die Verbindung wegen fehlerhafter Daten geschlossen werden soll.
+    """
+    error = False
+    pos = 0
+    view = memoryview(conn.buffer)
+    try:
+        while True:
+            # Hash einer Teildatei wird noch berechnet: Daten bleiben bis zur OFFSET-Antwort im Puffer
+            if conn.img_pending is not None:
+                break
+            # Laufender IMG-Transfer: Rohdaten folgen direkt auf den IMG-Frame
+            if conn.img_handle is not None:
+                pos += _write_image_data(conn, ctx, view[pos:])
+                if conn.img_handle is not None:
+                    break
+                continue
+            # Zu große Frames werden abgelehnt, bevor sie vollständig gepuffert sind
+            length = frame_length(view, pos)
+            if length is not None and length > MAX_LINE:
+                error = True
+                break
+            frame = parse_frame(view, pos)
+            if frame is None:
+                break
+            frame_type, payload, pos = frame
+            try:
+                if frame_type == FRAME_MSG:
+                    # Bei MSG: Leite die Nachricht an die CLI weiter
+                    from_handle, text = decode_msg_frame(payload)
+                    ctx.queue.put(('MSG', from_handle, text))
+                    ctx.metrics.inc('messages_received')
+                elif frame_type == FRAME_MSG_Z and conn.compressed:
+                    # Komprimierte MSG: erst entpacken (begrenzt), dann wie MSG
+                    try:
+                        data = decompress_payload(payload, MAX_LINE)
+                    except ValueError:
+                        error = True
+                        break
+                    ctx.metrics.inc('decompress_bytes_before', len(payload))
+                    ctx.metrics.inc('decompress_bytes_after', len(data))
+                    from_handle, text = decode_msg_frame(data)
+                    ctx.queue.put(('MSG', from_handle, text))
+                    ctx.metrics.inc('messages_received')
+                elif frame_type == FRAME_IMG:
+                    # Bei IMG: Bilddaten folgen im Puffer
+                    try:
+                        from_handle, size = decode_img_frame(payload)
+                    except ValueError:
+                        # Zu kurzer Kopf: nur diese Verbindung schließen
+                        error = True
+                        break
+                    if not _start_image(conn, ctx, from_handle, size):
+                        error = True
+                        break
+                elif frame_type == FRAME_IMG_RESUME and 'resume' in ctx.capabilities:
+                    # Fortsetzbares IMG: nach der OFFSET-Antwort folgen nur die fehlenden Bytes
+                    try:
+                        from_handle, size, digest = decode_img_resume_frame(payload)
+                    except ValueError:
+                        error = True
+                        break
+                    if not _start_resumable_image(conn, ctx, from_handle, size, digest):
+                        error = True
+                        break
+                else:
+                    # Unbekannter Frame-Typ
+                    error = True
+                    break
+            finally:
+                payload.release()
+    finally:
+        view.release()
+    del conn.buffer[:pos]
+    return error
 
-    #Stelle sicher, dass der imagepath existiert
-    imagepath = os.path.abspath(config['imagepath'])
-    #Erstelle den Ordner, falls er nicht existiert
-    if not os.path.exists(imagepath):
-        os.makedirs(imagepath)
+
+def _process_buffer(conn, ctx):
+    """
+    Verarbeitet alle vollständigen Nachrichten im Puffer einer Verbindung.
+    Rückgabe: True, wenn die Verbindung wegen fehlerhafter Daten geschlossen werden soll.
+    """
+    while True:
+        # Nach erfolgreicher Aushandlung folgen nur noch Frames
+        if conn.framed:
+            return _process_frames(conn, ctx)
+
+        # Laufender IMG-Transfer: Rohdaten bis zur angekündigten Größe in die Datei schreiben
+        if conn.img_handle is not None:
+            taken = _write_image_data(conn, ctx, conn.buffer)
+            del conn.buffer[:taken]
+            if conn.img_handle is not None:
+                return False
+            continue
+
+        # Suche das Ende der nächsten SLCP-Zeile
+        idx = conn.buffer.find(b'\n')
+        if idx < 0:
+            # Zeile ohne Ende, die zu lang ist, wird verworfen
+            return len(conn.buffer) > MAX_LINE
+        # Lese die Zeile und dekodiere sie
+        line = conn.buffer[:idx + 1].decode('utf-8', errors='ignore')
+        del conn.buffer[:idx + 1]
+        try:
+            # Versuche, die Zeile zu parsen
+            cmd, args = parse_slcp_line(line)
+        except Exception:
+            return True
+
+        #Verarbeite die empfangene Nachricht basierend auf dem Befehl
+        if cmd == 'MSG' and len(args) >= 2:
+            # Bei MSG: Leite die Nachricht an die CLI weiter
+            ctx.queue.put(('MSG', args[0], args[1]))
+            ctx.metrics.inc('messages_received')
+            continue
+
+        #Bei IMG: Header merken, die Bilddaten folgen im Puffer
+        elif cmd == 'IMG' and len(args) == 2:
+            try:
+                size = int(args[1])
+            except ValueError:
+                return True
+            if not _start_image(conn, ctx, args[0], size):
+                return True
+            continue
+
+        # Bei HELLO: Gemeinsame Fähigkeiten aushandeln und beantworten
+        elif cmd == 'HELLO':
+            caps = parse_hello(args) & ctx.capabilities
+            try:
+                conn.sock.send(build_hello(caps))
+            except OSError:
+                return True
+            # Ab jetzt ggf. Frame-Format statt Textzeilen (und komprimierte Frames)
+            conn.framed = 'framed' in caps
+            conn.compressed = conn.framed and 'zlib' in caps
+            continue
+
+        # Unbekannte oder fehlerhafte Nachricht
+        return True
+
+
+def _receive_data(conn, ctx, data):
+    """
+    Übernimmt empfangene Bytes einer Verbindung und verarbeitet alle vollständigen Nachrichten.
+    Rückgabe: True, wenn die Verbindung wegen fehlerhafter Daten geschlossen werden soll.
+    """
+    conn.last_read = time.monotonic()
+    ctx.metrics.inc('bytes_received', len(data))
+    if conn.superseded:
+        return True
+    start = time.perf_counter()
+    conn.buffer += data
+    error = _process_buffer(conn, ctx)
+    if error:
+        ctx.metrics.inc('protocol_errors')
+    ctx.metrics.observe('process_seconds', time.perf_counter() - start)
+    return error
+
+
+def server_loop(config, net_to_interface_queue, interface_to_net_queue=None, ready=None):
+    """
+    Funktion namens `server_loop`, die den Serverprozess implementiert.
+    ready: optionales Event, das gesetzt wird, sobald der Server Verbindungen annimmt.
+    """
+
+    # Gemeinsame Einstellungen (Bildordner, Queue, Größenlimit, Worker-Pool); ImageStore legt den imagepath an
+    ctx = _ServerContext(config, net_to_interface_queue)
 
     # Setze den aktuellen Port aus der Konfiguration
     current_port = config['port']
@@ -39,16 +586,49 @@ def server_loop(config, net_to_interface_queue, interface_to_net_queue=None):
         s.bind(("", port))
         # Setze den Socket in den Listenmodus
         s.listen()
+        # Nicht-blockierend, damit der Selector alle Verbindungen bedienen kann
+        s.setblocking(False)
         return s
 
+    # Selector überwacht den Listen-Socket und alle offenen Verbindungen gleichzeitig
+    sel = selectors.DefaultSelector()
     # Binde den Socket an den aktuellen Port
     sock = bind_socket(current_port)
-    # Setze eine Timeout für den Socket, um nicht ewig zu blockieren
-    sock.settimeout(0.5)
+    sel.register(sock, selectors.EVENT_READ, data=None)
+    # Alle offenen Verbindungen: Socket -> _Connection
+    connections = {}
+    # Ergebnisse aus dem Worker-Pool (Hash einer Teildatei) werden im Thread der Schleife übernommen;
+    # ein Byte auf dem Weck-Socket beendet das Warten in select() sofort
+    completions = deque()
+    wake_recv, wake_send = socket.socketpair()
+    wake_recv.setblocking(False)
+    wake_send.setblocking(False)
+    wakeup = object()
+    sel.register(wake_recv, selectors.EVENT_READ, data=wakeup)
+
+    def call_soon(conn, fn):
+        completions.append((conn, fn))
+        try:
+            wake_send.send(b'\0')
+        except BlockingIOError:
+            # Weck-Socket ist schon voll: die Schleife wacht ohnehin auf
+            pass
+
+    ctx.call_soon = call_soon
+    if ready is not None:
+        ready.set()
+
+    def close_connection(conn):
+        """Schließt eine Verbindung und verwirft unvollständige Daten."""
+        # Abgebrochene Bildübertragungen werden nicht als (defektes) Bild gespeichert
+        conn.abort_transfer(ctx)
+        sel.unregister(conn.sock)
+        conn.sock.close()
+        del connections[conn.sock]
 
     while True:
         """
-        Endlosschleife, um auf eingehende Verbindungen zu warten
+        Endlosschleife, um auf eingehende Verbindungen und Daten zu warten
         """
         #Überprüfe, ob eine neue Portänderung angefordert wurde
         if interface_to_net_queue is not None:
@@ -61,67 +641,76 @@ def server_loop(config, net_to_interface_queue, interface_to_net_queue=None):
                     new_port = int(msg[1])
                     # Wenn der neue Port sich vom aktuellen Port unterscheidet, schließe den alten Socket und binde einen neuen Socket
                     if new_port != current_port:
+                        sel.unregister(sock)
                         sock.close()
                         # Binde den Socket an den neuen Port
                         sock = bind_socket(new_port)
-                        # Setze den Socket-Timeout zurück
-                        sock.settimeout(0.5)
-                        # Informiere die CLI über die Portänderung
+                        sel.register(sock, selectors.EVENT_READ, data=None)
                         current_port = new_port
             except queue.Empty:
                 pass
 
-        try:
-            # Warte auf eingehende Verbindungen
-            conn, _ = sock.accept()
-        except socket.timeout:
-            continue
-        with conn:
-            # Lese eine Zeile von der Verbindung
-            f = conn.makefile('rb')
-            # Lese die Zeile und dekodiere sie
-            line = f.readline().decode('utf-8', errors='ignore')
-            if not line:
+        # Warte höchstens 0,5 s auf Ereignisse, damit Portwechsel und Deadlines geprüft werden
+        for key, _ in sel.select(timeout=0.5):
+            if key.data is wakeup:
+                try:
+                    while wake_recv.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                while completions:
+                    conn, fn = completions.popleft()
+                    # Nur für Verbindungen, die noch offen sind
+                    if connections.get(conn.sock) is conn and fn():
+                        close_connection(conn)
+                continue
+            if key.data is None:
+                # Neue Verbindungen annehmen, solange welche anstehen
+                while True:
+                    try:
+                        conn_sock, addr = key.fileobj.accept()
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    conn_sock.setblocking(False)
+                    conn = _Connection(conn_sock, addr)
+                    connections[conn_sock] = conn
+                    sel.register(conn_sock, selectors.EVENT_READ, data=conn)
+                    ctx.metrics.inc('connections_accepted')
                 continue
+
+            conn = key.data
             try:
-                # Versuche, die Zeile zu parsen
-                cmd, args = parse_slcp_line(line)
-            except Exception:
+                data = conn.sock.recv(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                close_connection(conn)
                 continue
+            if not data:
+                # Gegenseite hat geschlossen; unvollständige Bilder werden verworfen
+                close_connection(conn)
+                continue
+            if _receive_data(conn, ctx, data):
+                close_connection(conn)
 
-            #Verarbeite die empfangene Nachricht basierend auf dem Befehl
-            if cmd == 'MSG' and len(args) >= 2:
-                # Bei MSG: Leite die Nachricht an die CLI weiter
-                from_handle = args[0]
-                text = args[1]
-                # Füge den Rest der Nachricht (falls vorhanden) zusammen
-                net_to_interface_queue.put(('MSG', from_handle, text))
-
-            #Bei IMG: Lese den Header und die Bilddaten
-            elif cmd == 'IMG' and len(args) == 2:
-                # Lese den Header und die Bilddaten
-                from_handle = args[0]
-                # Lese die Größe des Bildes
-                size = int(args[1])
-                # Lese die Bilddaten aus der Verbindung
-                img_data = f.read(size)
-                # Wenn die Bilddaten nicht die erwartete Größe haben, ignoriere die Nachricht
-                filename = f"{from_handle}_{int(time.time())}.jpg"
-                # Speichere das Bild im angegebenen Verzeichnis
-                filepath = os.path.join(imagepath, filename)
-                # Überprüfe, ob die empfangenen Bilddaten die erwartete Größe haben
-                with open(filepath, 'wb') as imgf:
-                    imgf.write(img_data)
-                # Füge den Pfad des gespeicherten Bildes zur Queue hinzu
-                net_to_interface_queue.put(('IMG', from_handle, filepath))
+        # Verbindungen schließen, deren Lese-Deadline bzw. Leerlaufzeit abgelaufen ist
+        now = time.monotonic()
+        expired = [c for c in connections.values() if c.expired(now, ctx)]
+        for conn in expired:
+            ctx.metrics.inc('connections_expired')
+            close_connection(conn)
+
+        # Regelmäßig Momentanwerte erfassen und einen Schnappschuss an die Oberfläche schicken
+        ctx.publish_stats(len(connections))
 
 """
 Test Main-Funktion zum Testen des Servers
 
 if __name__ == '__main__':
-    config = toml.load('config.toml')
+    from startup import load_config
+    config = load_config('config.toml')
     from multiprocessing import Queue
     q1 = Queue()
     q2 = Queue()
     server_loop(config, q1, q2)
-"""
\ No newline at end of file
+"""
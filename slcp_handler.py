@@ -1,10 +1,14 @@
 # File: slcp_handler.py
 
+import hashlib
+import struct
+import zlib
+
 """
 @file slcp_handler.py
 @brief SLCP (Simple LAN Chat Protocol) Handler
 
-Bietet Funktionen, um SLCP-Text-Befehle (JOIN, LEAVE, WHO, KNOWUSERS, MSG, IMG)
+Bietet Funktionen, um SLCP-Text-Befehle (JOIN, LEAVE, ALIVE, WHO, KNOWUSERS, MSG, IMG)
 aufzubauen und einzeln zu parsen.
 Als erstes werden Methoden erstellt, die Nachrichten im SLCP-Format formatieren. 
 Die letzte Methode `parse_slcp_line` parst eine einzelne SLCP-Zeile in Befehl und Argumente.
@@ -16,6 +20,10 @@ Das umwandeln der Strings in Bytes erfolgt mit der `.encode`-Methode, die einen
 Jede Methode hat als Rückgabewert das finale Format der SLCP Nachricht als Bytes. 
 """
 
+# Standardwert: maximale Größe einer KNOWUSERS-Seite in Bytes. Bei einer MTU von 1500 Bytes
+# bleiben nach IP- (20) und UDP-Header (8) 1472 Bytes, sodass keine IP-Fragmentierung entsteht.
+KNOWUSERS_PAGE_SIZE = 1400
+
 def build_join(handle: str, port: int) -> bytes:    # Da .encode ein Byte Objekt erzeugt wird hier der Rückgabetyp als bytes angegeben.
     """Erzeugt eine JOIN-Nachricht."""
     return f"JOIN {handle} {port}\n".encode('utf-8')
@@ -24,9 +32,33 @@ def build_leave(handle: str) -> bytes:
     """Erzeugt eine LEAVE-Nachricht."""
     return f"LEAVE {handle}\n".encode('utf-8')  # Das f am Rückgabewert steht für 'formated String' und ermöglicht es, Variablen direkt in den String einzufügen.
 
-def build_who() -> bytes:
-    """Erzeugt eine WHO-Nachricht."""
-    return b"WHO\n"  # Das b vor dem String kennzeichnet, dass es sich um Bytes handelt. Hier werden keine Variablen eingefügt, daher ist kein f notwendig.
+def build_alive(handle: str, port: int) -> bytes:
+    """Erzeugt eine ALIVE-Nachricht (Heartbeat), mit der ein Peer regelmäßig zeigt, dass er noch erreichbar ist."""
+    return f"ALIVE {handle} {port}\n".encode('utf-8')
+
+def build_caps(handle: str, capabilities) -> bytes:
+    """
+    Erzeugt eine CAPS-Nachricht, mit der ein Peer seine Discovery-Fähigkeiten (z. B. zlib) bekannt gibt.
+    Ältere Peers kennen CAPS nicht und ignorieren die Nachricht.
+    """
+    return f"CAPS {handle} {','.join(sorted(capabilities))}\n".encode('utf-8')
+
+def build_who(peers: dict = None) -> bytes:
+    """
+    Erzeugt eine WHO-Nachricht. Mit peers (der eigenen Sicht handle -> (host, port)) lautet sie
+    "WHO <anzahl> <digest>": Peers mit derselben Sicht müssen dann nicht antworten.
+    """
+    if peers is None:
+        return b"WHO\n"  # Das b vor dem String kennzeichnet, dass es sich um Bytes handelt. Hier werden keine Variablen eingefügt, daher ist kein f notwendig.
+    return f"WHO {len(peers)} {peer_digest(peers)}\n".encode('utf-8')
+
+def peer_digest(peers: dict) -> str:
+    """
+    Kurzer, von der Reihenfolge unabhängiger Fingerabdruck einer Peerliste (handle -> (host, port)).
+    Zwei Peers mit demselben Digest kennen dieselben Einträge.
+    """
+    entries = sorted(f"{h}:{host}:{port}" for h, (host, port) in peers.items())
+    return hashlib.sha1("\n".join(entries).encode('utf-8')).hexdigest()[:16]
 
 """
 Aus einer Datenstruktur (Dictionary) wird ein formatierter String erzeugt, der dann per Netzwerk versendet wird. 
@@ -47,6 +79,68 @@ def build_knowusers(peers: dict) -> bytes:
     payload = ",".join(parts)                       # Verbindet alle formatierten Strings in der Liste mit einem Komma.
     return f"KNOWUSERS {payload}\n".encode('utf-8') # Hier wird wieder das f für 'formated String' verwendet, um den finalen String zu erstellen, der dann in Bytes umgewandelt wird.
 
+"""
+Bei großen Peerlisten passt KNOWUSERS nicht mehr in ein einzelnes Datagramm. Die Liste wird daher
+auf mehrere Seiten verteilt, die jeweils höchstens max_size Bytes groß sind.
+Nur wenn mehr als eine Seite nötig ist, trägt jede Seite eine Markierung <seite>/<gesamt>,
+z. B. "KNOWUSERS 2/5 alice:10.0.0.2:5001,...". Eine einzelne Seite bleibt im ursprünglichen Format
+"KNOWUSERS <liste>", damit auch Knoten ohne Seitenunterstützung sie verstehen.
+Jede Seite ist für sich vollständig und kann sofort beim Empfang übernommen werden.
+"""
+
+def build_knowusers_pages(peers: dict, max_size: int = KNOWUSERS_PAGE_SIZE) -> list:
+    """
+    Erzeugt eine Liste von KNOWUSERS-Seiten (bytes), von denen keine größer als max_size ist.
+    Eine leere Peerliste ergibt genau eine leere Seite.
+    """
+    # Platz für "KNOWUSERS 9999/9999 " und den Zeilenumbruch reservieren
+    budget = max_size - len("KNOWUSERS 9999/9999 \n")
+    pages = []
+    current = []
+    size = 0
+    for h, (host, port) in peers.items():
+        entry = f"{h}:{host}:{port}"
+        # +1 für das trennende Komma
+        length = len(entry.encode('utf-8')) + (1 if current else 0)
+        if current and size + length > budget:
+            pages.append(current)
+            current = []
+            length -= 1
+            size = 0
+        current.append(entry)
+        size += length
+    pages.append(current)
+    total = len(pages)
+    if total == 1:
+        # Passt in ein Datagramm: ohne Markierung (kompatibel zu älteren Knoten)
+        return [f"KNOWUSERS {','.join(pages[0])}\n".encode('utf-8')]
+    return [f"KNOWUSERS {i}/{total} {','.join(page)}\n".encode('utf-8') for i, page in enumerate(pages, 1)]
+
+def parse_knowusers(args: list):
+    """
+    Zerlegt die Argumente einer KNOWUSERS-Nachricht (mit oder ohne Seitenmarkierung).
+    Rückgabe: (seite, gesamt, [(handle, host, port), ...]); ohne Markierung ist seite = gesamt = 1.
+    Fehlerhafte Einträge werden übersprungen.
+    """
+    seq, total = 1, 1
+    payload = args[0] if args else ''
+    # Seitenmarkierung "<seite>/<gesamt>" vor den Einträgen erkennen (Einträge enthalten immer ':')
+    if args and '/' in args[0] and ':' not in args[0]:
+        try:
+            seq, total = (int(x) for x in args[0].split('/'))
+            # Eine leere Seite besteht nur aus der Markierung
+            payload = args[1] if len(args) > 1 else ''
+        except ValueError:
+            pass
+    entries = []
+    for entry in payload.split(',') if payload else []:
+        try:
+            h, host, port_str = entry.split(':')
+            entries.append((h, host, int(port_str)))
+        except ValueError:
+            continue
+    return seq, total, entries
+
 def build_msg(from_handle: str, text: str) -> bytes:
     """Erzeugt eine MSG-Nachricht."""
     return f"MSG {from_handle} {text}\n".encode('utf-8')
@@ -69,4 +163,150 @@ def parse_slcp_line(line: str):
     tokens = line.strip().split(' ', 2)              # Entfernt führende und nachgestellte Leerzeichen oder Zeilenumbrüche und trennt die Zeile an maximal zwei Leerzeichen, sodass am Ende maximal 3 Teile entstehen
     cmd = tokens[0]                          # Der Befehl ist das erste Element der Liste 
     args = tokens[1:] if len(tokens) > 1 else []     # Hier wird geprüft ob die Nachricht mehr als ein Element hat, wenn ja, wird alles außer dem ersten Element als Argumente genommen, ansonsten ist die Liste leer.
-    return cmd, args                  # Ausgabe des Tupels, Beispiel der Ausgabe: "JOIN", ["Alice", "5000"]
\ No newline at end of file
+    return cmd, args                  # Ausgabe des Tupels, Beispiel der Ausgabe: "JOIN", ["Alice", "5000"]
+
+"""
+Optionales binäres SLCP-Format (Framing) für TCP-Verbindungen:
+Jede Nachricht besteht aus einem Typ-Byte, einer 4-Byte-Länge (Big Endian) und den Nutzdaten.
+Dadurch ist die Grenze zwischen Nachrichten unabhängig vom Inhalt – Nachrichten dürfen also auch
+Zeilenumbrüche enthalten – und der Empfänger kann viele Nachrichten aus einem einzigen recv()
+direkt aus einem memoryview herauslesen, ohne zeilenweise zu dekodieren.
+
+Das Format wird pro Verbindung ausgehandelt: Der Client sendet als erste Zeile "HELLO <fähigkeiten>",
+der Server antwortet mit "HELLO <gemeinsame fähigkeiten>". Enthält die Antwort "framed", sind alle
+folgenden Nachrichten auf dieser Verbindung Frames. Ältere Server kennen HELLO nicht und schließen
+die Verbindung; der Client bleibt dann beim Textformat.
+"""
+
+# Frame-Typen
+FRAME_MSG = 1  # Nutzdaten: <handle>\0<text> (UTF-8)
+FRAME_IMG = 2  # Nutzdaten: <größe als 8-Byte-Zahl><handle>; danach folgen <größe> Rohbytes des Bildes
+FRAME_MSG_Z = 3  # Nutzdaten wie FRAME_MSG, aber zlib-komprimiert (nur nach Aushandlung von "zlib" per HELLO)
+FRAME_IMG_RESUME = 4  # Nutzdaten: <größe 8 Bytes><SHA-256 32 Bytes><handle>; Antwort "OFFSET <n>", dann Bytes ab n
+
+# Typ-Byte und Länge der Nutzdaten
+_FRAME_HEADER = struct.Struct('>BI')
+_IMG_SIZE = struct.Struct('>Q')
+_IMG_RESUME = struct.Struct('>Q32s')
+
+def build_hello(capabilities) -> bytes:
+    """Erzeugt eine HELLO-Nachricht mit den (kommagetrennten) unterstützten Fähigkeiten."""
+    return f"HELLO {','.join(sorted(capabilities))}\n".encode('utf-8')
+
+def parse_hello(args: list) -> set:
+    """Liefert die Menge der Fähigkeiten aus den Argumenten einer HELLO-Nachricht."""
+    return {cap for cap in args[0].split(',') if cap} if args else set()
+
+def encode_frame(frame_type: int, payload: bytes) -> bytes:
+    """Erzeugt einen Frame aus Typ und Nutzdaten."""
+    return _FRAME_HEADER.pack(frame_type, len(payload)) + payload
+
+def msg_frame_payload(from_handle: str, text: str) -> bytes:
+    """Nutzdaten eines MSG-Frames (unkomprimiert)."""
+    return from_handle.encode('utf-8') + b'\0' + text.encode('utf-8')
+
+def build_msg_frame(from_handle: str, text: str) -> bytes:
+    """Erzeugt eine MSG-Nachricht im Frame-Format."""
+    return encode_frame(FRAME_MSG, msg_frame_payload(from_handle, text))
+
+def build_img_frame(from_handle: str, size: int) -> bytes:
+    """Erzeugt einen IMG-Header im Frame-Format; die Bilddaten folgen direkt danach."""
+    return encode_frame(FRAME_IMG, _IMG_SIZE.pack(size) + from_handle.encode('utf-8'))
+
+def build_img_resume_frame(from_handle: str, size: int, digest: str) -> bytes:
+    """
+    Erzeugt den Kopf einer fortsetzbaren Bildübertragung (nach Aushandlung von "resume" per HELLO).
+    digest (SHA-256 des Inhalts, hex) ist zugleich die Transfer-ID und die Prüfsumme.
+    """
+    return encode_frame(FRAME_IMG_RESUME, _IMG_RESUME.pack(size, bytes.fromhex(digest)) + from_handle.encode('utf-8'))
+
+def decode_img_resume_frame(payload: memoryview):
+    """
+    Zerlegt die Nutzdaten eines IMG_RESUME-Frames in (handle, größe, digest als hex).
+    Wirft ValueError, wenn sie zu kurz sind.
+    """
+    if len(payload) < _IMG_RESUME.size:
+        raise ValueError("IMG_RESUME-Frame zu kurz")
+    size, digest = _IMG_RESUME.unpack_from(payload, 0)
+    return str(payload[_IMG_RESUME.size:], 'utf-8', errors='ignore'), size, digest.hex()
+
+def build_offset(offset: int) -> bytes:
+    """Antwort des Empfängers auf IMG_RESUME: ab diesem Byte fehlen die Bilddaten noch."""
+    return f"OFFSET {offset}\n".encode('utf-8')
+
+def build_ack(ok: bool) -> bytes:
+    """Abschluss einer fortsetzbaren Übertragung: ACK (Prüfsumme stimmt) oder NAK (verworfen)."""
+    return b"ACK\n" if ok else b"NAK\n"
+
+def parse_frame(view: memoryview, offset: int = 0):
+    """
+    Liest einen Frame ab Position offset aus einem memoryview, ohne Daten zu kopieren.
+    Rückgabe: (typ, nutzdaten als memoryview, position nach dem frame) oder None,
+    falls der Frame noch nicht vollständig empfangen wurde.
+    Der zurückgegebene memoryview muss freigegeben werden, bevor der Puffer verändert wird.
+    """
+    if len(view) - offset < _FRAME_HEADER.size:
+        return None
+    frame_type, length = _FRAME_HEADER.unpack_from(view, offset)
+    start = offset + _FRAME_HEADER.size
+    end = start + length
+    if len(view) < end:
+        return None
+    return frame_type, view[start:end], end
+
+def frame_length(view: memoryview, offset: int = 0):
+    """Liefert die angekündigte Nutzdatenlänge des Frames ab offset oder None, falls der Kopf fehlt."""
+    if len(view) - offset < _FRAME_HEADER.size:
+        return None
+    return _FRAME_HEADER.unpack_from(view, offset)[1]
+
+def decode_msg_frame(payload: memoryview):
+    """Zerlegt die Nutzdaten eines MSG-Frames in (handle, text)."""
+    handle, _, text = bytes(payload).partition(b'\0')
+    return handle.decode('utf-8', errors='ignore'), text.decode('utf-8', errors='ignore')
+
+def decode_img_frame(payload: memoryview):
+    """Zerlegt die Nutzdaten eines IMG-Frames in (handle, größe). Wirft ValueError, wenn sie zu kurz sind."""
+    if len(payload) < _IMG_SIZE.size:
+        raise ValueError("IMG-Frame zu kurz")
+    size, = _IMG_SIZE.unpack_from(payload, 0)
+    return str(payload[_IMG_SIZE.size:], 'utf-8', errors='ignore'), size
+
+"""
+Optionale Kompression (zlib aus der Standardbibliothek):
+Nutzdaten ab COMPRESS_THRESHOLD Bytes werden komprimiert, aber nur, wenn die Gegenseite das
+unterstützt – per HELLO "zlib" auf TCP-Verbindungen (Frame FRAME_MSG_Z) bzw. per CAPS in der
+Discovery (Datagramm "KNOWUSERSZ " + zlib-Daten einer KNOWUSERS-Zeile). Wird das Ergebnis nicht
+kleiner, bleibt es beim Original. Beim Entpacken wird die Größe begrenzt, damit ein kleines Paket
+nicht beliebig viel Speicher belegen kann.
+"""
+
+# Standardwert: Nutzdaten ab dieser Größe (in Bytes) werden komprimiert (0 = nie)
+COMPRESS_THRESHOLD = 512
+# Kompressionsstufe: schnell, bei den sich wiederholenden SLCP-Inhalten trotzdem wirksam
+COMPRESS_LEVEL = 6
+# Präfix eines komprimierten KNOWUSERS-Datagramms
+KNOWUSERS_Z_PREFIX = b"KNOWUSERSZ "
+
+def compress_payload(payload: bytes, threshold: int = COMPRESS_THRESHOLD):
+    """Liefert die zlib-komprimierten Nutzdaten oder None (zu klein, abgeschaltet oder nicht kleiner)."""
+    if not threshold or len(payload) < threshold:
+        return None
+    packed = zlib.compress(payload, COMPRESS_LEVEL)
+    return packed if len(packed) < len(payload) else None
+
+def decompress_payload(packed, limit: int) -> bytes:
+    """Entpackt zlib-Daten; wirft ValueError bei defekten Daten oder mehr als limit Bytes Ergebnis."""
+    inflater = zlib.decompressobj()
+    try:
+        data = inflater.decompress(packed, limit + 1)
+    except zlib.error as e:
+        raise ValueError(str(e))
+    if len(data) > limit or not inflater.eof:
+        raise ValueError("komprimierte Nutzdaten zu groß oder unvollständig")
+    return data
+
+def compress_knowusers(page: bytes, threshold: int = COMPRESS_THRESHOLD):
+    """Komprimiert eine KNOWUSERS-Seite zu einem KNOWUSERSZ-Datagramm oder liefert None."""
+    packed = compress_payload(page, threshold)
+    return KNOWUSERS_Z_PREFIX + packed if packed is not None else None
@@ -0,0 +1,58 @@
+# File: startup.py
+
+import time
+
+"""
+@file startup.py
+@brief Schneller Startpfad: Konfiguration laden und Startzeiten messen.
+
+- load_config() liest config.toml mit dem in Python >= 3.11 eingebauten tomllib und greift
+  nur auf älteren Versionen auf das externe toml-Paket zurück.
+- PROFILE misst mit main.py --startup-profile die Zeit ab dem Start von main.py bis zu
+  einzelnen Schritten (Konfiguration, Prozesse bereit, Oberfläche geladen, erstes JOIN)
+  und gibt sie sofort aus. Ohne --startup-profile kostet mark() nur einen Vergleich.
+"""
+
+# Bezugszeitpunkt: Import dieses Moduls (als Erstes in main.py)
+_T0 = time.perf_counter()
+
+
+def load_config(path='config.toml'):
+    """Lädt die TOML-Konfiguration als Dictionary."""
+    try:
+        import tomllib
+    except ModuleNotFoundError:
+        # Python < 3.11: externes Paket verwenden
+        import toml
+        return toml.load(path)
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+
+class StartupProfile:
+    """Gibt die Zeit seit dem Start für benannte Schritte aus, wenn eingeschaltet."""
+
+    def __init__(self):
+        self.enabled = False
+        self._last = _T0
+        # Bereits gemeldete Schritte für mark_once()
+        self._seen = set()
+
+    def mark(self, label):
+        """Gibt Gesamtzeit und Zeit seit dem vorherigen Schritt aus."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        print(f"[Startup] {(now - _T0) * 1000:8.1f} ms  (+{(now - self._last) * 1000:7.1f} ms)  {label}")
+        self._last = now
+
+    def mark_once(self, label):
+        """Wie mark(), aber jeder Schritt wird nur beim ersten Mal ausgegeben."""
+        if not self.enabled or label in self._seen:
+            return
+        self._seen.add(label)
+        self.mark(label)
+
+
+# Startmessung des aktuellen Prozesses
+PROFILE = StartupProfile()
@@ -0,0 +1,116 @@
+# File: thumbnails.py
+
+import hashlib
+import os
+import queue
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+"""
+@file thumbnails.py
+@brief Vorschaubilder für die GUI: Dekodieren im Hintergrund mit dauerhaftem Cache.
+
+- request(path, size) gibt das Dekodieren und Verkleinern an einen Worker-Thread ab; der
+  Tk-Hauptthread blockiert nie auf Image.open()/thumbnail().
+- Fertige Vorschauen (PIL-Bilder) holt die GUI in ihrem Poll-Tick mit ready() ab und erzeugt
+  erst dort das PhotoImage (Tk-Objekte dürfen nur im Hauptthread angelegt werden).
+- Jede Vorschau wird als PNG unter <thumbnail_dir>/<sha256>_<size>.png gespeichert. Bilder aus
+  der Bildablage (image_store) tragen ihren Hash bereits im Namen, andere werden gehasht.
+  Dasselbe Bild in derselben Größe wird so nur einmal dekodiert, auch über Neustarts hinweg;
+  eine neue Größe nach dem Skalieren des Fensters erzeugt eine eigene Vorschau.
+"""
+
+# Standardwert: Verzeichnis des Vorschau-Caches
+THUMBNAIL_DIR = "./thumbnails"
+# Anzahl der Threads, die Vorschauen dekodieren
+THUMBNAIL_WORKERS = 2
+
+# Dateiname der Bildablage: Hash steht bereits im Namen
+_STORE_NAME = re.compile(r'^([0-9a-f]{64})\.jpg$')
+
+
+def _content_hash(path):
+    """SHA-256 des Dateiinhalts (aus dem Namen, wenn die Datei aus der Bildablage stammt)."""
+    match = _STORE_NAME.match(os.path.basename(path))
+    if match:
+        return match.group(1)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ThumbnailCache:
+    """Erzeugt Vorschaubilder im Hintergrund und speichert sie dauerhaft."""
+
+    def __init__(self, directory=THUMBNAIL_DIR, workers=THUMBNAIL_WORKERS):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        # Fertige Ergebnisse (path, size, PIL-Bild oder None) für den Hauptthread
+        self._results = queue.Queue()
+        # (path, size) der laufenden Aufträge; doppelte Anfragen werden zusammengefasst
+        self._in_flight = set()
+
+    def request(self, path, size):
+        """Fordert die Vorschau von path in der Größe size an (Ergebnis später über ready())."""
+        key = (path, size)
+        if key in self._in_flight:
+            return
+        self._in_flight.add(key)
+        self._pool.submit(self._work, path, size)
+
+    def ready(self):
+        """Liefert alle seit dem letzten Aufruf fertigen Vorschauen als [(path, size, Bild oder None)]."""
+        done = []
+        while True:
+            try:
+                path, size, image = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._in_flight.discard((path, size))
+            done.append((path, size, image))
+        return done
+
+    def close(self):
+        """Beendet die Worker, ohne auf ausstehende Aufträge zu warten."""
+        self._pool.shutdown(wait=False)
+
+    def _work(self, path, size):
+        """Worker-Thread: Vorschau aus dem Cache laden oder erzeugen; None bei Fehlern."""
+        try:
+            image = self._load(path, size)
+        except Exception:
+            image = None
+        self._results.put((path, size, image))
+
+    def _load(self, path, size):
+        """Liest die Vorschau aus dem Cache bzw. dekodiert das Bild und legt sie dort ab."""
+        cached = os.path.join(self.directory, f"{_content_hash(path)}_{size}.png")
+        try:
+            with Image.open(cached) as img:
+                img.load()
+                return img.copy()
+        except OSError:
+            # Noch nicht im Cache (oder Cache-Datei defekt): neu erzeugen
+            pass
+        with Image.open(path) as img:
+            # JPEG: direkt in reduzierter Auflösung dekodieren (deutlich schneller als volle Größe)
+            img.draft('RGB', (size, size))
+            img.thumbnail((size, size))
+            if img.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+                img = img.convert('RGB')
+            thumb = img.copy()
+        # Atomar ablegen, damit ein abgebrochener Schreibvorgang keinen defekten Cache hinterlässt
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                thumb.save(f, format='PNG')
+            os.replace(tmp, cached)
+        except OSError:
+            # Cache nicht beschreibbar: Vorschau trotzdem anzeigen
+            os.unlink(tmp)
+        return thumb